@@ -0,0 +1,232 @@
+# /backend/app/api/admision.py
+"""
+Control de admisión y descarte de carga para /api/clasificar-producto.
+
+Sin límite, en un pico las requests se apilan detrás de los hilos con su cuerpo
+(base64) ya leído en memoria y terminan todas por timeout. Con este middleware
+ASGI, que corre antes de leer el cuerpo:
+
+- A lo sumo ``max_en_curso`` requests se procesan a la vez.
+- Hasta ``max_cola`` más esperan un lugar, como máximo ``espera_ms``. Si no lo
+  consiguen reciben 503; si la cola ya está llena, 429 al instante. En ambos
+  casos va un ``Retry-After`` estimado con el tiempo de servicio reciente.
+- Cada request admitida lleva un plazo (ADMISION_PLAZO_MS, o menor con el header
+  ``X-Plazo-Ms``) en un contextvar. Las etapas lo consultan con
+  ``verificar_plazo()`` y el programador de lotes descarta los tensores vencidos:
+  el trabajo que ya nadie espera no llega a la inferencia ni a la subida.
+
+/api/registro-lote tiene su propio control (``obtener_control_lotes``): pocos
+lotes a la vez (LOTE_ADMISION_*) y sin plazo, porque cientos de ítems no entran
+en el de una request suelta y no deben quitarle lugares a los escaneos.
+"""
+import asyncio
+import contextvars
+import json
+import math
+import time
+from collections import deque
+from typing import Callable, Optional
+
+from .config import settings
+
+# Instante (time.monotonic) en que vence la request en curso; None = sin plazo
+_plazo: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("plazo_request", default=None)
+
+
+class Sobrecarga(Exception):
+    """El servidor no puede atender la request a tiempo (se responde con Retry-After)."""
+
+    def __init__(self, message: str, status: int = 503, retry_after: int = 1):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class PlazoVencido(Sobrecarga):
+    def __init__(self, etapa: str = ""):
+        super().__init__(f"Plazo de la request vencido{f' antes de {etapa}' if etapa else ''}.", 503, 1)
+
+
+def plazo_actual() -> Optional[float]:
+    return _plazo.get()
+
+
+def vencido(plazo: Optional[float]) -> bool:
+    return plazo is not None and time.monotonic() >= plazo
+
+
+def verificar_plazo(etapa: str = ""):
+    """Lanza PlazoVencido si la request en curso ya superó su plazo."""
+    if vencido(_plazo.get()):
+        obtener_control_admision().vencidas += 1
+        raise PlazoVencido(etapa)
+
+
+class ControlAdmision:
+    def __init__(
+        self,
+        max_en_curso: int = settings.ADMISION_MAX_EN_CURSO,
+        max_cola: int = settings.ADMISION_MAX_COLA,
+        espera_ms: int = settings.ADMISION_ESPERA_MS,
+        plazo_ms: int = settings.ADMISION_PLAZO_MS,
+    ):
+        self.max_en_curso = max(1, max_en_curso)
+        self.max_cola = max(0, max_cola)
+        self.espera = max(0, espera_ms) / 1000
+        self.plazo = max(0, plazo_ms) / 1000
+        self.en_curso = 0
+        # Futuros de las requests que esperan lugar, en orden de llegada
+        self._cola: deque = deque()
+        # Tiempo de servicio (media móvil exponencial) para estimar Retry-After
+        self.servicio_medio_s = 0.5
+        self.admitidas = 0
+        self.rechazadas_cola_llena = 0
+        self.rechazadas_espera = 0
+        self.vencidas = 0
+        self.cola_max_observada = 0
+
+    def retry_after(self) -> int:
+        """Segundos hasta que probablemente se libere lugar para una request nueva."""
+        tandas = (len(self._cola) + 1) / self.max_en_curso
+        return max(1, min(60, math.ceil(self.servicio_medio_s * tandas)))
+
+    async def entrar(self, plazo: Optional[float]):
+        """Toma un lugar (esperando si hace falta) o lanza Sobrecarga."""
+        if self.en_curso < self.max_en_curso and not self._cola:
+            self.en_curso += 1
+            self.admitidas += 1
+            return
+
+        if len(self._cola) >= self.max_cola:
+            self.rechazadas_cola_llena += 1
+            raise Sobrecarga("Servidor saturado: demasiadas requests en espera.", 429, self.retry_after())
+
+        espera = self.espera
+        if plazo is not None:
+            espera = min(espera, plazo - time.monotonic())
+        futuro = asyncio.get_running_loop().create_future()
+        self._cola.append(futuro)
+        self.cola_max_observada = max(self.cola_max_observada, len(self._cola))
+        try:
+            await asyncio.wait_for(futuro, max(0.0, espera))
+        except asyncio.TimeoutError:
+            self.rechazadas_espera += 1
+            raise Sobrecarga("Servidor saturado: no se liberó lugar a tiempo.", 503, self.retry_after())
+        except BaseException:
+            # Cliente desconectado mientras esperaba: si ya le habían pasado el lugar, se devuelve
+            if futuro.done() and not futuro.cancelled():
+                self.salir()
+            raise
+        finally:
+            if futuro in self._cola:
+                self._cola.remove(futuro)
+        self.admitidas += 1
+
+    def salir(self, duracion_s: Optional[float] = None):
+        """Libera el lugar: pasa directo a la primera request en espera, si hay."""
+        if duracion_s is not None:
+            self.servicio_medio_s = 0.9 * self.servicio_medio_s + 0.1 * duracion_s
+        while self._cola:
+            futuro = self._cola.popleft()
+            if not futuro.done():
+                futuro.set_result(None)
+                return
+        self.en_curso -= 1
+
+    def estadisticas(self) -> dict:
+        return {
+            "en_curso": self.en_curso,
+            "max_en_curso": self.max_en_curso,
+            "en_cola": len(self._cola),
+            "max_cola": self.max_cola,
+            "cola_max_observada": self.cola_max_observada,
+            "admitidas": self.admitidas,
+            "rechazadas_cola_llena": self.rechazadas_cola_llena,
+            "rechazadas_espera": self.rechazadas_espera,
+            "vencidas": self.vencidas,
+            "servicio_medio_ms": round(self.servicio_medio_s * 1000, 1),
+        }
+
+
+class MiddlewareAdmision:
+    """Middleware ASGI: aplica el ControlAdmision a los POST de las rutas indicadas."""
+
+    def __init__(
+        self, app, rutas: tuple = ("/api/clasificar-producto",), obtener_control: Optional[Callable] = None
+    ):
+        self.app = app
+        self.rutas = rutas
+        # Por defecto el control compartido de los escaneos (ver obtener_control_admision)
+        self.obtener_control = obtener_control
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith(self.rutas):
+            await self.app(scope, receive, send)
+            return
+
+        control = (self.obtener_control or obtener_control_admision)()
+        plazo = _plazo_de_la_request(scope, control)
+        try:
+            await control.entrar(plazo)
+        except Sobrecarga as e:
+            await responder_sobrecarga(send, e)
+            return
+
+        token = _plazo.set(plazo)
+        inicio = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _plazo.reset(token)
+            control.salir(time.monotonic() - inicio)
+
+
+def _plazo_de_la_request(scope, control: ControlAdmision) -> Optional[float]:
+    plazo_s = control.plazo or None
+    for nombre, valor in scope["headers"]:
+        if nombre == b"x-plazo-ms" and valor.isdigit():
+            pedido = int(valor) / 1000
+            plazo_s = min(plazo_s, pedido) if plazo_s else pedido
+    return time.monotonic() + plazo_s if plazo_s else None
+
+
+async def responder_sobrecarga(send, error: Sobrecarga):
+    cuerpo = json.dumps({"detail": str(error)}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": error.status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(cuerpo)).encode()),
+            (b"retry-after", str(error.retry_after).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": cuerpo})
+
+
+# ------------------------------
+# INSTANCIA POR WORKER
+# ------------------------------
+_control: Optional[ControlAdmision] = None
+
+
+def obtener_control_admision() -> ControlAdmision:
+    global _control
+    if _control is None:
+        _control = ControlAdmision(
+            settings.ADMISION_MAX_EN_CURSO, settings.ADMISION_MAX_COLA,
+            settings.ADMISION_ESPERA_MS, settings.ADMISION_PLAZO_MS,
+        )
+    return _control
+
+
+_control_lotes: Optional[ControlAdmision] = None
+
+
+def obtener_control_lotes() -> ControlAdmision:
+    global _control_lotes
+    if _control_lotes is None:
+        _control_lotes = ControlAdmision(
+            settings.LOTE_ADMISION_MAX_EN_CURSO, settings.LOTE_ADMISION_MAX_COLA, settings.ADMISION_ESPERA_MS, 0,
+        )
+    return _control_lotes
@@ -0,0 +1,199 @@
+# /backend/app/api/almacen_imagenes.py
+"""
+Nombres por contenido para las imágenes del bucket ``imagenes``.
+
+Cada imagen se guarda como ``<sha256 de los bytes>.jpeg`` (y sus variantes como
+``<sha256>_<variante>.<ext>``): dos escaneos con la misma foto apuntan a los
+mismos objetos y la segunda subida se puede omitir. Cada
+worker recuerda (LRU acotado) los nombres que ya sabe que existen en el bucket.
+Si no lo sabe, sube sin ``upsert`` y un 409 "Duplicate" del Storage significa
+que otro worker ya la había subido.
+
+Como un mismo objeto puede estar referenciado por varios productos, la API nunca
+borra imágenes; los huérfanos se limpian fuera de línea con ``migrar_imagenes.py``.
+"""
+import asyncio
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from .config import settings
+from .preprocesamiento import ImagenDecodificada
+from .variantes_imagen import formato_variantes, generar_variantes, nombres_variantes
+
+BUCKET_IMAGENES = "imagenes"
+
+_NOMBRE_POR_CONTENIDO = re.compile(r"^[0-9a-f]{64}(_[a-z]+)?\.(jpeg|webp)$")
+
+
+def hash_contenido(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def nombre_por_contenido(image_bytes: bytes) -> str:
+    return f"{hash_contenido(image_bytes)}.jpeg"
+
+
+def es_nombre_por_contenido(file_name: str) -> bool:
+    return bool(_NOMBRE_POR_CONTENIDO.match(file_name))
+
+
+def es_duplicado(error: Exception) -> bool:
+    """True si el Storage rechazó la subida porque el objeto ya existe."""
+    status = str(getattr(error, "status", "") or getattr(error, "statusCode", ""))
+    code = str(getattr(error, "code", ""))
+    return status == "409" or code == "Duplicate" or "already exists" in str(error)
+
+
+class IndiceImagenes:
+    def __init__(self, max_entradas: int = settings.IMAGENES_CONOCIDAS_MAX):
+        self.max_entradas = max(1, max_entradas)
+        self._lock = threading.Lock()
+        self._nombres: "OrderedDict[str, None]" = OrderedDict()
+        self.subidas = 0
+        self.omitidas = 0
+        self.duplicadas = 0
+
+    def contiene(self, file_name: str) -> bool:
+        with self._lock:
+            if file_name not in self._nombres:
+                return False
+            self._nombres.move_to_end(file_name)
+            self.omitidas += 1
+            return True
+
+    def agregar(self, file_name: str, nuevo: bool):
+        with self._lock:
+            if nuevo:
+                self.subidas += 1
+            else:
+                self.duplicadas += 1
+            self._nombres[file_name] = None
+            self._nombres.move_to_end(file_name)
+            while len(self._nombres) > self.max_entradas:
+                self._nombres.popitem(last=False)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "conocidas": len(self._nombres),
+                "max_entradas": self.max_entradas,
+                "subidas": self.subidas,
+                "omitidas": self.omitidas,
+                "duplicadas": self.duplicadas,
+            }
+
+
+# ------------------------------
+# INSTANCIA POR WORKER
+# ------------------------------
+_indice: Optional[IndiceImagenes] = None
+_indice_lock = threading.Lock()
+
+
+def obtener_indice_imagenes() -> IndiceImagenes:
+    global _indice
+    if _indice is None:
+        with _indice_lock:
+            if _indice is None:
+                _indice = IndiceImagenes(settings.IMAGENES_CONOCIDAS_MAX)
+    return _indice
+
+
+# ------------------------------
+# SUBIDA
+# ------------------------------
+def subir_objeto(bucket, file_name: str, contenido: bytes, content_type: str) -> bool:
+    """Sube un objeto nombrado por contenido; devuelve False si ya estaba en el bucket."""
+    indice = obtener_indice_imagenes()
+    if indice.contiene(file_name):
+        return False
+    try:
+        if settings.IMAGENES_VERIFICAR_EXISTENCIA and bucket.exists(file_name):
+            nuevo = False
+        else:
+            bucket.upload(file_name, contenido, {"content-type": content_type, "upsert": "false"})
+            nuevo = True
+    except Exception as e:
+        if not es_duplicado(e):
+            raise
+        nuevo = False
+    indice.agregar(file_name, nuevo)
+    return nuevo
+
+
+def _objetos_por_contenido(image_bytes: bytes, decodificada: Optional[ImagenDecodificada]):
+    """
+    (file_name principal, file_name de la miniatura | None, objetos a subir).
+    Los objetos van como (nombre, bytes, content-type) con el principal al final:
+    si la vista ya está en el bucket, el resto también (lista vacía).
+    """
+    hash_original = hash_contenido(image_bytes)
+    original = f"{hash_original}.jpeg"
+    if decodificada is None:
+        return original, None, [(original, image_bytes, "image/jpeg")]
+
+    nombres = nombres_variantes(hash_original, settings.IMAGENES_FORMATO)
+    if obtener_indice_imagenes().contiene(nombres["vista"]):
+        return nombres["vista"], nombres["miniatura"], []
+
+    content_type = formato_variantes(settings.IMAGENES_FORMATO)[2]
+    variantes = generar_variantes(
+        decodificada, settings.IMAGENES_VISTA_LADO, settings.IMAGENES_MINIATURA_LADO,
+        settings.IMAGENES_CALIDAD, settings.IMAGENES_FORMATO,
+    )
+    objetos = [(nombres["miniatura"], variantes["miniatura"], content_type)]
+    if settings.IMAGENES_GUARDAR_ORIGINAL:
+        objetos.append((original, image_bytes, "image/jpeg"))
+    objetos.append((nombres["vista"], variantes["vista"], content_type))
+    return nombres["vista"], nombres["miniatura"], objetos
+
+
+def subir_por_contenido(bucket, image_bytes: bytes, decodificada: Optional[ImagenDecodificada] = None):
+    """
+    Sube la foto (o, con ``decodificada``, su vista y su miniatura) y devuelve
+    (file_name principal, file_name de la miniatura | None, nuevo).
+    La original solo se sube junto a las variantes con IMAGENES_GUARDAR_ORIGINAL.
+    """
+    principal, miniatura, objetos = _objetos_por_contenido(image_bytes, decodificada)
+    nuevo = False
+    for file_name, contenido, content_type in objetos:
+        nuevo = subir_objeto(bucket, file_name, contenido, content_type)
+    return principal, miniatura, nuevo
+
+
+# ------------------------------
+# SUBIDA (ASYNC)
+# ------------------------------
+async def subir_objeto_async(bucket, file_name: str, contenido: bytes, content_type: str) -> bool:
+    """subir_objeto() sobre un bucket asíncrono (ver repositorio.almacen_async)."""
+    indice = obtener_indice_imagenes()
+    if indice.contiene(file_name):
+        return False
+    try:
+        if settings.IMAGENES_VERIFICAR_EXISTENCIA and await bucket.exists(file_name):
+            nuevo = False
+        else:
+            await bucket.upload(file_name, contenido, {"content-type": content_type, "upsert": "false"})
+            nuevo = True
+    except Exception as e:
+        if not es_duplicado(e):
+            raise
+        nuevo = False
+    indice.agregar(file_name, nuevo)
+    return nuevo
+
+
+async def subir_por_contenido_async(bucket, image_bytes: bytes, decodificada: Optional[ImagenDecodificada] = None):
+    """
+    subir_por_contenido() sin bloquear el event-loop: el hash y las variantes se
+    calculan en un hilo y las subidas previas a la principal van en paralelo.
+    """
+    principal, miniatura, objetos = await asyncio.to_thread(_objetos_por_contenido, image_bytes, decodificada)
+    if not objetos:
+        return principal, miniatura, False
+    *previos, ultimo = objetos
+    await asyncio.gather(*(subir_objeto_async(bucket, *objeto) for objeto in previos))
+    return principal, miniatura, await subir_objeto_async(bucket, *ultimo)
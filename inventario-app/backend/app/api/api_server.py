@@ -1,13 +1,90 @@
 # /backend/app/api/api_server.py
 import asyncio
-from fastapi import FastAPI, HTTPException
+import json
+import os
+from contextlib import asynccontextmanager
+import hmac
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
+from starlette.datastructures import UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
 from typing import Optional
 
-from api.app_ia import registrar_producto_y_imagen
+from api.app_ia import (
+    registrar_producto_y_imagen_async, registrar_producto_desde_bytes_async, iniciar_coalescencia,
+    iniciar_subidas_diferidas, iniciar_diario_offline, iniciar_persistencia_async,
+    calentar_modelo, predict_from_bytes_async, registrar_lote_async, MODEL_PATH, LABELS_PATH, CONFIDENCE_THRESHOLD
+)
+from api.coalescencia import detener_coalescedor
+from api.cache_predicciones import estadisticas_caches
+from api.almacen_imagenes import obtener_indice_imagenes
+from api.cola_subidas import obtener_cola_subidas, detener_cola_subidas
+from api.admision import MiddlewareAdmision, Sobrecarga, obtener_control_admision, obtener_control_lotes
+from api.circuito import obtener_circuito, CERRADO
+from api import metricas, bitacora, perfilador
+from api.cliente_http import cerrar_cliente_http
+from api.diario_offline import obtener_diario, detener_diario
+from api.config import settings
+from api.motor_ia import obtener_motor
+from api.lotes_ia import obtener_programador, iniciar_programador, detener_programador
+
+
+# Estado del arranque para /listo: la instancia recibe tráfico recién con el modelo caliente
+_arranque = {"listo": False, "modelo": None, "calentamiento_ms": None, "error": None}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    bitacora.iniciar_bitacora()
+    _arranque.update(listo=False, error=None)
+    inicio = asyncio.get_running_loop().time()
+    # Modelo, etiquetas y primeros invokes antes de aceptar requests
+    modelo_cargado = False
+    try:
+        calentamiento = await asyncio.to_thread(calentar_modelo, MODEL_PATH, LABELS_PATH, settings.IA_CALENTAMIENTO)
+        _arranque.update(modelo=calentamiento["modelo"], calentamiento_ms=calentamiento["calentamiento_ms"])
+        modelo_cargado = True
+        print(f"[INIT] Modelo caliente ({calentamiento['invokes']} invokes por intérprete, "
+              f"{calentamiento['calentamiento_ms']} ms).")
+    except Exception as e:
+        _arranque["error"] = f"Modelo no cargado: {e}"
+        print(f"[ERROR INIT] Modelo no cargado: {e}")
+    # El programador de micro-lotes vive en el event-loop del worker
+    if modelo_cargado:
+        iniciar_programador(obtener_motor(MODEL_PATH, LABELS_PATH))
+    # Pool HTTP del worker para las llamadas a Supabase de las requests
+    await iniciar_persistencia_async()
+    # Escaneos guardados durante un corte anterior: se sincronizan en segundo plano
+    iniciar_diario_offline()
+    iniciar_coalescencia()
+    # Retoma del disco las subidas que quedaron pendientes
+    await asyncio.to_thread(iniciar_subidas_diferidas)
+    _arranque["arranque_ms"] = round((asyncio.get_running_loop().time() - inicio) * 1000, 1)
+    _arranque["listo"] = modelo_cargado
+    yield
+    # Al apagar deja de declararse lista antes de soltar los recursos
+    _arranque["listo"] = False
+    # Primero se vacían los incrementos agrupados: ningún escaneo aceptado se pierde al apagar
+    await detener_coalescedor()
+    # Las subidas en curso terminan; las pendientes quedan en disco para el próximo arranque
+    await asyncio.to_thread(detener_cola_subidas)
+    # Lo que no se llegó a sincronizar queda en el diario para el próximo arranque
+    await detener_diario()
+    await detener_programador()
+    await cerrar_cliente_http()
+    bitacora.detener_bitacora()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+# Con persistencia local las imágenes se sirven desde la misma API
+if settings.PERSISTENCIA == "local":
+    _almacen_local = os.path.join(settings.PERSISTENCIA_LOCAL_DIR, "almacen")
+    os.makedirs(_almacen_local, exist_ok=True)
+    app.mount(settings.PERSISTENCIA_LOCAL_URL, StaticFiles(directory=_almacen_local), name="almacen")
 
 origins = [
     "*",
@@ -20,6 +97,18 @@ origins = [
     "https://inventario-ia-api-887072391939.us-central1.run.app"
 ]
 
+# Perfilado de una fracción de los registros (apagado por defecto); por dentro de la
+# admisión, para que la espera de un lugar no cuente como tiempo de la request
+app.add_middleware(
+    perfilador.MiddlewarePerfil, rutas=("/api/clasificar-producto", "/api/clasificar", "/api/registro-lote")
+)
+# Límite de requests en curso / en espera antes de leer el cuerpo (429/503 con Retry-After).
+# Se agrega antes que CORS para que los rechazos también lleven sus headers.
+app.add_middleware(MiddlewareAdmision, rutas=("/api/clasificar-producto", "/api/clasificar"))
+app.add_middleware(MiddlewareAdmision, rutas=("/api/registro-lote",), obtener_control=obtener_control_lotes)
+# Por fuera de la admisión: cuenta también las requests en espera y los rechazos
+app.add_middleware(metricas.MiddlewareMetricas)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Para mobile siempre * (seguro si tu API no es pública)
@@ -47,35 +136,319 @@ class ClassificationRequest(BaseModel):
 # --- ENDPOINT ---
 @app.post("/api/clasificar-producto")
 async def classify_product_endpoint(request: ClassificationRequest):
-    # Opcional: log de lo que llega (útil para debugear)
-    print("[API] Request recibido:", request.model_dump(exclude_none=True))
+    # Log de lo que llega (útil para debugear); la imagen queda resumida en tamaño + huella
+    bitacora.info("Request recibida", request=request.model_dump(exclude_none=True))
+
+    return await _ejecutar_registro(registrar_producto_y_imagen_async(
+        request.image_base64,
+        request.codigo_barras,
+        request.nombre,
+        request.marca,
+        request.modelo,
+        request.categoria_id,
+        request.compatibilidad,
+        request.observaciones,
+        request.imagen_url
+    ))
 
+
+async def _ejecutar_registro(registro):
     try:
-        # Ejecutar la función síncrona en un thread para no bloquear el event-loop
-        result = await asyncio.to_thread(
-            registrar_producto_y_imagen,
-            request.image_base64,
-            request.codigo_barras,
-            request.nombre,
-            request.marca,
-            request.modelo,
-            request.categoria_id,
-            request.compatibilidad,
-            request.observaciones,
-            request.imagen_url
-        )
+        # Las etapas bloqueantes corren en threads dentro del registro async; el event-loop queda libre
+        result = await registro
+    except Sobrecarga as e:
+        bitacora.advertencia("Request descartada", status=e.status, motivo=str(e))
+        raise HTTPException(status_code=e.status, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
-        print("[API ERROR] Excepción al procesar IA/DB:", repr(e))
+        bitacora.error("Excepción al procesar IA/DB", error=repr(e))
         # Devolvemos detalle para la consola; el frontend verá 500 y el texto
         raise HTTPException(status_code=500, detail=f"Error interno del servidor IA: {e}")
 
+    # Sin conexión y con el diario offline lleno no es culpa del cliente: 503 y que reintente
+    if isinstance(result, dict) and result.get("diario_lleno"):
+        bitacora.advertencia("Request descartada", status=503, motivo=result.get("message"))
+        raise HTTPException(
+            status_code=503, detail=result.get("message"), headers={"Retry-After": str(settings.DIARIO_INTERVALO_S)}
+        )
+
     # Si la función devolvió un objeto de error (estatus 'error'), lo transformamos a 400
     if isinstance(result, dict) and result.get("status") == "error":
-        print("[API] Resultado de app_ia con status=error:", result.get("message"))
+        bitacora.advertencia("Resultado de app_ia con status=error", detalle=result.get("message"))
         raise HTTPException(status_code=400, detail=result.get("message"))
 
     return result
 
+
+# --- ENDPOINT BINARIO (sin base64) ---
+CAMPOS_PRODUCTO = (
+    "codigo_barras", "nombre", "marca", "modelo", "categoria_id",
+    "compatibilidad", "observaciones", "imagen_url",
+)
+TIPOS_IMAGEN_CRUDA = ("application/octet-stream", "image/jpeg", "image/png", "image/webp")
+
+
+async def _stream_limitado(request: Request, limite: int, que: str = "La imagen"):
+    """Entrega el cuerpo por chunks cortando con 413 apenas supera el límite."""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > limite:
+        raise HTTPException(status_code=413, detail=f"{que} supera el máximo de {limite} bytes.")
+
+    recibido = 0
+    async for chunk in request.stream():
+        recibido += len(chunk)
+        if recibido > limite:
+            raise HTTPException(status_code=413, detail=f"{que} supera el máximo de {limite} bytes.")
+        yield chunk
+
+
+async def _parsear_multipart(parser: MultiPartParser):
+    """Form del cuerpo multipart; un cuerpo malformado o fuera de los límites del parser es un error del cliente."""
+    try:
+        return await parser.parse()
+    except MultiPartException as e:
+        status_code = 413 if e.message.startswith("Part exceeded maximum size") else 400
+        raise HTTPException(status_code=status_code, detail=f"Formulario inválido: {e.message}")
+
+
+async def _leer_imagen(request: Request):
+    """(bytes de la imagen, campos) de un cuerpo multipart (campo ``imagen``) o binario (campos en la query)."""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    limite = settings.API_MAX_CUERPO_BYTES
+
+    if content_type == "multipart/form-data":
+        parser = MultiPartParser(request.headers, _stream_limitado(request, limite), max_files=1)
+        form = await _parsear_multipart(parser)
+        archivo = form.get("imagen")
+        if not isinstance(archivo, UploadFile):
+            raise HTTPException(status_code=400, detail="Falta el archivo 'imagen' en el formulario.")
+        # El archivo ya quedó en el spool del parser: se lee una sola vez
+        image_bytes = await archivo.read()
+        await form.close()
+        campos = form
+    elif content_type in TIPOS_IMAGEN_CRUDA:
+        image_bytes = b"".join([chunk async for chunk in _stream_limitado(request, limite)])
+        campos = request.query_params
+    else:
+        raise HTTPException(status_code=415, detail=f"Content-Type no soportado: {content_type or 'vacío'}")
+
+    if not image_bytes:
+        raise HTTPException(status_code=400, detail="La imagen está vacía.")
+    return image_bytes, campos
+
+
+@app.post("/api/clasificar-producto/binario")
+async def classify_product_binary_endpoint(request: Request):
+    """
+    Variante de /api/clasificar-producto que recibe la imagen en binario:
+
+    - multipart/form-data: archivo en el campo ``imagen`` y metadatos como campos del form.
+    - application/octet-stream (o image/*): la imagen es el cuerpo y los metadatos van en la query.
+    """
+    image_bytes, campos = await _leer_imagen(request)
+    valores = [campos.get(campo) or None for campo in CAMPOS_PRODUCTO]
+    bitacora.info("Request binario recibida", codigo_barras=valores[0], bytes=len(image_bytes))
+
+    return await _ejecutar_registro(registrar_producto_desde_bytes_async(image_bytes, *valores))
+
+
+# --- SOLO CLASIFICACIÓN (vista previa) ---
+@app.post("/api/clasificar")
+async def classify_preview_endpoint(request: Request, top_k: int = 3):
+    """
+    Clasifica la imagen sin registrar nada: ni Storage ni base de datos. Mismo motor,
+    lotes y caché que el registro, así que cuesta lo que una inferencia. Recibe la
+    imagen como /api/clasificar-producto/binario y responde etiqueta, confianza,
+    probabilidad de cada clase y las ``top_k`` más probables.
+    """
+    image_bytes, _ = await _leer_imagen(request)
+    return await _ejecutar_registro(predict_from_bytes_async(
+        MODEL_PATH, image_bytes, LABELS_PATH, CONFIDENCE_THRESHOLD, top_k=max(1, top_k)
+    ))
+
+
+# --- REGISTRO EN LOTE ---
+@app.post("/api/registro-lote")
+async def bulk_register_endpoint(request: Request):
+    """
+    Muchos escaneos en una sola request (tomas de inventario), como multipart/form-data:
+
+    - ``items``: JSON con la lista de productos (codigo_barras, nombre, marca, modelo,
+      categoria_id, compatibilidad, observaciones).
+    - Un archivo ``imagenes`` por producto, en el mismo orden que ``items``.
+
+    El form se lee en streaming: los archivos quedan en el spool del parser y cada
+    imagen se lee recién cuando se procesa su ítem (a lo sumo LOTE_CONCURRENCIA en
+    memoria a la vez). Responde un resultado por ítem. Tiene su propio control de
+    admisión (LOTE_ADMISION_*, sin plazo): el de /api/clasificar-producto no
+    alcanza para cientos de ítems, y los lotes no deben quitarle lugares a los escaneos.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type != "multipart/form-data":
+        raise HTTPException(status_code=415, detail="El registro en lote se envía como multipart/form-data.")
+
+    limite = settings.LOTE_MAX_CUERPO_MB * 1024 * 1024
+    parser = MultiPartParser(
+        request.headers, _stream_limitado(request, limite, "El lote"),
+        max_files=settings.LOTE_MAX_ITEMS, max_fields=16, max_part_size=8 * 1024 * 1024,
+    )
+    form = await _parsear_multipart(parser)
+    try:
+        try:
+            items = json.loads(form.get("items") or "null")
+        except (TypeError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=f"'items' no es un JSON válido: {e}")
+        if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+            raise HTTPException(status_code=400, detail="'items' debe ser una lista de productos.")
+        if len(items) > settings.LOTE_MAX_ITEMS:
+            raise HTTPException(status_code=413, detail=f"El lote supera el máximo de {settings.LOTE_MAX_ITEMS} ítems.")
+
+        imagenes = [archivo for archivo in form.getlist("imagenes") if isinstance(archivo, UploadFile)]
+        bitacora.info("Request de lote recibida", items=len(items), imagenes=len(imagenes))
+        items = [
+            dict({campo: item.get(campo) or None for campo in CAMPOS_PRODUCTO},
+                 imagen=imagenes[i] if i < len(imagenes) else None)
+            for i, item in enumerate(items)
+        ]
+        return await _ejecutar_registro(registrar_lote_async(items))
+    finally:
+        await form.close()
+
+
+@app.get("/api/estadisticas")
+def estadisticas():
+    cola = obtener_cola_subidas()
+    diario = obtener_diario()
+    programador = obtener_programador()
+    return {
+        "admision": obtener_control_admision().estadisticas(),
+        "admision_lotes": obtener_control_lotes().estadisticas(),
+        "cola_ia": programador.estadisticas() if programador else None,
+        "cache_predicciones": estadisticas_caches(),
+        "imagenes": obtener_indice_imagenes().estadisticas(),
+        "cola_subidas": cola.estadisticas() if cola else None,
+        "circuito_supabase": obtener_circuito().estadisticas(),
+        "diario_offline": diario.estadisticas() if diario else None,
+    }
+
+
+# Medidores que /metrics lee en cada exportación
+metricas.registrar_medidor(
+    "nexa_admision_en_curso", "Requests de registro admitidas en curso.",
+    lambda: obtener_control_admision().en_curso,
+)
+metricas.registrar_medidor(
+    "nexa_admision_en_cola", "Requests de registro esperando lugar.",
+    lambda: obtener_control_admision().estadisticas()["en_cola"],
+)
+metricas.registrar_medidor(
+    "nexa_cola_ia", "Imágenes esperando lote de inferencia.",
+    lambda: obtener_programador().estadisticas()["en_cola"] if obtener_programador() else None,
+)
+metricas.registrar_medidor(
+    "nexa_cola_subidas_pendientes", "Subidas diferidas pendientes.",
+    lambda: obtener_cola_subidas().estadisticas()["pendientes"] if obtener_cola_subidas() else None,
+)
+metricas.registrar_medidor(
+    "nexa_diario_pendientes", "Escaneos del diario offline sin sincronizar.",
+    lambda: obtener_diario().pendientes if obtener_diario() else None,
+)
+metricas.registrar_medidor(
+    "nexa_diario_fallidos", "Escaneos del diario offline rechazados por la base, a revisar o reintentar.",
+    lambda: obtener_diario().fallidos if obtener_diario() else None,
+)
+metricas.registrar_medidor(
+    "nexa_logs_descartados", "Eventos de log descartados con la cola llena.", bitacora.descartados,
+)
+metricas.registrar_medidor(
+    "nexa_circuito_abierto", "1 si el circuito de Supabase no está cerrado.",
+    lambda: int(obtener_circuito().estado != CERRADO),
+)
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return Response(content=metricas.exportar(), media_type=metricas.CONTENT_TYPE)
+
+
+# --- ADMINISTRACIÓN ---
+def _verificar_admin(token: Optional[str]):
+    """Sin ADMIN_TOKEN configurado los endpoints de administración no existen (404)."""
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not token or not hmac.compare_digest(token.encode(), settings.ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Token de administración inválido.")
+
+
+@app.post("/api/admin/perfil", include_in_schema=False)
+async def perfil_worker(
+    segundos: float = 10,
+    intervalo_ms: int = settings.PERFIL_INTERVALO_MS,
+    inactivos: bool = False,
+    x_admin_token: Optional[str] = Header(None),
+):
+    """Perfila este worker ``segundos`` y devuelve las pilas en formato collapsed (flamegraph)."""
+    _verificar_admin(x_admin_token)
+    if not 0 < segundos <= settings.PERFIL_MAX_S:
+        raise HTTPException(status_code=400, detail=f"segundos debe estar entre 0 y {settings.PERFIL_MAX_S}.")
+    try:
+        pilas, muestras = await perfilador.perfilar(segundos, intervalo_ms, inactivos)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(pilas, headers={"X-Perfil-Muestras": str(muestras), "X-Perfil-Pid": str(os.getpid())})
+
+
+@app.get("/api/admin/perfil/lentas", include_in_schema=False)
+def perfil_lentas(x_admin_token: Optional[str] = Header(None)):
+    """Perfiles de las requests más lentas entre las muestreadas (de la más lenta a la más rápida)."""
+    _verificar_admin(x_admin_token)
+    perfil = perfilador.obtener_perfil_requests()
+    return {
+        "pid": os.getpid(), "muestreo_pct": perfil.fraccion * 100, "conservar": perfil.conservar,
+        "lentas": perfil.lentas(),
+    }
+
+
+@app.post("/api/admin/perfil/muestreo", include_in_schema=False)
+def perfil_muestreo(pct: float, conservar: Optional[int] = None, x_admin_token: Optional[str] = Header(None)):
+    """Cambia en caliente el porcentaje de requests perfiladas de este worker (0 = apagado)."""
+    _verificar_admin(x_admin_token)
+    perfil = perfilador.obtener_perfil_requests()
+    perfil.configurar(pct, conservar if conservar is not None else perfil.conservar)
+    return {"status": "success", "pid": os.getpid(), "muestreo_pct": perfil.fraccion * 100,
+            "conservar": perfil.conservar}
+
+
+@app.get("/api/admin/diario", include_in_schema=False)
+def diario_fallidos(limite: int = 100, x_admin_token: Optional[str] = Header(None)):
+    """Escaneos del diario offline de este worker que la base rechazó, con su último error (sin la imagen)."""
+    _verificar_admin(x_admin_token)
+    diario = obtener_diario()
+    if diario is None:
+        raise HTTPException(status_code=409, detail="Diario offline inactivo.")
+    return {"pid": os.getpid(), "fallidos": diario.fallidos, "escaneos": diario.listar_fallidos(max(1, limite))}
+
+
+@app.post("/api/admin/diario/reintentar", include_in_schema=False)
+def diario_reintentar(x_admin_token: Optional[str] = Header(None)):
+    """Devuelve los fallidos de este worker a la cola del diario; el sincronizador los reaplica."""
+    _verificar_admin(x_admin_token)
+    diario = obtener_diario()
+    if diario is None:
+        raise HTTPException(status_code=409, detail="Diario offline inactivo.")
+    return {"status": "success", "pid": os.getpid(), "reencolados": diario.reencolar_fallidos()}
+
+
 @app.get("/")
 def root():
-    return {"status": "ok", "message": "API funcionando correctamente."}
\ No newline at end of file
+    return {"status": "ok", "message": "API funcionando correctamente."}
+
+
+@app.get("/listo")
+def listo():
+    """Readiness: 200 solo con el modelo cargado y caliente (``/`` es solo liveness)."""
+    if not _arranque["listo"]:
+        return JSONResponse(
+            status_code=503, headers={"Retry-After": "1"},
+            content={"status": "error", "message": _arranque["error"] or "Instancia arrancando.", **_arranque},
+        )
+    return {"status": "ok", **_arranque}
\ No newline at end of file
@@ -1,101 +1,444 @@
+import asyncio
 import os
-import tensorflow as tf
-import numpy as np
-from tensorflow.keras.preprocessing import image
-from supabase import create_client, Client
-from datetime import datetime
-from io import BytesIO
-import base64
 import uuid
-from typing import Optional, Union
+import base64
+from typing import Optional
+
+from .coalescencia import obtener_coalescedor, iniciar_coalescedor
+from .almacen_imagenes import BUCKET_IMAGENES, subir_por_contenido, subir_por_contenido_async
+from .cola_subidas import obtener_cola_subidas, iniciar_cola_subidas
+from .circuito import es_error_de_conexion, obtener_circuito
+from .diario_offline import DiarioLleno, obtener_diario, iniciar_diario
+from .config import settings
+from .repositorio import RepositorioInventario, crear_repositorio, get_disponibilidad
+from .cliente_http import iniciar_cliente_http
+from .admision import verificar_plazo
+from .metricas import medir
+from . import bitacora
+from .preprocesamiento import ImagenDecodificada
+# La clasificación vive en prediccion.py (sin efectos al importarse); se re-exporta para api_server
+from .prediccion import (  # noqa: F401
+    CONFIDENCE_THRESHOLD, LABELS_PATH, MODEL_PATH, _error_imagen, calentar_modelo, predict_from_bytes,
+    predict_from_bytes_async,
+)
+
+# Persistencia de productos e imágenes (Supabase o local, ver repositorio.py)
+repositorio: Optional[RepositorioInventario] = None
+
+
+def _conectar_repositorio() -> bool:
+    """Crea el repositorio configurado (el sincronizador del diario lo reintenta si falló al arrancar)."""
+    global repositorio
+    try:
+        repositorio = crear_repositorio(settings.PERSISTENCIA)
+        print(f"[INIT] Persistencia lista ({repositorio.nombre}).")
+        return True
+    except Exception as e:
+        print(f"[ERROR INIT] Persistencia ({settings.PERSISTENCIA}) no inicializada: {e}")
+        repositorio = None
+        return False
 
-# ------------------------------
-# CONFIG
-# ------------------------------
-IMG_SIZE = (224, 224)
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-MODEL_DIR = os.path.join(BASE_DIR, "modelo_ia")
-MODEL_PATH = os.path.join(MODEL_DIR, "modelo_final_v3.tflite")
-LABELS_PATH = os.path.join(MODEL_DIR, "labels.txt")
-CONFIDENCE_THRESHOLD = 0.50
-
-supabase: Union[Client, None] = None
-try:
-    from credenciales import SUPABASE_URL, SUPABASE_ANON_KEY
-    supabase = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
-    print("[INIT] Supabase listo.")
-except Exception as e:
-    print(f"[ERROR INIT] Supabase no inicializado: {e}")
-    supabase = None
+
+_conectar_repositorio()
+
+
+async def iniciar_persistencia_async():
+    """Conecta el repositorio al pool HTTP compartido del worker (se llama desde el lifespan)."""
+    if repositorio is None:
+        return
+    try:
+        await repositorio.iniciar_async(iniciar_cliente_http())
+    except Exception as e:
+        print(f"[ERROR INIT] Cliente asíncrono no iniciado, se usa el sincrónico en hilos: {e}")
 
 
 # ------------------------------
-# UTILS
+# ETAPAS DEL REGISTRO
 # ------------------------------
-def get_labels(path):
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            return [line.strip() for line in f.readlines()]
-    return None
+def _decodificacion_compartida(image_bytes: bytes) -> Optional[ImagenDecodificada]:
+    """Decodificación única para la inferencia y las variantes (None si no se generan variantes)."""
+    if not settings.IMAGENES_VARIANTES:
+        return None
+    return ImagenDecodificada(image_bytes, settings.IMAGENES_VISTA_LADO)
+
+
+def _subir_imagen(image_bytes: bytes, decodificada: Optional[ImagenDecodificada] = None):
+    """
+    Sube la imagen al Storage con su hash como nombre y devuelve su URL pública.
+    Si el mismo contenido ya está en el bucket no se vuelve a subir ('nuevo': False).
+    Los objetos no se borran desde la API aunque el registro falle: otro producto
+    puede apuntar al mismo hash. Los huérfanos se limpian con api/migrar_imagenes.py.
+
+    Con ``decodificada`` (IMAGENES_VARIANTES) se suben la vista y la miniatura en
+    vez de la foto original, que solo se guarda con IMAGENES_GUARDAR_ORIGINAL.
+    """
+    circuito = obtener_circuito()
+    if not circuito.permite():
+        return {'status': 'error', 'message': 'Supabase no disponible (circuito abierto).', 'sin_conexion': True}
+
+    bucket = repositorio.almacen(BUCKET_IMAGENES)
+    try:
+        file_name, miniatura, nuevo = subir_por_contenido(bucket, image_bytes, decodificada)
+    except Exception as e:
+        circuito.registrar(e)
+        return _error_subida(e)
+    circuito.registrar(None)
+
+    # Obtener URL pública
+    try:
+        public_url = bucket.get_public_url(file_name)
+        miniatura_url = bucket.get_public_url(miniatura) if miniatura else None
+    except Exception as e:
+        return {"status": "error", "message": f"Error obteniendo URL pública: {e}"}
+
+    return {
+        'status': 'success', 'file_name': file_name, 'public_url': public_url,
+        'miniatura_url': miniatura_url, 'nuevo': nuevo
+    }
 
 
-def preprocess_image(image_data: bytes, target_size=IMG_SIZE):
-    img = image.load_img(BytesIO(image_data), target_size=target_size)
-    img_array = image.img_to_array(img)
-    img_array = np.expand_dims(img_array, axis=0)
-    return tf.keras.applications.mobilenet_v2.preprocess_input(img_array).astype(np.float32)
+async def _subir_imagen_async(image_bytes: bytes, decodificada: Optional[ImagenDecodificada] = None):
+    """_subir_imagen() por el pool HTTP compartido; las variantes se generan en un hilo."""
+    circuito = obtener_circuito()
+    if not circuito.permite():
+        return {'status': 'error', 'message': 'Supabase no disponible (circuito abierto).', 'sin_conexion': True}
 
+    bucket = repositorio.almacen_async(BUCKET_IMAGENES)
+    try:
+        file_name, miniatura, nuevo = await subir_por_contenido_async(bucket, image_bytes, decodificada)
+    except Exception as e:
+        circuito.registrar(e)
+        return _error_subida(e)
+    circuito.registrar(None)
+
+    try:
+        public_url = await bucket.get_public_url(file_name)
+        miniatura_url = await bucket.get_public_url(miniatura) if miniatura else None
+    except Exception as e:
+        return {"status": "error", "message": f"Error obteniendo URL pública: {e}"}
 
-def get_disponibilidad(cantidad: int) -> str:
-    if cantidad <= 0:
-        return "Sin stock"
-    if cantidad <= 4:
-        return "Baja disponibilidad"
-    if cantidad <= 10:
-        return "Disponibilidad media"
-    return "Alta disponibilidad"
+    return {
+        'status': 'success', 'file_name': file_name, 'public_url': public_url,
+        'miniatura_url': miniatura_url, 'nuevo': nuevo
+    }
 
 
-# ------------------------------
-# IA PREDICTION
-# ------------------------------
-def predict_from_bytes(model_path, image_data: bytes, labels_path, threshold):
-    if not os.path.exists(model_path):
-        return {'status': 'error', 'message': f'Modelo no encontrado: {model_path}'}
+def _error_subida(e: Exception) -> dict:
+    if es_error_de_conexion(e):
+        return {'status': 'error', 'message': f"Error subiendo imagen: {e}", 'sin_conexion': True}
+    if isinstance(e, (ValueError, OSError)):
+        return _error_imagen(e)
+    return {'status': 'error', 'message': f"Error subiendo imagen: {e}"}
+
+
+def _reservar_en_cola(image_bytes: bytes):
+    """Id del trabajo en la cola de subidas, o None si está desactivada o llena."""
+    cola = obtener_cola_subidas()
+    if cola is None:
+        return None
+    try:
+        return cola.reservar(image_bytes)
+    except OSError as e:
+        bitacora.advertencia("No se pudo encolar la imagen, se sube en línea", error=str(e))
+        return None
+
+
+def _subir_o_diferir(image_bytes: bytes, decodificada: Optional[ImagenDecodificada] = None):
+    """
+    Con SUBIDA_DIFERIDA deja la imagen en la cola en disco y no espera al Storage
+    ('trabajo_diferido'); si la cola está llena (o desactivada) sube en línea.
+    """
+    with medir("subida"):
+        trabajo_id = _reservar_en_cola(image_bytes)
+        if trabajo_id is not None:
+            return {'status': 'success', 'public_url': None, 'miniatura_url': None, 'trabajo_diferido': trabajo_id}
+        return _subir_imagen(image_bytes, decodificada)
+
+
+async def _subir_o_diferir_async(image_bytes: bytes, decodificada: Optional[ImagenDecodificada] = None):
+    with medir("subida"):
+        # La reserva escribe la imagen en disco (fsync): va en un hilo
+        trabajo_id = await asyncio.to_thread(_reservar_en_cola, image_bytes)
+        if trabajo_id is not None:
+            return {'status': 'success', 'public_url': None, 'miniatura_url': None, 'trabajo_diferido': trabajo_id}
+        return await _subir_imagen_async(image_bytes, decodificada)
+
+
+def _cerrar_subida_diferida(subida: dict, respuesta: dict) -> dict:
+    """Confirma el trabajo de subida si el escaneo quedó escrito, o lo descarta si no."""
+    trabajo_id = subida.get("trabajo_diferido")
+    cola = obtener_cola_subidas()
+    if cola is None:
+        return respuesta
+    if trabajo_id is None:
+        # Subida en línea (cola llena): ninguna imagen anterior encolada debe pisarla
+        if respuesta["status"] == "success":
+            cola.invalidar(respuesta["producto_id"])
+        return respuesta
+    if respuesta["status"] != "success":
+        cola.descartar(trabajo_id)
+        return respuesta
+    cola.confirmar(trabajo_id, respuesta["producto_id"])
+    return dict(respuesta, imagen_pendiente=True)
+
+
+def _procesar_subida_diferida(producto_id: int, image_bytes: bytes, vigente):
+    """Trabajo de la cola: sube la imagen y completa las URLs del producto (lanza si falla)."""
+    subida = _subir_imagen(image_bytes, _decodificacion_compartida(image_bytes))
+    if subida["status"] == "error":
+        raise RuntimeError(subida["message"])
+    if not vigente():
+        return
+    cambios = {"imagen_url": subida["public_url"]}
+    if subida["miniatura_url"]:
+        cambios["imagen_miniatura_url"] = subida["miniatura_url"]
+    repositorio.actualizar_producto(producto_id, cambios)
+
+
+def iniciar_subidas_diferidas():
+    """Activa (según configuración) la cola de subidas en segundo plano de este worker."""
+    if repositorio is None:
+        return None
+    return iniciar_cola_subidas(_procesar_subida_diferida)
+
+
+def _categoria_id(categoria_id: Optional[str]):
+    return int(categoria_id) if categoria_id and str(categoria_id).isdigit() else None
+
+
+def _escribir_escaneo(campos: dict, estado_ia: str, subida: dict, escaneo_ids: list):
+    """
+    Busca el producto (código de barras, luego nombre+marca+modelo) y suma un
+    escaneo por cada id de ``escaneo_ids`` a su stock, o lo registra si es nuevo,
+    en una sola operación atómica del repositorio (en Supabase, la RPC
+    ``registrar_escaneo`` de backend/supabase/migrations). Los ids ya aplicados
+    no vuelven a sumar, así que reintentar tras un timeout es seguro.
+
+    Si Supabase no responde (o el circuito está abierto) el error trae
+    ``'sin_conexion': True`` y el escaneo puede ir al diario offline.
+    """
+    circuito = obtener_circuito()
+    if repositorio is None or not circuito.permite():
+        return {"status": "error", "message": "Supabase no disponible (circuito abierto).", "sin_conexion": True}
+
+    try:
+        fila = repositorio.registrar_escaneo(_parametros_escaneo(campos, estado_ia, subida, escaneo_ids))
+    except Exception as e:
+        circuito.registrar(e)
+        return _error_escritura(e)
+    circuito.registrar(None)
+    return _fila_escrita(fila)
+
+
+async def _escribir_escaneo_async(campos: dict, estado_ia: str, subida: dict, escaneo_ids: list):
+    """_escribir_escaneo() por el pool HTTP compartido (la usa también la coalescencia)."""
+    circuito = obtener_circuito()
+    if repositorio is None or not circuito.permite():
+        return {"status": "error", "message": "Supabase no disponible (circuito abierto).", "sin_conexion": True}
+
+    try:
+        fila = await repositorio.registrar_escaneo_async(_parametros_escaneo(campos, estado_ia, subida, escaneo_ids))
+    except Exception as e:
+        circuito.registrar(e)
+        return _error_escritura(e)
+    circuito.registrar(None)
+    return _fila_escrita(fila)
+
+
+def _parametros_escaneo(campos: dict, estado_ia: str, subida: dict, escaneo_ids: list) -> dict:
+    return {
+        "p_codigo_barras": campos["codigo_barras"],
+        "p_nombre": campos.get("nombre"),
+        "p_marca": campos.get("marca"),
+        "p_modelo": campos.get("modelo"),
+        "p_categoria_id": _categoria_id(campos.get("categoria_id")),
+        "p_compatibilidad": campos.get("compatibilidad"),
+        "p_observaciones": campos.get("observaciones"),
+        "p_estado": estado_ia,
+        "p_imagen_url": subida.get("public_url"),
+        "p_imagen_miniatura_url": subida.get("miniatura_url"),
+        "p_incremento": len(escaneo_ids),
+        "p_escaneo_ids": escaneo_ids
+    }
+
 
-    interpreter = tf.lite.Interpreter(model_path=model_path)
-    interpreter.allocate_tensors()
+def _error_escritura(e: Exception) -> dict:
+    return {"status": "error", "message": f"Error registrando producto: {e}", "sin_conexion": es_error_de_conexion(e)}
 
-    input_tensor = preprocess_image(image_data)
-    input_details = interpreter.get_input_details()
-    output_details = interpreter.get_output_details()
 
-    interpreter.set_tensor(input_details[0]['index'], input_tensor)
-    interpreter.invoke()
+def _fila_escrita(fila: Optional[dict]) -> dict:
+    if not fila:
+        return {"status": "error", "message": "La base de datos no devolvió el producto registrado."}
+    return {"status": "success", "fila": fila}
 
-    output_data = interpreter.get_tensor(output_details[0]['index'])
-    probabilities = output_data[0]
 
-    labels = get_labels(labels_path)
-    if not labels:
-        return {'status': 'error', 'message': 'No se pudieron cargar las etiquetas.'}
+def _respuesta_escaneo(fila: dict, estado_ia: str, subida: dict):
+    stock = fila["stock"]
+
+    if fila["coincidencia"] == "nuevo":
+        return {
+            "status": "success",
+            "message": "Producto nuevo registrado.",
+            "producto_id": fila["producto_id"],
+            "estado_clasificado": estado_ia,
+            "stock_actual": stock,
+            "disponibilidad": get_disponibilidad(stock),
+            "imagen_url": subida.get("public_url"),
+            "imagen_miniatura_url": subida.get("miniatura_url")
+        }
 
-    idx = np.argmax(probabilities)
-    confidence = probabilities[idx]
+    return {
+        "status": "success",
+        "message": f"Stock actualizado (coincidencia {fila['coincidencia']}).",
+        "producto_id": fila["producto_id"],
+        "estado_clasificado": estado_ia,
+        "stock_actual": stock,
+        "disponibilidad": get_disponibilidad(stock)
+    }
 
-    label = labels[idx] if confidence >= threshold else "INCIERTO"
+
+def _registrar_escaneo(estado_ia: str, subida: dict, campos: dict, escaneo_id: str):
+    with medir("escritura"):
+        escritura = _escribir_escaneo(campos, estado_ia, subida, [escaneo_id])
+    if escritura["status"] == "error":
+        return escritura
+    return _respuesta_escaneo(escritura["fila"], estado_ia, subida)
+
+
+async def _registrar_escaneo_async(estado_ia: str, subida: dict, campos: dict, escaneo_id: str):
+    with medir("escritura"):
+        escritura = await _escribir_escaneo_async(campos, estado_ia, subida, [escaneo_id])
+    if escritura["status"] == "error":
+        return escritura
+    return _respuesta_escaneo(escritura["fila"], estado_ia, subida)
+
+
+def iniciar_coalescencia():
+    """Activa (según configuración) la agrupación de escaneos repetidos en este worker."""
+    return iniciar_coalescedor(_escribir_escaneo_async)
+
+
+# ------------------------------
+# DIARIO OFFLINE
+# ------------------------------
+def _sin_conexion() -> bool:
+    """True si el escaneo va directo al diario offline, sin intentar Supabase."""
+    diario = obtener_diario()
+    if diario is None:
+        return False
+    # Con escaneos pendientes en el diario, los nuevos van detrás para respetar el orden
+    return repositorio is None or not obtener_circuito().disponible or diario.pendientes > 0
+
+
+def _registrar_en_diario(escaneo_id: str, campos: dict, estado_ia: str, image_bytes: bytes, subida: dict):
+    """Guarda el escaneo en el diario local; se aplica en Supabase al volver la conexión."""
+    cola = obtener_cola_subidas()
+    if subida.get("trabajo_diferido") and cola is not None:
+        cola.descartar(subida["trabajo_diferido"])
+
+    # Si la imagen ya se subió alcanza con sus URLs
+    urls = None
+    if subida.get("public_url"):
+        urls = {"imagen_url": subida["public_url"], "imagen_miniatura_url": subida.get("miniatura_url")}
+    try:
+        with medir("escritura"):
+            obtener_diario().registrar(escaneo_id, campos, estado_ia, None if urls else image_bytes, urls)
+    except DiarioLleno as e:
+        # La API lo responde con 503: el cliente reintenta más tarde
+        bitacora.advertencia("Diario offline lleno, escaneo rechazado", codigo_barras=campos.get("codigo_barras"))
+        return {"status": "error", "message": f"Sin conexión con Supabase y {e}.", "diario_lleno": True}
+    except Exception as e:
+        return {"status": "error", "message": f"Sin conexión con Supabase y no se pudo guardar el escaneo: {e}"}
 
     return {
-        'status': 'success',
-        'predicted_label': label,
-        'confidence': float(confidence),
-        'confidence_score': f"{confidence * 100:.2f}%"
+        "status": "success",
+        "message": "Sin conexión con Supabase: escaneo guardado, se sincronizará al volver la conexión.",
+        "estado_clasificado": estado_ia,
+        "stock_actual": None,
+        "disponibilidad": None,
+        "pendiente_sincronizacion": True
     }
 
 
+def _diario_o_respuesta(respuesta: dict, escaneo_id: str, campos: dict, estado_ia: str,
+                        image_bytes: bytes, subida: dict) -> dict:
+    """Si la etapa falló por conexión y hay diario, el escaneo se guarda ahí en vez de perderse."""
+    if respuesta["status"] == "error" and respuesta.get("sin_conexion") and obtener_diario() is not None:
+        return _registrar_en_diario(escaneo_id, campos, estado_ia, image_bytes, subida)
+    return _cerrar_subida_diferida(subida, respuesta)
+
+
+def _aplicar_desde_diario(campos: dict, estado_ia: str, image_bytes: Optional[bytes],
+                          urls: Optional[dict], escaneo_ids: list):
+    """Reaplica un grupo de escaneos del diario (ver SincronizadorDiario); lanza si falla."""
+    if repositorio is None and not _conectar_repositorio():
+        raise ConnectionError("Persistencia no inicializada.")
+
+    subida = {}
+    if urls:
+        subida = {"public_url": urls.get("imagen_url"), "miniatura_url": urls.get("imagen_miniatura_url")}
+    elif image_bytes is not None:
+        subida = _subir_imagen(image_bytes, _decodificacion_compartida(image_bytes))
+        if subida["status"] == "error":
+            if subida.get("sin_conexion"):
+                raise ConnectionError(subida["message"])
+            # El Storage rechazó la imagen: el stock se aplica igual, sin imagen nueva
+            bitacora.advertencia(
+                "Imagen del diario rechazada, se aplica el escaneo sin imagen",
+                codigo_barras=campos.get("codigo_barras"), error=subida["message"],
+            )
+            subida = {}
+
+    escritura = _escribir_escaneo(campos, estado_ia, subida, escaneo_ids)
+    if escritura["status"] == "error":
+        raise (ConnectionError if escritura.get("sin_conexion") else RuntimeError)(escritura["message"])
+
+    # La imagen del diario es más nueva que cualquier subida encolada antes del corte
+    cola = obtener_cola_subidas()
+    if cola is not None:
+        cola.invalidar(escritura["fila"]["producto_id"])
+
+
+def iniciar_diario_offline():
+    """Activa (según configuración) el diario offline de este worker y su sincronizador."""
+    return iniciar_diario(obtener_circuito(), _aplicar_desde_diario)
+
+
 # ------------------------------
 # FUNCIÓN PRINCIPAL
 # ------------------------------
+def _validar_registro(codigo_barras: str):
+    # Sin cliente todavía se puede registrar si el diario offline está activo
+    if repositorio is None and obtener_diario() is None:
+        return {'status': 'error', 'message': 'Persistencia no inicializada.'}
+
+    if not codigo_barras:
+        return {'status': 'error', 'message': 'El código de barras es obligatorio.'}
+
+    return None
+
+
+def _campos_producto(codigo_barras, nombre, marca, modelo, categoria_id, compatibilidad, observaciones):
+    return {
+        "codigo_barras": codigo_barras,
+        "nombre": nombre,
+        "marca": marca,
+        "modelo": modelo,
+        "categoria_id": categoria_id,
+        "compatibilidad": compatibilidad,
+        "observaciones": observaciones
+    }
+
+
+def _decodificar_base64(image_base64: str):
+    try:
+        with medir("decodificacion"):
+            return {'status': 'success', 'image_bytes': base64.b64decode(image_base64)}
+    except Exception as e:
+        bitacora.advertencia("Imagen base64 inválida", error=repr(e))
+        return {'status': 'error', 'message': "Error decodificando imagen: base64 inválido."}
+
+
 def registrar_producto_y_imagen(
     image_base64: str,
     codigo_barras: str,
@@ -107,150 +450,336 @@ def registrar_producto_y_imagen(
     observaciones: Optional[str] = None,
     imagen_url: Optional[str] = None
 ):
-    print(f"[START] Procesando código: {codigo_barras}")
-    current_time = datetime.now().isoformat()
+    error = _validar_registro(codigo_barras)
+    if error:
+        return error
 
-    if supabase is None:
-        return {'status': 'error', 'message': 'Supabase no inicializado.'}
+    # 1) Decodificar imagen
+    decodificada = _decodificar_base64(image_base64)
+    if decodificada["status"] == "error":
+        return decodificada
 
-    if not codigo_barras:
-        return {'status': 'error', 'message': 'El código de barras es obligatorio.'}
+    return registrar_producto_desde_bytes(
+        decodificada["image_bytes"], codigo_barras, nombre, marca, modelo,
+        categoria_id, compatibilidad, observaciones, imagen_url
+    )
 
-    # ------------------------------
-    # 1) Decodificar imagen
-    # ------------------------------
-    try:
-        image_bytes = base64.b64decode(image_base64)
-    except Exception as e:
-        return {'status': 'error', 'message': f"Error decodificando imagen: {e}"}
 
-    # ------------------------------
-    # 2) Clasificación IA
-    # ------------------------------
-    prediction = predict_from_bytes(MODEL_PATH, image_bytes, LABELS_PATH, CONFIDENCE_THRESHOLD)
+def registrar_producto_desde_bytes(
+    image_bytes: bytes,
+    codigo_barras: str,
+    nombre: Optional[str] = None,
+    marca: Optional[str] = None,
+    modelo: Optional[str] = None,
+    categoria_id: Optional[str] = None,
+    compatibilidad: Optional[str] = None,
+    observaciones: Optional[str] = None,
+    imagen_url: Optional[str] = None
+):
+    """Registro a partir de los bytes crudos de la imagen (sin base64 de por medio)."""
+    bitacora.info("Procesando escaneo", codigo_barras=codigo_barras)
+
+    error = _validar_registro(codigo_barras)
+    if error:
+        return error
+
+    # 2) Clasificación IA (la decodificación se reutiliza para las variantes de la imagen)
+    decodificada = _decodificacion_compartida(image_bytes)
+    prediction = predict_from_bytes(MODEL_PATH, image_bytes, LABELS_PATH, CONFIDENCE_THRESHOLD, decodificada)
     if prediction["status"] == "error":
         return prediction
 
     estado_ia = prediction["predicted_label"].lower()
+    escaneo_id = str(uuid.uuid4())
+    campos = _campos_producto(codigo_barras, nombre, marca, modelo, categoria_id, compatibilidad, observaciones)
 
-    # ------------------------------
-    # 3) Subir imagen al Storage
-    # ------------------------------
-    # 3) Subir imagen al Storage + obtener URL pública
-    file_name = f"{uuid.uuid4()}.jpeg"
-    bucket = supabase.storage.from_("imagenes")
+    # Sin conexión con Supabase el escaneo va al diario offline
+    if _sin_conexion():
+        return _registrar_en_diario(escaneo_id, campos, estado_ia, image_bytes, {})
 
-    try:
-        bucket.upload(
-            file_name,
-            image_bytes,
-            {"content-type": "image/jpeg"}
+    # 3) Subir imagen al Storage + obtener URL pública (o dejarla en la cola de subidas)
+    subida = _subir_o_diferir(image_bytes, decodificada)
+    if subida["status"] == "error":
+        return _diario_o_respuesta(subida, escaneo_id, campos, estado_ia, image_bytes, {})
+
+    # 4) Buscar + actualizar stock o registrar producto nuevo (una sola ida a la BD)
+    respuesta = _registrar_escaneo(estado_ia, subida, campos, escaneo_id)
+    return _diario_o_respuesta(respuesta, escaneo_id, campos, estado_ia, image_bytes, subida)
+
+
+# ------------------------------
+# FUNCIÓN PRINCIPAL (ASYNC)
+# ------------------------------
+async def registrar_producto_y_imagen_async(
+    image_base64: str,
+    codigo_barras: str,
+    nombre: Optional[str] = None,
+    marca: Optional[str] = None,
+    modelo: Optional[str] = None,
+    categoria_id: Optional[str] = None,
+    compatibilidad: Optional[str] = None,
+    observaciones: Optional[str] = None,
+    imagen_url: Optional[str] = None
+):
+    error = _validar_registro(codigo_barras)
+    if error:
+        return error
+
+    verificar_plazo("decodificar la imagen")
+    decodificada = await asyncio.to_thread(_decodificar_base64, image_base64)
+    if decodificada["status"] == "error":
+        return decodificada
+
+    return await registrar_producto_desde_bytes_async(
+        decodificada["image_bytes"], codigo_barras, nombre, marca, modelo,
+        categoria_id, compatibilidad, observaciones, imagen_url
+    )
+
+
+async def registrar_producto_desde_bytes_async(
+    image_bytes: bytes,
+    codigo_barras: str,
+    nombre: Optional[str] = None,
+    marca: Optional[str] = None,
+    modelo: Optional[str] = None,
+    categoria_id: Optional[str] = None,
+    compatibilidad: Optional[str] = None,
+    observaciones: Optional[str] = None,
+    imagen_url: Optional[str] = None
+):
+    """
+    Mismo registro que registrar_producto_desde_bytes, con las etapas independientes
+    en paralelo: la inferencia y la subida al Storage corren a la vez (compartiendo
+    una sola decodificación de la imagen) y el registro atómico del escaneo arranca
+    cuando terminan ambas.
+    """
+    bitacora.info("Procesando escaneo", codigo_barras=codigo_barras, modo="async")
+
+    error = _validar_registro(codigo_barras)
+    if error:
+        return error
+
+    # Si la request esperó demasiado (admisión, lectura del cuerpo) ya no vale la pena empezar
+    verificar_plazo("empezar el registro")
+    escaneo_id = str(uuid.uuid4())
+    campos = _campos_producto(codigo_barras, nombre, marca, modelo, categoria_id, compatibilidad, observaciones)
+    decodificada = _decodificacion_compartida(image_bytes)
+
+    # Sin conexión con Supabase no se intenta subir: solo inferencia y diario offline
+    if _sin_conexion():
+        prediction = await predict_from_bytes_async(
+            MODEL_PATH, image_bytes, LABELS_PATH, CONFIDENCE_THRESHOLD, decodificada
         )
-    except Exception as e:
-        return {'status': 'error', 'message': f"Error subiendo imagen: {e}"}
+        if prediction["status"] == "error":
+            return prediction
+        estado_ia = prediction["predicted_label"].lower()
+        return await asyncio.to_thread(_registrar_en_diario, escaneo_id, campos, estado_ia, image_bytes, {})
+
+    prediction, subida = await asyncio.gather(
+        predict_from_bytes_async(MODEL_PATH, image_bytes, LABELS_PATH, CONFIDENCE_THRESHOLD, decodificada),
+        _subir_o_diferir_async(image_bytes, decodificada),
+        return_exceptions=True,
+    )
+    # Una etapa lanzó (p. ej. plazo vencido en la cola de inferencia): se libera la reserva de la subida
+    for etapa in (prediction, subida):
+        if isinstance(etapa, BaseException):
+            if isinstance(subida, dict):
+                await asyncio.to_thread(_cerrar_subida_diferida, subida, {'status': 'error'})
+            raise etapa
+
+    # Mismo orden de prioridad de errores que la versión secuencial
+    if prediction["status"] == "error":
+        return await asyncio.to_thread(_cerrar_subida_diferida, subida, prediction)
+    estado_ia = prediction["predicted_label"].lower()
+    if subida["status"] == "error":
+        return await asyncio.to_thread(_diario_o_respuesta, subida, escaneo_id, campos, estado_ia, image_bytes, {})
 
-    # Obtener URL pública
+    # Vencida a esta altura, el cliente ya no espera la respuesta: no se suma un escaneo que reintentará
     try:
-        public_url = bucket.get_public_url(file_name)
-    except Exception as e:
-        return {"status": "error", "message": f"Error obteniendo URL pública: {e}"}
-    
-    # ------------------------------
-    # 4) Buscar por código de barras (corregido)
-    # ------------------------------
-    try:
-        result = (
-            supabase.table("productos")
-            .select("*")
-            .eq("codigo_barras", codigo_barras)
-            .maybe_single()
-            .execute()
+        verificar_plazo("registrar el escaneo")
+    except Exception:
+        await asyncio.to_thread(_cerrar_subida_diferida, subida, {'status': 'error'})
+        raise
+
+    # Con la coalescencia activa, los escaneos repetidos del mismo código se escriben juntos
+    coalescedor = obtener_coalescedor()
+    if coalescedor is not None:
+        with medir("escritura"):
+            escritura = await coalescedor.registrar(campos, estado_ia, subida, escaneo_id)
+        if escritura["status"] == "success":
+            escritura = _respuesta_escaneo(escritura["fila"], estado_ia, subida)
+        return await asyncio.to_thread(
+            _diario_o_respuesta, escritura, escaneo_id, campos, estado_ia, image_bytes, subida
         )
-    except Exception as e:
-        return {"status": "error", "message": f"Error buscando producto por código: {e}"}
 
-    producto = result.data if result and hasattr(result, "data") and isinstance(result.data, dict) else None
+    respuesta = await _registrar_escaneo_async(estado_ia, subida, campos, escaneo_id)
+    return await asyncio.to_thread(_diario_o_respuesta, respuesta, escaneo_id, campos, estado_ia, image_bytes, subida)
 
-    # Si existe → actualizar stock
-    if producto:
-        stock_nuevo = producto["stock"] + 1
-        supabase.table("productos").update({
-            "stock": stock_nuevo,
-            "disponibilidad": get_disponibilidad(stock_nuevo),
-            "estado": estado_ia,
-            "updated_at": current_time,
-            "imagen_url": public_url
-        }).eq("id", producto["id"]).execute()
-
-        return {
-            "status": "success",
-            "message": "Stock actualizado (coincidencia código de barras).",
-            "producto_id": producto["id"],
-            "estado_clasificado": estado_ia,
-            "stock_actual": stock_nuevo
-        }
 
-    # ------------------------------
-    # 5) Buscar coincidencia nombre+marca+modelo
-    # ------------------------------
-    try:
-        result2 = (
-            supabase.table("productos")
-            .select("*")
-            .match({
-                "nombre": nombre,
-                "marca": marca,
-                "modelo": modelo
-            })
-            .maybe_single()
-            .execute()
+# ------------------------------
+# REGISTRO EN LOTE
+# ------------------------------
+async def _imagen_del_item(imagen) -> Optional[bytes]:
+    """La imagen puede llegar en bytes o como archivo (UploadFile) que se lee recién al procesar el ítem."""
+    if imagen is None or isinstance(imagen, (bytes, bytearray)):
+        return imagen
+    return await imagen.read()
+
+
+def _releer_imagen_del_item(imagen) -> bytes:
+    """Vuelve a leer la imagen del spool del parser (desde un hilo: lectura sincrónica del archivo)."""
+    if isinstance(imagen, (bytes, bytearray)):
+        return imagen
+    imagen.file.seek(0)
+    return imagen.file.read()
+
+
+async def _preparar_item_lote(item: dict, sin_conexion: bool) -> dict:
+    """
+    Clasifica y sube la imagen de un ítem del lote. Devuelve la respuesta final
+    del ítem (error o diario offline) o ``{'status': 'pendiente', ...}`` con lo
+    que necesita la escritura en lote.
+    """
+    campos = _campos_producto(*(item.get(campo) for campo in (
+        "codigo_barras", "nombre", "marca", "modelo", "categoria_id", "compatibilidad", "observaciones"
+    )))
+    error = _validar_registro(campos["codigo_barras"])
+    if error:
+        return error
+
+    image_bytes = await _imagen_del_item(item.get("imagen"))
+    if not image_bytes:
+        return {'status': 'error', 'message': 'Falta la imagen.'}
+    if len(image_bytes) > settings.API_MAX_CUERPO_BYTES:
+        return {'status': 'error', 'message': f'La imagen supera el máximo de {settings.API_MAX_CUERPO_BYTES} bytes.'}
+
+    escaneo_id = str(uuid.uuid4())
+    decodificada = _decodificacion_compartida(image_bytes)
+
+    if sin_conexion:
+        prediction = await predict_from_bytes_async(
+            MODEL_PATH, image_bytes, LABELS_PATH, CONFIDENCE_THRESHOLD, decodificada
         )
-        producto2 = result2.data if result2 and isinstance(result2.data, dict) else None
-    except Exception:
-        producto2 = None
-
-    if producto2:
-        stock_nuevo = producto2["stock"] + 1
-        supabase.table("productos").update({
-            "stock": stock_nuevo,
-            "disponibilidad": get_disponibilidad(stock_nuevo),
-            "estado": estado_ia,
-            "updated_at": current_time,
-            "imagen_url": public_url
-        }).eq("id", producto2["id"]).execute()
+        if prediction["status"] == "error":
+            return prediction
+        estado_ia = prediction["predicted_label"].lower()
+        return await asyncio.to_thread(_registrar_en_diario, escaneo_id, campos, estado_ia, image_bytes, {})
+
+    # Con el micro-batching activo, las inferencias de los ítems en curso viajan en el mismo lote
+    prediction, subida = await asyncio.gather(
+        predict_from_bytes_async(MODEL_PATH, image_bytes, LABELS_PATH, CONFIDENCE_THRESHOLD, decodificada),
+        _subir_o_diferir_async(image_bytes, decodificada),
+        return_exceptions=True,
+    )
+    # Una excepción en un ítem no corta el lote: se informa como error del ítem
+    for etapa in (prediction, subida):
+        if isinstance(etapa, Exception):
+            if isinstance(subida, dict):
+                await asyncio.to_thread(_cerrar_subida_diferida, subida, {'status': 'error'})
+            return {'status': 'error', 'message': f"Error procesando el ítem: {etapa}"}
 
-        return {
-            "status": "success",
-            "message": "Stock actualizado (coincidencia nombre/marca/modelo).",
-            "producto_id": producto2["id"],
-            "estado_clasificado": estado_ia,
-            "stock_actual": stock_nuevo
-        }
+    if prediction["status"] == "error":
+        return await asyncio.to_thread(_cerrar_subida_diferida, subida, prediction)
+    estado_ia = prediction["predicted_label"].lower()
+    if subida["status"] == "error":
+        return await asyncio.to_thread(_diario_o_respuesta, subida, escaneo_id, campos, estado_ia, image_bytes, {})
 
-    # ------------------------------
-    # 6) Registrar producto nuevo
-    # ------------------------------
-    nuevo = supabase.table("productos").insert({
-        "codigo_barras": codigo_barras,
-        "nombre": nombre,
-        "marca": marca,
-        "modelo": modelo,
-        "compatibilidad": compatibilidad,
-        "categoria_id": int(categoria_id) if categoria_id and str(categoria_id).isdigit() else None,
-        "observaciones": observaciones,
-        "stock": 1,
-        "estado": estado_ia,
-        "disponibilidad": get_disponibilidad(1),
-        "created_at": current_time,
-        "updated_at": current_time,
-        "imagen_url": public_url
-    }).execute()
+    return {
+        'status': 'pendiente', 'campos': campos, 'estado_ia': estado_ia, 'subida': subida,
+        # La imagen no se retiene hasta la escritura del grupo (LOTE_ESCRITURA ítems):
+        # solo hace falta si el escaneo termina en el diario, y se relee del spool
+        'escaneo_id': escaneo_id, 'imagen': item.get("imagen"),
+    }
 
+
+async def _escribir_lote_async(pendientes: list) -> list:
+    """
+    Escribe los escaneos del grupo con una sola llamada al repositorio
+    (``registrar_escaneos_lote``). Si la base rechaza el lote, se reintenta
+    escaneo por escaneo para que un ítem inválido no arrastre a los demás.
+    """
+    circuito = obtener_circuito()
+    if repositorio is None or not circuito.permite():
+        return [{"status": "error", "message": "Supabase no disponible (circuito abierto).", "sin_conexion": True}
+                for _ in pendientes]
+
+    parametros = [
+        _parametros_escaneo(p["campos"], p["estado_ia"], p["subida"], [p["escaneo_id"]]) for p in pendientes
+    ]
+    try:
+        filas = await repositorio.registrar_escaneos_async(parametros)
+    except Exception as e:
+        circuito.registrar(e)
+        if es_error_de_conexion(e):
+            return [_error_escritura(e) for _ in pendientes]
+        bitacora.advertencia("Escritura en lote rechazada, se reintenta por ítem", error=repr(e), items=len(pendientes))
+        return list(await asyncio.gather(*(
+            _escribir_escaneo_async(p["campos"], p["estado_ia"], p["subida"], [p["escaneo_id"]])
+            for p in pendientes
+        )))
+    circuito.registrar(None)
+    return [_fila_escrita(fila) for fila in filas]
+
+
+def _cerrar_items_lote(pendientes: list, escrituras: list) -> list:
+    """Respuesta de cada ítem escrito: confirma su subida diferida o lo manda al diario si no hubo conexión."""
+    respuestas = []
+    for p, escritura in zip(pendientes, escrituras):
+        if escritura["status"] == "success":
+            escritura = _respuesta_escaneo(escritura["fila"], p["estado_ia"], p["subida"])
+        image_bytes = _releer_imagen_del_item(p["imagen"]) if escritura.get("sin_conexion") else None
+        respuestas.append(_diario_o_respuesta(
+            escritura, p["escaneo_id"], p["campos"], p["estado_ia"], image_bytes, p["subida"]
+        ))
+    return respuestas
+
+
+async def registrar_lote_async(items: list) -> dict:
+    """
+    Registra muchos escaneos en una request (tomas de inventario). Cada ítem trae
+    los campos del producto y ``imagen`` (bytes o un archivo con ``read()``).
+
+    Los ítems se procesan por grupos de LOTE_ESCRITURA: hasta LOTE_CONCURRENCIA
+    a la vez se clasifican (en lotes, con el micro-batching) y suben su imagen, y
+    después el grupo entero se escribe con una sola llamada a la base. El error
+    de un ítem no corta el lote: cada uno tiene su resultado, en el orden recibido.
+    El ``stock_actual`` de cada ítem es el del producto al terminar su grupo.
+    """
+    bitacora.info("Procesando lote", items=len(items))
+    if repositorio is None and obtener_diario() is None:
+        return {'status': 'error', 'message': 'Persistencia no inicializada.'}
+
+    limite = asyncio.Semaphore(max(1, settings.LOTE_CONCURRENCIA))
+
+    async def preparar(item: dict, sin_conexion: bool) -> dict:
+        async with limite:
+            try:
+                return await _preparar_item_lote(item, sin_conexion)
+            except Exception as e:
+                bitacora.error("Error procesando ítem del lote", error=repr(e))
+                return {'status': 'error', 'message': "Error interno procesando el ítem."}
+
+    resultados = []
+    grupo = max(1, settings.LOTE_ESCRITURA)
+    for inicio in range(0, len(items), grupo):
+        sin_conexion = _sin_conexion()
+        preparados = await asyncio.gather(*(preparar(item, sin_conexion) for item in items[inicio:inicio + grupo]))
+
+        pendientes = [p for p in preparados if p["status"] == "pendiente"]
+        if pendientes:
+            with medir("escritura"):
+                escrituras = await _escribir_lote_async(pendientes)
+            cerrados = iter(await asyncio.to_thread(_cerrar_items_lote, pendientes, escrituras))
+            preparados = [next(cerrados) if p["status"] == "pendiente" else p for p in preparados]
+        resultados += preparados
+
+    exitosos = sum(1 for r in resultados if r["status"] == "success")
     return {
         "status": "success",
-        "message": "Producto nuevo registrado.",
-        "producto_id": nuevo.data[0]["id"],
-        "estado_clasificado": estado_ia,
-        "stock_actual": 1,
-        "imagen_url": public_url
-    }
\ No newline at end of file
+        "total": len(resultados),
+        "exitosos": exitosos,
+        "fallidos": len(resultados) - exitosos,
+        "resultados": [
+            dict(r, indice=i, codigo_barras=items[i].get("codigo_barras")) for i, r in enumerate(resultados)
+        ],
+    }
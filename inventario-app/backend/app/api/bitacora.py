@@ -0,0 +1,142 @@
+# /backend/app/api/bitacora.py
+"""
+Logs estructurados y no bloqueantes para el camino de las requests.
+
+``print`` escribe a stdout en el momento, desde el event-loop: con el cuerpo de
+la request incluido (``image_base64``) eran megabytes por escaneo. Acá:
+
+- Cada evento es un mensaje más campos. Los campos largos (más de LOG_MAX_CAMPO
+  caracteres, o bytes) se reemplazan por su tamaño y una huella corta, así que
+  nunca se copia una imagen al log.
+- El logger solo encola (``QueueHandler``). Un hilo aparte (``QueueListener``)
+  formatea y escribe. Si la cola se llena, el evento se descarta y se cuenta;
+  la request no espera.
+- ``info`` se muestrea (LOG_MUESTREO_PCT). Las advertencias y los errores se
+  escriben siempre.
+- Con LOG_FORMATO=json sale una línea JSON por evento con ``severity`` y
+  ``message``, que Cloud Logging indexa. Con "texto" sale legible para desarrollo.
+
+Los fallos de los trabajos en segundo plano (cola de subidas, diario offline)
+también pasan por acá, con el mismo formato que los de las requests. Los
+mensajes de arranque (``[INIT]``) siguen con ``print``: salen una vez por worker.
+"""
+import hashlib
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from typing import Optional
+
+from .config import settings
+
+# Para la huella de un campo largo alcanza con el tamaño, el comienzo y el final: sin
+# recorrer megabytes de base64 en el event-loop
+_BYTES_HUELLA = 4096
+
+
+def resumir(valor, max_caracteres: int = settings.LOG_MAX_CAMPO):
+    """Devuelve el valor tal cual si es corto; si no, '<N caracteres huella=...>'."""
+    if isinstance(valor, (bytes, bytearray, memoryview)):
+        datos = bytes(valor[:_BYTES_HUELLA]) + bytes(valor[-_BYTES_HUELLA:])
+        return f"<{len(valor)} bytes huella={hashlib.blake2b(datos, digest_size=6).hexdigest()}>"
+    if isinstance(valor, str) and len(valor) > max_caracteres:
+        datos = (valor[:_BYTES_HUELLA] + valor[-_BYTES_HUELLA:]).encode("utf-8", "replace")
+        return f"<{len(valor)} caracteres huella={hashlib.blake2b(datos, digest_size=6).hexdigest()}>"
+    if isinstance(valor, dict):
+        return resumir_campos(valor, max_caracteres)
+    return valor
+
+
+def resumir_campos(campos: dict, max_caracteres: int = settings.LOG_MAX_CAMPO) -> dict:
+    return {clave: resumir(valor, max_caracteres) for clave, valor in campos.items()}
+
+
+class FormatoJson(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        evento = {
+            "severity": record.levelname,
+            "message": record.getMessage(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "logger": record.name,
+        }
+        evento.update(getattr(record, "campos", None) or {})
+        return json.dumps(evento, ensure_ascii=False, default=str)
+
+
+class FormatoTexto(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        campos = getattr(record, "campos", None) or {}
+        detalle = " ".join(f"{clave}={valor}" for clave, valor in campos.items())
+        return f"[{record.levelname}] {record.getMessage()}{' ' + detalle if detalle else ''}"
+
+
+class _ManejadorCola(logging.handlers.QueueHandler):
+    """QueueHandler que descarta (y cuenta) en vez de bloquear o fallar con la cola llena."""
+
+    descartados = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _ManejadorCola.descartados += 1
+
+
+# ------------------------------
+# INSTANCIA POR WORKER
+# ------------------------------
+_logger = logging.getLogger("nexa")
+_logger.propagate = False
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def iniciar_bitacora() -> logging.Logger:
+    """Arranca el hilo escritor (idempotente; lo llama el lifespan y, si hace falta, el primer evento)."""
+    global _listener
+    if _listener is not None:
+        return _logger
+    salida = logging.StreamHandler(sys.stdout)
+    salida.setFormatter(FormatoJson() if settings.LOG_FORMATO == "json" else FormatoTexto())
+    cola = queue.Queue(maxsize=max(1, settings.LOG_COLA_MAX))
+    _logger.handlers[:] = [_ManejadorCola(cola)]
+    _logger.setLevel(settings.LOG_NIVEL.upper())
+    _listener = logging.handlers.QueueListener(cola, salida)
+    _listener.start()
+    return _logger
+
+
+def detener_bitacora():
+    """Escribe lo que quedó en la cola y detiene el hilo escritor."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _emitir(nivel: int, mensaje: str, campos: dict):
+    if _listener is None:
+        iniciar_bitacora()
+    if _logger.isEnabledFor(nivel):
+        _logger.log(nivel, mensaje, extra={"campos": resumir_campos(campos)})
+
+
+def info(mensaje: str, **campos):
+    """Evento informativo; se escribe solo la fracción LOG_MUESTREO_PCT."""
+    if settings.LOG_MUESTREO_PCT < 100 and random.random() * 100 >= settings.LOG_MUESTREO_PCT:
+        return
+    _emitir(logging.INFO, mensaje, campos)
+
+
+def advertencia(mensaje: str, **campos):
+    _emitir(logging.WARNING, mensaje, campos)
+
+
+def error(mensaje: str, **campos):
+    _emitir(logging.ERROR, mensaje, campos)
+
+
+def descartados() -> int:
+    return _ManejadorCola.descartados
@@ -0,0 +1,211 @@
+# /backend/app/api/cache_predicciones.py
+"""
+Caché de predicciones por contenido de la imagen.
+
+Los clientes reintentan la misma captura después de un corte de red y algunos
+dispositivos reenvían una foto ya cacheada. La clave es un hash de los bytes de
+la imagen prefijado con la versión del modelo (hash del archivo .tflite), así
+que al cambiar ``modelo_final_v3.tflite`` las entradas viejas dejan de usarse solas.
+
+- LRU local acotado por memoria, con contadores de aciertos/fallos/desalojos.
+- Opcional: hash perceptual (dHash 64 bits sobre el tensor ya preprocesado) para
+  fotos casi idénticas; ahorra el invoke, no la decodificación.
+- Opcional: Redis como backend compartido entre los workers de gunicorn.
+
+Se guardan las probabilidades, no la etiqueta: el umbral de confianza se sigue
+aplicando en cada request.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from .config import settings
+
+# Costo aproximado de una entrada además de las probabilidades (clave, OrderedDict, ndarray)
+_OVERHEAD_ENTRADA = 200
+
+
+def huella_perceptual(input_tensor: np.ndarray) -> str:
+    """dHash de 64 bits del tensor (1, 224, 224, 3): compara el brillo de bloques vecinos."""
+    gris = input_tensor[0].mean(axis=2)
+    filas = np.array_split(gris, 8, axis=0)
+    bloques = np.array([[bloque.mean() for bloque in np.array_split(fila, 9, axis=1)] for fila in filas])
+    bits = bloques[:, 1:] > bloques[:, :-1]
+    return np.packbits(bits).tobytes().hex()
+
+
+class CachePredicciones:
+    def __init__(
+        self,
+        version_modelo: str,
+        max_bytes: int = settings.CACHE_PREDICCIONES_MAX_MB * 1024 * 1024,
+        perceptual: bool = settings.CACHE_PREDICCIONES_PHASH,
+        redis_url: str = settings.CACHE_PREDICCIONES_REDIS_URL,
+        ttl_s: int = settings.CACHE_PREDICCIONES_TTL_S,
+    ):
+        self.version_modelo = version_modelo
+        self.max_bytes = max_bytes
+        self.perceptual = perceptual
+        self.ttl = ttl_s
+        self._lock = threading.Lock()
+        self._entradas: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.bytes_usados = 0
+        self.aciertos = 0
+        self.aciertos_perceptuales = 0
+        self.aciertos_compartidos = 0
+        self.fallos = 0
+        self.desalojos = 0
+        self.errores_compartido = 0
+
+        self._redis = None
+        if redis_url:
+            # Dependencia opcional: solo hace falta si se configura el backend compartido
+            import redis
+            self._redis = redis.Redis.from_url(redis_url, socket_timeout=0.05, socket_connect_timeout=0.05)
+
+    # ------------------------------
+    # Claves
+    # ------------------------------
+    def clave(self, image_data: bytes) -> str:
+        return f"pred:{self.version_modelo}:{hashlib.blake2b(image_data, digest_size=16).hexdigest()}"
+
+    def clave_perceptual(self, input_tensor: np.ndarray) -> str:
+        return f"pred:{self.version_modelo}:p:{huella_perceptual(input_tensor)}"
+
+    @property
+    def compartida(self) -> bool:
+        return self._redis is not None
+
+    # ------------------------------
+    # Uso desde la predicción
+    # ------------------------------
+    def buscar(self, image_data: bytes):
+        """Devuelve (probabilidades | None, claves a guardar después de la inferencia)."""
+        clave = self.clave(image_data)
+        return self.obtener(clave), [clave]
+
+    def buscar_perceptual(self, input_tensor: np.ndarray, claves: list) -> Optional[np.ndarray]:
+        """Segunda oportunidad con el hash perceptual, una vez preprocesada la imagen."""
+        if not self.perceptual:
+            return None
+        clave = self.clave_perceptual(input_tensor)
+        probabilidades = self.obtener(clave, perceptual=True)
+        if probabilidades is not None:
+            # El próximo reenvío de estos mismos bytes ya acierta sin decodificar
+            self.guardar(claves, probabilidades)
+        else:
+            claves.append(clave)
+        return probabilidades
+
+    # ------------------------------
+    # Lectura / escritura
+    # ------------------------------
+    def obtener(self, clave: str, perceptual: bool = False) -> Optional[np.ndarray]:
+        with self._lock:
+            probabilidades = self._entradas.get(clave)
+            if probabilidades is not None:
+                self._entradas.move_to_end(clave)
+                if perceptual:
+                    self.aciertos_perceptuales += 1
+                else:
+                    self.aciertos += 1
+                return probabilidades
+
+        probabilidades = self._obtener_compartido(clave)
+        with self._lock:
+            if probabilidades is None:
+                self.fallos += 1
+                return None
+            self.aciertos_compartidos += 1
+            self._guardar_local(clave, probabilidades)
+        return probabilidades
+
+    def guardar(self, claves: list, probabilidades: np.ndarray):
+        probabilidades = np.array(probabilidades, dtype=np.float32)
+        with self._lock:
+            for clave in claves:
+                self._guardar_local(clave, probabilidades)
+        for clave in claves:
+            self._guardar_compartido(clave, probabilidades)
+
+    def _guardar_local(self, clave: str, probabilidades: np.ndarray):
+        anterior = self._entradas.pop(clave, None)
+        if anterior is not None:
+            self.bytes_usados -= len(clave) + anterior.nbytes + _OVERHEAD_ENTRADA
+        self._entradas[clave] = probabilidades
+        self.bytes_usados += len(clave) + probabilidades.nbytes + _OVERHEAD_ENTRADA
+
+        while self.bytes_usados > self.max_bytes and self._entradas:
+            clave_vieja, vieja = self._entradas.popitem(last=False)
+            self.bytes_usados -= len(clave_vieja) + vieja.nbytes + _OVERHEAD_ENTRADA
+            self.desalojos += 1
+
+    def _obtener_compartido(self, clave: str) -> Optional[np.ndarray]:
+        if self._redis is None:
+            return None
+        try:
+            valor = self._redis.get(clave)
+        except Exception:
+            self.errores_compartido += 1
+            return None
+        return np.array(json.loads(valor), dtype=np.float32) if valor else None
+
+    def _guardar_compartido(self, clave: str, probabilidades: np.ndarray):
+        if self._redis is None:
+            return
+        try:
+            self._redis.set(clave, json.dumps(probabilidades.tolist()), ex=self.ttl)
+        except Exception:
+            self.errores_compartido += 1
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "version_modelo": self.version_modelo,
+                "entradas": len(self._entradas),
+                "bytes_usados": self.bytes_usados,
+                "max_bytes": self.max_bytes,
+                "aciertos": self.aciertos,
+                "aciertos_perceptuales": self.aciertos_perceptuales,
+                "aciertos_compartidos": self.aciertos_compartidos,
+                "fallos": self.fallos,
+                "desalojos": self.desalojos,
+                "perceptual": self.perceptual,
+                "backend_compartido": self.compartida,
+                "errores_compartido": self.errores_compartido,
+            }
+
+
+# ------------------------------
+# INSTANCIA POR WORKER
+# ------------------------------
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def obtener_cache_predicciones(version_modelo: str) -> Optional[CachePredicciones]:
+    """Caché de la versión de modelo indicada (None si CACHE_PREDICCIONES es 0)."""
+    if not settings.CACHE_PREDICCIONES:
+        return None
+    cache = _caches.get(version_modelo)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(version_modelo)
+            if cache is None:
+                cache = CachePredicciones(
+                    version_modelo,
+                    settings.CACHE_PREDICCIONES_MAX_MB * 1024 * 1024,
+                    settings.CACHE_PREDICCIONES_PHASH,
+                    settings.CACHE_PREDICCIONES_REDIS_URL,
+                    settings.CACHE_PREDICCIONES_TTL_S,
+                )
+                _caches[version_modelo] = cache
+    return cache
+
+
+def estadisticas_caches() -> list:
+    return [cache.estadisticas() for cache in list(_caches.values())]
@@ -0,0 +1,115 @@
+# /backend/app/api/circuito.py
+"""
+Circuit breaker para las llamadas a Supabase.
+
+Después de ``umbral`` fallas de conexión seguidas el circuito se abre y durante
+``enfriamiento_s`` las requests no intentan llamar a Supabase (fallan al instante
+y el escaneo va al diario offline). Pasado ese tiempo queda semiabierto: deja pasar
+una sola llamada de prueba; si sale bien se cierra, si falla vuelve a abrirse.
+
+Solo cuentan los errores de conectividad (timeouts, conexión rechazada, 5xx):
+un 4xx de PostgREST es un error de la request, no del servidor.
+"""
+import threading
+import time
+from typing import Optional
+
+import httpx
+
+from .config import settings
+
+CERRADO = "cerrado"
+ABIERTO = "abierto"
+SEMIABIERTO = "semiabierto"
+
+
+def es_error_de_conexion(error: Exception) -> bool:
+    """True si el error indica que Supabase no está disponible (y no un error de la request)."""
+    # Ojo: no cualquier OSError (una imagen ilegible para PIL también lo es)
+    if isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError)):
+        return True
+    # postgrest.APIError (code) / storage3 StorageApiError (status)
+    codigo = str(getattr(error, "status", "") or getattr(error, "code", "") or "")
+    return codigo.startswith("5") or codigo in ("PGRST000", "PGRST001", "PGRST002")
+
+
+class CircuitoRemoto:
+    def __init__(
+        self,
+        umbral: int = settings.CIRCUITO_UMBRAL,
+        enfriamiento_s: float = settings.CIRCUITO_ENFRIAMIENTO_S,
+    ):
+        self.umbral = max(1, umbral)
+        self.enfriamiento = enfriamiento_s
+        self._lock = threading.Lock()
+        self.estado = CERRADO
+        self._fallas_seguidas = 0
+        self._abierto_desde = 0.0
+        self._prueba_en_curso = False
+        self.aperturas = 0
+        self.rechazadas = 0
+
+    @property
+    def disponible(self) -> bool:
+        """False mientras el circuito está abierto y no pasó el enfriamiento (no consume la prueba)."""
+        with self._lock:
+            return not (self.estado == ABIERTO and time.monotonic() - self._abierto_desde < self.enfriamiento)
+
+    def permite(self) -> bool:
+        """¿Se puede llamar a Supabase ahora? En semiabierto solo una llamada de prueba a la vez."""
+        with self._lock:
+            if self.estado == ABIERTO and time.monotonic() - self._abierto_desde >= self.enfriamiento:
+                self.estado = SEMIABIERTO
+            if self.estado == CERRADO:
+                return True
+            if self.estado == SEMIABIERTO and not self._prueba_en_curso:
+                self._prueba_en_curso = True
+                return True
+            self.rechazadas += 1
+            return False
+
+    def exito(self):
+        with self._lock:
+            self.estado = CERRADO
+            self._fallas_seguidas = 0
+            self._prueba_en_curso = False
+
+    def fallo(self):
+        with self._lock:
+            self._fallas_seguidas += 1
+            self._prueba_en_curso = False
+            if self.estado == SEMIABIERTO or self._fallas_seguidas >= self.umbral:
+                if self.estado != ABIERTO:
+                    self.aperturas += 1
+                    print(f"[WARN] Supabase no disponible: circuito abierto por {self.enfriamiento} s.")
+                self.estado = ABIERTO
+                self._abierto_desde = time.monotonic()
+
+    def registrar(self, error: Optional[Exception]):
+        """Cuenta el resultado de una llamada: None = éxito; solo los errores de conexión abren."""
+        if error is None:
+            self.exito()
+        elif es_error_de_conexion(error):
+            self.fallo()
+        else:
+            # El servidor respondió: hay conexión aunque la request haya fallado
+            self.exito()
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "estado": self.estado,
+                "fallas_seguidas": self._fallas_seguidas,
+                "aperturas": self.aperturas,
+                "rechazadas": self.rechazadas,
+            }
+
+
+# ------------------------------
+# INSTANCIA POR WORKER
+# ------------------------------
+_circuito = CircuitoRemoto(settings.CIRCUITO_UMBRAL, settings.CIRCUITO_ENFRIAMIENTO_S)
+
+
+def obtener_circuito() -> CircuitoRemoto:
+    return _circuito
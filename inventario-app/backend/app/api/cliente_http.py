@@ -0,0 +1,81 @@
+# /backend/app/api/cliente_http.py
+"""
+Pool HTTP asíncrono compartido por las llamadas a Supabase (PostgREST y Storage).
+
+Se crea una vez por worker en el lifespan de FastAPI y lo reutilizan todas las
+requests: conexiones keep-alive (HTTP/2 si está ``h2``, multiplexando varias
+llamadas por conexión) en vez de un hilo bloqueado por cada llamada. Los hilos
+quedan para la inferencia y el disco.
+
+Tamaño y timeouts se ajustan con HTTP_*; el timeout de escritura es el del
+Storage (subidas) y el resto el de PostgREST.
+"""
+from typing import Optional
+
+import httpx
+
+from .config import settings
+
+
+def _http2_disponible() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def crear_cliente_http(
+    max_conexiones: int = settings.HTTP_MAX_CONEXIONES,
+    max_keepalive: int = settings.HTTP_MAX_KEEPALIVE,
+    keepalive_s: float = settings.HTTP_KEEPALIVE_S,
+    espera_pool_s: float = settings.HTTP_ESPERA_POOL_S,
+    http2: bool = settings.HTTP2,
+) -> httpx.AsyncClient:
+    if http2 and not _http2_disponible():
+        print("[WARN] HTTP2=1 pero falta el paquete h2 (httpx[http2]): se usa HTTP/1.1.")
+        http2 = False
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=max_conexiones,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_s,
+        ),
+        timeout=httpx.Timeout(
+            settings.SUPABASE_TIMEOUT_S,
+            write=settings.SUPABASE_TIMEOUT_STORAGE_S,
+            pool=espera_pool_s,
+        ),
+    )
+
+
+# ------------------------------
+# INSTANCIA POR WORKER
+# ------------------------------
+_cliente: Optional[httpx.AsyncClient] = None
+
+
+def obtener_cliente_http() -> Optional[httpx.AsyncClient]:
+    return _cliente
+
+
+def iniciar_cliente_http() -> httpx.AsyncClient:
+    global _cliente
+    if _cliente is None:
+        _cliente = crear_cliente_http(
+            settings.HTTP_MAX_CONEXIONES, settings.HTTP_MAX_KEEPALIVE,
+            settings.HTTP_KEEPALIVE_S, settings.HTTP_ESPERA_POOL_S, settings.HTTP2,
+        )
+        print(
+            f"[INIT] Pool HTTP listo ({settings.HTTP_MAX_CONEXIONES} conexiones, "
+            f"HTTP/2 {'sí' if settings.HTTP2 and _http2_disponible() else 'no'})."
+        )
+    return _cliente
+
+
+async def cerrar_cliente_http():
+    global _cliente
+    if _cliente is not None:
+        await _cliente.aclose()
+        _cliente = None
@@ -0,0 +1,138 @@
+# /backend/app/api/coalescencia.py
+"""
+Coalescencia de escrituras para escaneos repetidos del mismo producto.
+
+En recepción la pistola lee el mismo ``codigo_barras`` decenas de veces seguidas.
+En vez de una escritura por lectura, los incrementos de un mismo código se
+acumulan durante ``ventana_ms`` y se aplican con una sola llamada a
+``registrar_escaneo`` (stock += n, con los ``escaneo_id`` de todos), guardando el ``estado`` y las imágenes
+del último escaneo. Cada request recibe igualmente su propio stock acumulado.
+
+Las imágenes de los escaneos intermedios no se borran: se guardan por contenido
+y pueden estar referenciadas por otros productos (ver almacen_imagenes).
+"""
+import asyncio
+from typing import Callable, Optional
+
+from .config import settings
+
+
+class _Pendiente:
+    __slots__ = ("campos", "estado_ia", "subida", "escaneo_ids", "futuros", "temporizador")
+
+    def __init__(self, campos: dict):
+        self.campos = campos
+        self.estado_ia = None
+        self.subida = None
+        self.escaneo_ids = []
+        self.futuros = []
+        self.temporizador = None
+
+
+class CoalescedorEscaneos:
+    def __init__(
+        self,
+        escribir: Callable,
+        ventana_ms: int = settings.COALESCENCIA_VENTANA_MS,
+    ):
+        # escribir(campos, estado_ia, subida, escaneo_ids) -> {'status', 'fila'} (async); stock += len(escaneo_ids)
+        self._escribir = escribir
+        self.ventana = max(0, ventana_ms) / 1000
+        self._pendientes = {}
+        self._en_vuelo = set()
+        self._cerrado = False
+
+    async def registrar(self, campos: dict, estado_ia: str, subida: dict, escaneo_id: str) -> dict:
+        """Suma un escaneo al grupo de su código de barras y espera la escritura conjunta."""
+        if self._cerrado:
+            return await self._escribir(campos, estado_ia, subida, [escaneo_id])
+
+        loop = asyncio.get_running_loop()
+        clave = campos["codigo_barras"]
+        pendiente = self._pendientes.get(clave)
+        if pendiente is None:
+            pendiente = _Pendiente(campos)
+            pendiente.temporizador = loop.call_later(self.ventana, self._disparar, clave)
+            self._pendientes[clave] = pendiente
+
+        # Gana el último escaneo: su estado y su imagen quedan en el producto
+        pendiente.estado_ia = estado_ia
+        pendiente.subida = subida
+        pendiente.escaneo_ids.append(escaneo_id)
+
+        futuro = loop.create_future()
+        pendiente.futuros.append(futuro)
+        return await futuro
+
+    def _disparar(self, clave: str):
+        pendiente = self._pendientes.pop(clave, None)
+        if pendiente is None:
+            return
+        tarea = asyncio.get_running_loop().create_task(self._vaciar(pendiente))
+        self._en_vuelo.add(tarea)
+        tarea.add_done_callback(self._en_vuelo.discard)
+
+    async def _vaciar(self, pendiente: _Pendiente):
+        n = len(pendiente.futuros)
+        try:
+            escritura = await self._escribir(
+                pendiente.campos, pendiente.estado_ia, pendiente.subida, pendiente.escaneo_ids
+            )
+        except Exception as e:
+            for futuro in pendiente.futuros:
+                if not futuro.done():
+                    futuro.set_exception(e)
+            return
+
+        if escritura["status"] == "error":
+            for futuro in pendiente.futuros:
+                if not futuro.done():
+                    futuro.set_result(escritura)
+            return
+
+        # El i-ésimo escaneo del grupo ve el stock que había justo después de él
+        fila = escritura["fila"]
+        stock_final = fila["stock"]
+        for i, futuro in enumerate(pendiente.futuros):
+            fila_i = dict(fila, stock=stock_final - n + i + 1)
+            if i > 0 and fila["coincidencia"] == "nuevo":
+                fila_i["coincidencia"] = "código de barras"
+            if not futuro.done():
+                futuro.set_result({"status": "success", "fila": fila_i})
+
+    async def cerrar(self):
+        """Escribe todo lo pendiente; los escaneos posteriores se escriben sin agrupar."""
+        self._cerrado = True
+        for clave in list(self._pendientes):
+            self._pendientes[clave].temporizador.cancel()
+            self._disparar(clave)
+        if self._en_vuelo:
+            await asyncio.gather(*self._en_vuelo, return_exceptions=True)
+
+
+# ------------------------------
+# INSTANCIA POR WORKER
+# ------------------------------
+_coalescedor: Optional[CoalescedorEscaneos] = None
+
+
+def obtener_coalescedor() -> Optional[CoalescedorEscaneos]:
+    return _coalescedor
+
+
+def iniciar_coalescedor(escribir: Callable) -> Optional[CoalescedorEscaneos]:
+    """Activa la coalescencia en este worker (None si COALESCENCIA_VENTANA_MS es 0)."""
+    global _coalescedor
+    if settings.COALESCENCIA_VENTANA_MS <= 0:
+        return None
+    _coalescedor = CoalescedorEscaneos(escribir, settings.COALESCENCIA_VENTANA_MS)
+    print(f"[INIT] Coalescencia de escaneos activa (ventana {settings.COALESCENCIA_VENTANA_MS} ms).")
+    return _coalescedor
+
+
+async def detener_coalescedor():
+    """Vacía los incrementos pendientes antes de apagar el worker."""
+    global _coalescedor
+    if _coalescedor is not None:
+        await _coalescedor.cerrar()
+        _coalescedor = None
@@ -0,0 +1,353 @@
+# /backend/app/api/cola_subidas.py
+"""
+Cola persistente de subidas diferidas al Storage.
+
+Con SUBIDA_DIFERIDA la API responde apenas terminan la inferencia y la escritura
+del stock; la foto queda en esta cola y unos threads en segundo plano la suben
+(con reintentos) y después completan ``productos.imagen_url``.
+
+- Cada trabajo se guarda en disco antes de responder: ``<id>.img`` con los bytes
+  y ``<id>.json`` con el producto. El .json se escribe al final (write + fsync +
+  rename), así que un trabajo sin .json nunca se confirmó y se descarta al arrancar.
+- Cada worker de gunicorn toma un subdirectorio ``slot-N`` con un lock de archivo.
+  Si un worker muere, el que lo reemplaza toma el slot libre y retoma sus trabajos.
+- Está acotada en trabajos y en bytes. Si está llena, ``reservar`` devuelve None
+  y la request sube la imagen en línea como antes (contrapresión).
+- Si hay un trabajo más nuevo del mismo producto, o un escaneo posterior ya dejó
+  su imagen en línea (``invalidar``), el trabajo viejo se descarta: su imagen ya
+  no debe quedar en el producto.
+"""
+import fcntl
+import heapq
+import json
+import os
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+from .config import settings
+from . import bitacora
+
+
+class ColaSubidas:
+    def __init__(
+        self,
+        directorio: str,
+        procesar: Callable,
+        max_trabajos: int = settings.SUBIDA_COLA_MAX,
+        max_bytes: int = settings.SUBIDA_COLA_MAX_MB * 1024 * 1024,
+        trabajadores: int = settings.SUBIDA_TRABAJADORES,
+        reintentos: int = settings.SUBIDA_REINTENTOS,
+    ):
+        # procesar(producto_id, image_bytes, vigente) sube la imagen y, si vigente() sigue
+        # siendo True, actualiza el producto; lanza si falla
+        self._procesar = procesar
+        self.max_trabajos = max(1, max_trabajos)
+        self.max_bytes = max_bytes
+        self.reintentos = reintentos
+        self._cantidad_trabajadores = max(1, trabajadores)
+
+        self.directorio = self._tomar_slot(directorio)
+        self._cond = threading.Condition()
+        self._detenida = False
+        self._hilos = []
+        # (próximo intento, id) de los trabajos confirmados
+        self._listos = []
+        self._trabajos = {}
+        self._reservas = {}
+        # producto -> id del trabajo más nuevo (o marca de invalidación) y cantidad pendiente
+        self._ultimo_por_producto = {}
+        self._pendientes_por_producto = {}
+        self._bytes = 0
+        self._en_curso = 0
+
+        self.completadas = 0
+        self.fallidas = 0
+        self.reintentadas = 0
+        self.descartadas = 0
+        self.rechazadas = 0
+        self.ultimo_retraso_s = None
+
+    # ------------------------------
+    # Disco
+    # ------------------------------
+    def _tomar_slot(self, directorio: str) -> str:
+        os.makedirs(directorio, exist_ok=True)
+        slot = 0
+        while True:
+            ruta = os.path.join(directorio, f"slot-{slot}")
+            os.makedirs(ruta, exist_ok=True)
+            lock = open(os.path.join(ruta, ".lock"), "w")
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock.close()
+                slot += 1
+                continue
+            # Se mantiene abierto mientras viva el proceso
+            self._lock_slot = lock
+            return ruta
+
+    def _ruta(self, trabajo_id: str, extension: str) -> str:
+        return os.path.join(self.directorio, f"{trabajo_id}.{extension}")
+
+    @staticmethod
+    def _escribir_atomico(ruta: str, contenido: bytes):
+        temporal = ruta + ".tmp"
+        with open(temporal, "wb") as f:
+            f.write(contenido)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, ruta)
+
+    def _guardar_meta(self, trabajo: dict):
+        self._escribir_atomico(self._ruta(trabajo["id"], "json"), json.dumps(trabajo).encode("utf-8"))
+
+    def _borrar(self, trabajo_id: str):
+        for extension in ("json", "img", "img.tmp", "json.tmp"):
+            try:
+                os.remove(self._ruta(trabajo_id, extension))
+            except FileNotFoundError:
+                pass
+
+    def _recuperar(self):
+        """Vuelve a encolar los trabajos confirmados que quedaron en disco."""
+        archivos = os.listdir(self.directorio)
+        confirmados = {a[:-5] for a in archivos if a.endswith(".json")}
+        for archivo in archivos:
+            trabajo_id = archivo.split(".", 1)[0]
+            if archivo != ".lock" and trabajo_id not in confirmados:
+                self._borrar(trabajo_id)
+
+        for trabajo_id in sorted(confirmados):
+            try:
+                with open(self._ruta(trabajo_id, "json"), "rb") as f:
+                    trabajo = json.loads(f.read())
+                trabajo["bytes"] = os.path.getsize(self._ruta(trabajo_id, "img"))
+            except (OSError, ValueError) as e:
+                bitacora.advertencia("Trabajo de subida ilegible, se descarta", trabajo=trabajo_id, error=str(e))
+                self._borrar(trabajo_id)
+                continue
+            self._agregar(trabajo, time.time())
+        if confirmados:
+            print(f"[INIT] Cola de subidas: {len(self._trabajos)} trabajos recuperados de {self.directorio}.")
+
+    # ------------------------------
+    # Encolado (desde las requests)
+    # ------------------------------
+    def reservar(self, image_bytes: bytes) -> Optional[str]:
+        """Guarda la imagen en disco y reserva su lugar; None si la cola está llena."""
+        with self._cond:
+            ocupados = len(self._trabajos) + len(self._reservas)
+            if self._detenida or ocupados >= self.max_trabajos or self._bytes + len(image_bytes) > self.max_bytes:
+                self.rechazadas += 1
+                return None
+            # time_ns mantiene el orden de llegada también entre reinicios
+            trabajo_id = f"{time.time_ns():020d}-{random.getrandbits(32):08x}"
+            self._reservas[trabajo_id] = len(image_bytes)
+            self._bytes += len(image_bytes)
+
+        try:
+            self._escribir_atomico(self._ruta(trabajo_id, "img"), image_bytes)
+        except OSError:
+            self.descartar(trabajo_id)
+            raise
+        return trabajo_id
+
+    def confirmar(self, trabajo_id: str, producto_id: int):
+        """El escaneo ya está escrito: la imagen queda pendiente de subir para ``producto_id``."""
+        with self._cond:
+            tamano = self._reservas.get(trabajo_id)
+        if tamano is None:
+            return
+        trabajo = {"id": trabajo_id, "producto_id": producto_id, "creado": time.time(), "intentos": 0}
+        self._guardar_meta(trabajo)
+        trabajo["bytes"] = tamano
+        with self._cond:
+            del self._reservas[trabajo_id]
+            self._bytes -= tamano
+            self._agregar(trabajo, trabajo["creado"])
+
+    def descartar(self, trabajo_id: str):
+        """La escritura del escaneo falló: se libera la reserva."""
+        with self._cond:
+            tamano = self._reservas.pop(trabajo_id, None)
+            if tamano is not None:
+                self._bytes -= tamano
+        self._borrar(trabajo_id)
+
+    def invalidar(self, producto_id: int):
+        """Un escaneo del producto ya guardó su imagen en línea: los trabajos anteriores sobran."""
+        with self._cond:
+            if producto_id in self._ultimo_por_producto:
+                # "~" ordena después de cualquier sufijo hexadecimal de los ids con el mismo instante
+                self._ultimo_por_producto[producto_id] = f"{time.time_ns():020d}-~"
+
+    def _vigente(self, trabajo: dict) -> bool:
+        return self._ultimo_por_producto.get(trabajo["producto_id"]) == trabajo["id"]
+
+    def _agregar(self, trabajo: dict, cuando: float):
+        with self._cond:
+            producto_id = trabajo["producto_id"]
+            self._trabajos[trabajo["id"]] = trabajo
+            self._bytes += trabajo["bytes"]
+            anterior = self._ultimo_por_producto.get(producto_id)
+            if anterior is None or trabajo["id"] > anterior:
+                self._ultimo_por_producto[producto_id] = trabajo["id"]
+            self._pendientes_por_producto[producto_id] = self._pendientes_por_producto.get(producto_id, 0) + 1
+            heapq.heappush(self._listos, (cuando, trabajo["id"]))
+            self._cond.notify()
+
+    # ------------------------------
+    # Trabajadores
+    # ------------------------------
+    def iniciar(self):
+        self._recuperar()
+        for i in range(self._cantidad_trabajadores):
+            hilo = threading.Thread(target=self._bucle, name=f"subidas-{i}", daemon=True)
+            hilo.start()
+            self._hilos.append(hilo)
+
+    def detener(self, timeout: float = 10.0):
+        """Termina las subidas en curso; lo pendiente queda en disco para el próximo arranque."""
+        with self._cond:
+            self._detenida = True
+            self._cond.notify_all()
+        limite = time.monotonic() + timeout
+        for hilo in self._hilos:
+            hilo.join(max(0.0, limite - time.monotonic()))
+        self._lock_slot.close()
+
+    def _siguiente(self) -> Optional[dict]:
+        with self._cond:
+            while not self._detenida:
+                if self._listos:
+                    cuando, trabajo_id = self._listos[0]
+                    espera = cuando - time.time()
+                    if espera <= 0:
+                        heapq.heappop(self._listos)
+                        self._en_curso += 1
+                        return self._trabajos[trabajo_id]
+                    self._cond.wait(espera)
+                else:
+                    self._cond.wait()
+            return None
+
+    def _bucle(self):
+        while True:
+            trabajo = self._siguiente()
+            if trabajo is None:
+                return
+            try:
+                self._ejecutar(trabajo)
+            finally:
+                with self._cond:
+                    self._en_curso -= 1
+
+    def _ejecutar(self, trabajo: dict):
+        trabajo_id, producto_id = trabajo["id"], trabajo["producto_id"]
+        if not self._vigente(trabajo):
+            # Hay una imagen más nueva del mismo producto
+            self._terminar(trabajo)
+            with self._cond:
+                self.descartadas += 1
+            return
+
+        try:
+            with open(self._ruta(trabajo_id, "img"), "rb") as f:
+                image_bytes = f.read()
+            self._procesar(producto_id, image_bytes, lambda: self._vigente(trabajo))
+        except Exception as e:
+            trabajo["intentos"] += 1
+            if trabajo["intentos"] > self.reintentos:
+                bitacora.error(
+                    "Subida diferida descartada", producto_id=producto_id, intentos=trabajo["intentos"], error=str(e)
+                )
+                self._terminar(trabajo)
+                with self._cond:
+                    self.fallidas += 1
+                return
+            self._guardar_meta({k: v for k, v in trabajo.items() if k != "bytes"})
+            # Backoff exponencial con jitter, hasta 5 minutos
+            espera = min(300.0, 2 ** trabajo["intentos"]) * random.uniform(0.5, 1.0)
+            bitacora.advertencia(
+                "Subida diferida fallida, se reintenta", producto_id=producto_id, intentos=trabajo["intentos"],
+                reintento_s=round(espera, 1), error=str(e),
+            )
+            with self._cond:
+                self.reintentadas += 1
+                heapq.heappush(self._listos, (time.time() + espera, trabajo_id))
+                self._cond.notify()
+            return
+
+        self._terminar(trabajo)
+        with self._cond:
+            self.completadas += 1
+            self.ultimo_retraso_s = round(time.time() - trabajo["creado"], 3)
+
+    def _terminar(self, trabajo: dict):
+        self._borrar(trabajo["id"])
+        with self._cond:
+            producto_id = trabajo["producto_id"]
+            self._trabajos.pop(trabajo["id"], None)
+            self._bytes -= trabajo["bytes"]
+            self._pendientes_por_producto[producto_id] -= 1
+            if self._pendientes_por_producto[producto_id] == 0:
+                del self._pendientes_por_producto[producto_id]
+                del self._ultimo_por_producto[producto_id]
+
+    def estadisticas(self) -> dict:
+        with self._cond:
+            mas_viejo = min((t["creado"] for t in self._trabajos.values()), default=None)
+            return {
+                "directorio": self.directorio,
+                "pendientes": len(self._trabajos),
+                "reservas": len(self._reservas),
+                "en_curso": self._en_curso,
+                "bytes": self._bytes,
+                "max_trabajos": self.max_trabajos,
+                "max_bytes": self.max_bytes,
+                "completadas": self.completadas,
+                "reintentadas": self.reintentadas,
+                "fallidas": self.fallidas,
+                "descartadas": self.descartadas,
+                "rechazadas": self.rechazadas,
+                "antiguedad_max_s": round(time.time() - mas_viejo, 3) if mas_viejo else None,
+                "ultimo_retraso_s": self.ultimo_retraso_s,
+            }
+
+
+# ------------------------------
+# INSTANCIA POR WORKER
+# ------------------------------
+_cola: Optional[ColaSubidas] = None
+
+
+def obtener_cola_subidas() -> Optional[ColaSubidas]:
+    return _cola
+
+
+def iniciar_cola_subidas(procesar: Callable) -> Optional[ColaSubidas]:
+    """Activa las subidas diferidas en este worker (None si SUBIDA_DIFERIDA es 0)."""
+    global _cola
+    if not settings.SUBIDA_DIFERIDA:
+        return None
+    _cola = ColaSubidas(
+        settings.SUBIDA_COLA_DIR,
+        procesar,
+        settings.SUBIDA_COLA_MAX,
+        settings.SUBIDA_COLA_MAX_MB * 1024 * 1024,
+        settings.SUBIDA_TRABAJADORES,
+        settings.SUBIDA_REINTENTOS,
+    )
+    _cola.iniciar()
+    print(f"[INIT] Subidas diferidas activas ({_cola.directorio}, {settings.SUBIDA_TRABAJADORES} hilos).")
+    return _cola
+
+
+def detener_cola_subidas():
+    global _cola
+    if _cola is not None:
+        _cola.detener()
+        _cola = None
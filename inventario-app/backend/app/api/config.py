@@ -0,0 +1,184 @@
+# /backend/app/api/config.py
+import os
+import tempfile
+
+
+def _env_int(nombre: str, defecto: int) -> int:
+    valor = os.getenv(nombre)
+    return int(valor) if valor not in (None, "") else defecto
+
+
+class Settings:
+    # ------------------------------
+    # MODELO IA
+    # ------------------------------
+    # Runtime TFLite: "auto" (LiteRT -> tflite_runtime -> tensorflow), "litert",
+    # "tflite_runtime" o "tensorflow".
+    IA_RUNTIME: str = os.getenv("IA_RUNTIME", "auto")
+    # Hilos de cada intérprete y uso del delegate XNNPACK (1 = activo)
+    IA_HILOS_INTERPRETE: int = _env_int("IA_HILOS_INTERPRETE", 1)
+    IA_XNNPACK: bool = _env_int("IA_XNNPACK", 1) == 1
+
+    # Cantidad de intérpretes TFLite precargados por worker. Cada request
+    # toma uno del pool y lo devuelve al terminar (el intérprete no es thread-safe).
+    IA_POOL_INTERPRETES: int = _env_int("IA_POOL_INTERPRETES", min(4, os.cpu_count() or 1))
+
+    # Preprocesamiento rápido: decodifica el JPEG ya reducido (draft/DCT) cerca de
+    # 224x224 en vez de la resolución completa. No es bit a bit igual a Keras; ver
+    # modelo_ia/test_preprocesamiento.py antes de activarlo (1 = activo).
+    IA_PREPROCESO_RAPIDO: bool = _env_int("IA_PREPROCESO_RAPIDO", 0) == 1
+    # Máximo de píxeles (ancho x alto) aceptado, se valida leyendo solo la cabecera
+    IA_MAX_PIXELES: int = _env_int("IA_MAX_PIXELES", 64_000_000)
+
+    # Micro-batching: se juntan hasta IA_LOTE_MAX imágenes durante como máximo
+    # IA_LOTE_ESPERA_MS antes de un único invoke. IA_LOTE_MAX=1 lo desactiva.
+    # Cada puesto del pool guarda un intérprete por tamaño (1, 2, 4, ... IA_LOTE_MAX).
+    IA_LOTE_MAX: int = _env_int("IA_LOTE_MAX", 8)
+    IA_LOTE_ESPERA_MS: int = _env_int("IA_LOTE_ESPERA_MS", 5)
+    # Tensores que pueden esperar lote; con la cola llena la request recibe 503
+    IA_COLA_MAX: int = _env_int("IA_COLA_MAX", 128)
+    # Invokes de calentamiento por intérprete al arrancar (0 = sin calentamiento):
+    # la instancia se declara lista (/listo) recién después
+    IA_CALENTAMIENTO: int = _env_int("IA_CALENTAMIENTO", 2)
+
+    # Caché de predicciones por hash de la imagen (1 = activo), acotada en MB.
+    # CACHE_PREDICCIONES_PHASH=1 suma un hash perceptual para fotos casi idénticas.
+    # Con CACHE_PREDICCIONES_REDIS_URL la caché se comparte entre workers (TTL en segundos).
+    CACHE_PREDICCIONES: bool = _env_int("CACHE_PREDICCIONES", 1) == 1
+    CACHE_PREDICCIONES_MAX_MB: int = _env_int("CACHE_PREDICCIONES_MAX_MB", 16)
+    CACHE_PREDICCIONES_PHASH: bool = _env_int("CACHE_PREDICCIONES_PHASH", 0) == 1
+    CACHE_PREDICCIONES_REDIS_URL: str = os.getenv("CACHE_PREDICCIONES_REDIS_URL", "")
+    CACHE_PREDICCIONES_TTL_S: int = _env_int("CACHE_PREDICCIONES_TTL_S", 86400)
+
+    # ------------------------------
+    # ESCRITURAS
+    # ------------------------------
+    # Ventana en la que se agrupan los escaneos repetidos de un mismo código de
+    # barras en una sola escritura (stock += n). 0 = desactivado.
+    COALESCENCIA_VENTANA_MS: int = _env_int("COALESCENCIA_VENTANA_MS", 0)
+
+    # ------------------------------
+    # IMÁGENES
+    # ------------------------------
+    # Las imágenes se guardan por hash de contenido. Cada worker recuerda hasta
+    # IMAGENES_CONOCIDAS_MAX nombres ya presentes en el bucket para no volver a subirlos.
+    IMAGENES_CONOCIDAS_MAX: int = _env_int("IMAGENES_CONOCIDAS_MAX", 50000)
+    # 1 = antes de subir una imagen desconocida se pregunta al Storage si existe (HEAD).
+    # Ahorra subir bytes repetidos a costa de una ida y vuelta extra en las imágenes nuevas.
+    IMAGENES_VERIFICAR_EXISTENCIA: bool = _env_int("IMAGENES_VERIFICAR_EXISTENCIA", 0) == 1
+
+    # Variantes que se suben en vez de la foto de la cámara (1 = activo): una vista
+    # comprimida y una miniatura, generadas con la misma decodificación de la inferencia.
+    # Lado mayor en píxeles, calidad y formato ("jpeg" o "webp").
+    IMAGENES_VARIANTES: bool = _env_int("IMAGENES_VARIANTES", 1) == 1
+    IMAGENES_VISTA_LADO: int = _env_int("IMAGENES_VISTA_LADO", 1280)
+    IMAGENES_MINIATURA_LADO: int = _env_int("IMAGENES_MINIATURA_LADO", 256)
+    IMAGENES_CALIDAD: int = _env_int("IMAGENES_CALIDAD", 80)
+    IMAGENES_FORMATO: str = os.getenv("IMAGENES_FORMATO", "jpeg")
+    # 1 = además se sube la foto original tal como llegó
+    IMAGENES_GUARDAR_ORIGINAL: bool = _env_int("IMAGENES_GUARDAR_ORIGINAL", 0) == 1
+
+    # Subida diferida (1 = activo): la API responde sin esperar al Storage y la imagen
+    # queda en una cola en disco que suben SUBIDA_TRABAJADORES hilos por worker.
+    # Para que sobreviva a que se recree el contenedor, SUBIDA_COLA_DIR debe ser un volumen.
+    SUBIDA_DIFERIDA: bool = _env_int("SUBIDA_DIFERIDA", 0) == 1
+    SUBIDA_COLA_DIR: str = os.getenv("SUBIDA_COLA_DIR", os.path.join(tempfile.gettempdir(), "nexa_subidas"))
+    # Límites de la cola por worker; llena, las requests vuelven a subir en línea
+    SUBIDA_COLA_MAX: int = _env_int("SUBIDA_COLA_MAX", 500)
+    SUBIDA_COLA_MAX_MB: int = _env_int("SUBIDA_COLA_MAX_MB", 1024)
+    SUBIDA_TRABAJADORES: int = _env_int("SUBIDA_TRABAJADORES", 2)
+    SUBIDA_REINTENTOS: int = _env_int("SUBIDA_REINTENTOS", 8)
+
+    # ------------------------------
+    # PERSISTENCIA
+    # ------------------------------
+    # "supabase" (producción) o "local": SQLite + carpeta de imágenes, sin nube
+    # (benchmarks, pruebas de carga, despliegue en el borde). Las imágenes locales
+    # se publican en PERSISTENCIA_LOCAL_URL.
+    PERSISTENCIA: str = os.getenv("PERSISTENCIA", "supabase")
+    PERSISTENCIA_LOCAL_DIR: str = os.getenv(
+        "PERSISTENCIA_LOCAL_DIR", os.path.join(tempfile.gettempdir(), "nexa_local")
+    )
+    PERSISTENCIA_LOCAL_URL: str = os.getenv("PERSISTENCIA_LOCAL_URL", "/almacen")
+
+    # ------------------------------
+    # SUPABASE / MODO SIN CONEXIÓN
+    # ------------------------------
+    # Timeouts de las llamadas (el cliente trae 120 s por defecto para PostgREST)
+    SUPABASE_TIMEOUT_S: int = _env_int("SUPABASE_TIMEOUT_S", 5)
+    SUPABASE_TIMEOUT_STORAGE_S: int = _env_int("SUPABASE_TIMEOUT_STORAGE_S", 20)
+    # Pool HTTP asíncrono compartido (ver cliente_http.py): conexiones máximas,
+    # keep-alive y segundos de espera por una conexión libre. HTTP2=1 requiere h2.
+    HTTP_MAX_CONEXIONES: int = _env_int("HTTP_MAX_CONEXIONES", 100)
+    HTTP_MAX_KEEPALIVE: int = _env_int("HTTP_MAX_KEEPALIVE", 20)
+    HTTP_KEEPALIVE_S: int = _env_int("HTTP_KEEPALIVE_S", 30)
+    HTTP_ESPERA_POOL_S: int = _env_int("HTTP_ESPERA_POOL_S", 5)
+    HTTP2: bool = _env_int("HTTP2", 1) == 1
+    # Circuit breaker: fallas de conexión seguidas para abrirlo y segundos hasta reintentar
+    CIRCUITO_UMBRAL: int = _env_int("CIRCUITO_UMBRAL", 3)
+    CIRCUITO_ENFRIAMIENTO_S: int = _env_int("CIRCUITO_ENFRIAMIENTO_S", 15)
+    # Diario local de escaneos durante los cortes (1 = activo), cada cuánto se intenta
+    # sincronizar y cuántos escaneos se leen por lote. DIARIO_DIR debería ser un volumen.
+    DIARIO_OFFLINE: bool = _env_int("DIARIO_OFFLINE", 1) == 1
+    DIARIO_DIR: str = os.getenv("DIARIO_DIR", os.path.join(tempfile.gettempdir(), "nexa_diario"))
+    DIARIO_INTERVALO_S: int = _env_int("DIARIO_INTERVALO_S", 5)
+    DIARIO_LOTE: int = _env_int("DIARIO_LOTE", 100)
+    # Tope por worker (imágenes incluidas, pendientes + fallidos; 0 = sin tope). Lleno, la API responde 503
+    DIARIO_MAX_MB: int = _env_int("DIARIO_MAX_MB", 512)
+    DIARIO_MAX_ESCANEOS: int = _env_int("DIARIO_MAX_ESCANEOS", 20000)
+
+    # ------------------------------
+    # API
+    # ------------------------------
+    # Tamaño máximo del cuerpo de las subidas binarias; se controla mientras llega el stream
+    API_MAX_CUERPO_BYTES: int = _env_int("API_MAX_CUERPO_BYTES", 15 * 1024 * 1024)
+
+    # Control de admisión de /api/clasificar-producto (ver admision.py): requests en
+    # curso a la vez, cuántas pueden esperar un lugar y cuánto (más allá: 429/503 con
+    # Retry-After) y plazo total de cada request (0 = sin plazo; el cliente puede
+    # pedir uno menor con el header X-Plazo-Ms).
+    ADMISION_MAX_EN_CURSO: int = _env_int("ADMISION_MAX_EN_CURSO", 32)
+    ADMISION_MAX_COLA: int = _env_int("ADMISION_MAX_COLA", 64)
+    ADMISION_ESPERA_MS: int = _env_int("ADMISION_ESPERA_MS", 2000)
+    ADMISION_PLAZO_MS: int = _env_int("ADMISION_PLAZO_MS", 15000)
+
+    # Registro en lote (/api/registro-lote): máximo de ítems y de MB por request
+    # (el cuerpo va al spool en disco del parser), ítems que se clasifican y suben
+    # a la vez, y cada cuántos ítems se escribe en la base (una llamada a
+    # registrar_escaneos_lote por grupo). Admisión propia: lotes en curso y en espera
+    LOTE_MAX_ITEMS: int = _env_int("LOTE_MAX_ITEMS", 500)
+    LOTE_MAX_CUERPO_MB: int = _env_int("LOTE_MAX_CUERPO_MB", 128)
+    LOTE_CONCURRENCIA: int = _env_int("LOTE_CONCURRENCIA", 8)
+    LOTE_ESCRITURA: int = _env_int("LOTE_ESCRITURA", 100)
+    LOTE_ADMISION_MAX_EN_CURSO: int = _env_int("LOTE_ADMISION_MAX_EN_CURSO", 2)
+    LOTE_ADMISION_MAX_COLA: int = _env_int("LOTE_ADMISION_MAX_COLA", 4)
+
+    # ------------------------------
+    # LOGS
+    # ------------------------------
+    # "json" (una línea por evento, la que entiende Cloud Logging) o "texto" para desarrollo
+    LOG_FORMATO: str = os.getenv("LOG_FORMATO", "json")
+    LOG_NIVEL: str = os.getenv("LOG_NIVEL", "INFO")
+    # Porcentaje de los logs informativos de cada request que se escriben (advertencias y errores, siempre)
+    LOG_MUESTREO_PCT: int = _env_int("LOG_MUESTREO_PCT", 100)
+    # Caracteres máximos de un campo; los más largos (p. ej. image_base64) se reemplazan por tamaño + huella
+    LOG_MAX_CAMPO: int = _env_int("LOG_MAX_CAMPO", 200)
+    # Eventos que pueden esperar al hilo escritor; con la cola llena se descartan
+    LOG_COLA_MAX: int = _env_int("LOG_COLA_MAX", 10000)
+
+    # ------------------------------
+    # ADMINISTRACIÓN / PERFILADO
+    # ------------------------------
+    # Token de los endpoints /api/admin/* (header X-Admin-Token). Vacío = endpoints desactivados.
+    ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")
+    # Perfilador por muestreo (ver perfilador.py): milisegundos entre muestras y
+    # duración máxima de una corrida pedida por /api/admin/perfil
+    PERFIL_INTERVALO_MS: int = _env_int("PERFIL_INTERVALO_MS", 10)
+    PERFIL_MAX_S: int = _env_int("PERFIL_MAX_S", 60)
+    # Porcentaje de las requests de registro que se perfilan (0 = apagado) y cuántas
+    # de las más lentas se conservan; se puede cambiar en caliente por /api/admin/perfil/muestreo
+    PERFIL_MUESTREO_PCT: int = _env_int("PERFIL_MUESTREO_PCT", 0)
+    PERFIL_LENTAS: int = _env_int("PERFIL_LENTAS", 10)
+
+
+settings = Settings()
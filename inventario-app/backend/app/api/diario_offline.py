@@ -0,0 +1,384 @@
+# /backend/app/api/diario_offline.py
+"""
+Diario local (write-ahead) de escaneos para cortes de Supabase.
+
+Mientras Supabase no responde (circuito abierto, cliente sin inicializar o una
+llamada que falla por conexión) el escaneo no se pierde: se guarda en un SQLite
+en modo WAL con sus campos, el estado clasificado y la imagen (bytes, o las URLs
+si ya se había subido). Un sincronizador en segundo plano lo reaplica en orden
+cuando vuelve la conectividad.
+
+- Mientras el diario tenga escaneos pendientes, los nuevos también van al diario:
+  así el estado y la imagen del último escaneo siguen ganando.
+- Cada escaneo conserva el ``escaneo_id`` (uuid) con el que se intentó escribir.
+  ``registrar_escaneo`` ignora los ids ya aplicados, así que reaplicar después de
+  un timeout ambiguo (¿llegó o no la llamada?) no duplica stock.
+- Los escaneos consecutivos del mismo producto se reaplican con una sola llamada
+  (stock += n), subiendo solo la última imagen.
+- Un grupo que falla por algo que no es la conexión (la base lo rechaza) no
+  traba el diario ni se pierde: pasa a ``escaneos_fallidos`` con ``ultimo_error``,
+  donde se puede revisar y volver a encolar (ver /api/admin/diario).
+- El diario tiene tope (DIARIO_MAX_MB, DIARIO_MAX_ESCANEOS, contando los fallidos):
+  lleno, ``registrar`` lanza ``DiarioLleno`` y la API responde 503.
+"""
+import asyncio
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+
+from .circuito import CircuitoRemoto, es_error_de_conexion
+from .config import settings
+from . import bitacora
+
+
+# Bytes que ocupa un escaneo en el diario (la imagen manda)
+_TAMANO = "COALESCE(LENGTH(imagen), 0) + LENGTH(campos) + COALESCE(LENGTH(urls), 0)"
+_COLUMNAS = "id, escaneo_id, creado, campos, estado, imagen, urls"
+
+
+class DiarioLleno(Exception):
+    """El diario llegó a DIARIO_MAX_MB o DIARIO_MAX_ESCANEOS: el escaneo no se puede guardar."""
+
+
+class DiarioOffline:
+    def __init__(
+        self, ruta: str, max_bytes: int = settings.DIARIO_MAX_MB * 1024 * 1024,
+        max_escaneos: int = settings.DIARIO_MAX_ESCANEOS,
+    ):
+        os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        # FULL: un escaneo confirmado al cliente sobrevive también a un corte de luz
+        self._conexion.execute("PRAGMA synchronous=FULL")
+        self._conexion.execute("""
+            CREATE TABLE IF NOT EXISTS escaneos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                escaneo_id TEXT NOT NULL,
+                creado REAL NOT NULL,
+                campos TEXT NOT NULL,
+                estado TEXT,
+                imagen BLOB,
+                urls TEXT
+            )
+        """)
+        # Mismas columnas (y el mismo id, para volver a su lugar en el orden) más el error
+        self._conexion.execute("""
+            CREATE TABLE IF NOT EXISTS escaneos_fallidos (
+                id INTEGER PRIMARY KEY,
+                escaneo_id TEXT NOT NULL,
+                creado REAL NOT NULL,
+                campos TEXT NOT NULL,
+                estado TEXT,
+                imagen BLOB,
+                urls TEXT,
+                fallido REAL NOT NULL,
+                ultimo_error TEXT
+            )
+        """)
+        # 0 = sin tope
+        self.max_bytes = max_bytes
+        self.max_escaneos = max_escaneos
+        self._pendientes, bytes_pendientes = self._conexion.execute(
+            f"SELECT COUNT(*), COALESCE(SUM({_TAMANO}), 0) FROM escaneos"
+        ).fetchone()
+        self._fallidos, bytes_fallidos = self._conexion.execute(
+            f"SELECT COUNT(*), COALESCE(SUM({_TAMANO}), 0) FROM escaneos_fallidos"
+        ).fetchone()
+        self._bytes = bytes_pendientes + bytes_fallidos
+        self.registrados = 0
+        self.sincronizados = 0
+        self.rechazados = 0
+        self.ultimo_error: Optional[str] = None
+
+    @property
+    def pendientes(self) -> int:
+        return self._pendientes
+
+    @property
+    def fallidos(self) -> int:
+        return self._fallidos
+
+    def registrar(
+        self, escaneo_id: str, campos: dict, estado_ia: str, image_bytes: Optional[bytes], urls: Optional[dict]
+    ):
+        campos_json = json.dumps(campos)
+        urls_json = json.dumps(urls) if urls else None
+        tamano = len(campos_json.encode()) + len(image_bytes or b"") + len(urls_json.encode() if urls_json else b"")
+        with self._lock:
+            escaneos = self._pendientes + self._fallidos
+            if (self.max_escaneos > 0 and escaneos >= self.max_escaneos) or \
+                    (self.max_bytes > 0 and self._bytes + tamano > self.max_bytes):
+                self.rechazados += 1
+                raise DiarioLleno(
+                    f"el diario offline está lleno ({escaneos} escaneos, {self._bytes // (1024 * 1024)} MB)"
+                )
+            self._conexion.execute(
+                "INSERT INTO escaneos (escaneo_id, creado, campos, estado, imagen, urls) VALUES (?, ?, ?, ?, ?, ?)",
+                (escaneo_id, time.time(), campos_json, estado_ia, image_bytes, urls_json),
+            )
+            self._pendientes += 1
+            self._bytes += tamano
+            self.registrados += 1
+
+    def lote(self, limite: int) -> list:
+        with self._lock:
+            filas = self._conexion.execute(
+                "SELECT id, escaneo_id, creado, campos, estado, imagen, urls FROM escaneos ORDER BY id LIMIT ?",
+                (limite,),
+            ).fetchall()
+        return [
+            {
+                "id": fila[0], "escaneo_id": fila[1], "creado": fila[2], "campos": json.loads(fila[3]),
+                "estado": fila[4], "imagen": fila[5], "urls": json.loads(fila[6]) if fila[6] else None,
+            }
+            for fila in filas
+        ]
+
+    def borrar(self, ids: list):
+        marcas = ",".join("?" * len(ids))
+        with self._lock:
+            self._conexion.execute("BEGIN")
+            tamano = self._conexion.execute(
+                f"SELECT COALESCE(SUM({_TAMANO}), 0) FROM escaneos WHERE id IN ({marcas})", ids
+            ).fetchone()[0]
+            self._conexion.execute(f"DELETE FROM escaneos WHERE id IN ({marcas})", ids)
+            self._conexion.execute("COMMIT")
+            self._pendientes -= len(ids)
+            self._bytes -= tamano
+            self.sincronizados += len(ids)
+
+    def mover_a_fallidos(self, ids: list, error: str):
+        """Saca los escaneos de la cola y los guarda con el error para revisarlos o reintentarlos."""
+        marcas = ",".join("?" * len(ids))
+        with self._lock:
+            self._conexion.execute("BEGIN")
+            self._conexion.execute(
+                f"INSERT INTO escaneos_fallidos ({_COLUMNAS}, fallido, ultimo_error) "
+                f"SELECT {_COLUMNAS}, ?, ? FROM escaneos WHERE id IN ({marcas})",
+                [time.time(), error, *ids],
+            )
+            self._conexion.execute(f"DELETE FROM escaneos WHERE id IN ({marcas})", ids)
+            self._conexion.execute("COMMIT")
+            self._pendientes -= len(ids)
+            self._fallidos += len(ids)
+
+    def listar_fallidos(self, limite: int) -> list:
+        """Los fallidos más recientes, sin la imagen."""
+        with self._lock:
+            filas = self._conexion.execute(
+                "SELECT id, escaneo_id, creado, campos, estado, imagen IS NOT NULL, urls, fallido, ultimo_error "
+                "FROM escaneos_fallidos ORDER BY fallido DESC LIMIT ?",
+                (limite,),
+            ).fetchall()
+        return [
+            {
+                "id": fila[0], "escaneo_id": fila[1], "creado": fila[2], "campos": json.loads(fila[3]),
+                "estado": fila[4], "con_imagen": bool(fila[5]), "urls": json.loads(fila[6]) if fila[6] else None,
+                "fallido": fila[7], "ultimo_error": fila[8],
+            }
+            for fila in filas
+        ]
+
+    def reencolar_fallidos(self) -> int:
+        """
+        Devuelve los fallidos a la cola con su id original (vuelven a su lugar en
+        el orden). Los ``escaneo_id`` ya aplicados no suman de nuevo.
+        """
+        with self._lock:
+            self._conexion.execute("BEGIN")
+            self._conexion.execute(
+                f"INSERT INTO escaneos ({_COLUMNAS}) SELECT {_COLUMNAS} FROM escaneos_fallidos"
+            )
+            movidos = self._conexion.execute("DELETE FROM escaneos_fallidos").rowcount
+            self._conexion.execute("COMMIT")
+            self._pendientes += movidos
+            self._fallidos -= movidos
+        return movidos
+
+    def antiguedad_max_s(self) -> Optional[float]:
+        with self._lock:
+            fila = self._conexion.execute("SELECT MIN(creado) FROM escaneos").fetchone()
+        return round(time.time() - fila[0], 3) if fila and fila[0] else None
+
+    def cerrar(self):
+        with self._lock:
+            self._conexion.close()
+
+    def estadisticas(self) -> dict:
+        return {
+            "ruta": self.ruta,
+            "pendientes": self._pendientes,
+            "fallidos": self._fallidos,
+            "bytes": self._bytes,
+            "registrados": self.registrados,
+            "sincronizados": self.sincronizados,
+            "rechazados": self.rechazados,
+            "antiguedad_max_s": self.antiguedad_max_s(),
+            "ultimo_error": self.ultimo_error,
+        }
+
+
+def agrupar_consecutivos(escaneos: list) -> list:
+    """Agrupa escaneos seguidos con los mismos campos de producto (se aplican con stock += n)."""
+    grupos = []
+    for escaneo in escaneos:
+        if grupos and grupos[-1][0]["campos"] == escaneo["campos"]:
+            grupos[-1].append(escaneo)
+        else:
+            grupos.append([escaneo])
+    return grupos
+
+
+class SincronizadorDiario:
+    """Reaplica el diario en orden, en lotes, cuando Supabase vuelve a responder."""
+
+    def __init__(
+        self,
+        diario: DiarioOffline,
+        circuito: CircuitoRemoto,
+        aplicar: Callable,
+        intervalo_s: float = settings.DIARIO_INTERVALO_S,
+        lote: int = settings.DIARIO_LOTE,
+    ):
+        # aplicar(campos, estado_ia, image_bytes | None, urls | None, escaneo_ids) escribe un grupo y lanza
+        # si falla; sus llamadas a Supabase ya pasan por el circuito y le informan el resultado
+        self.diario = diario
+        self.circuito = circuito
+        self._aplicar = aplicar
+        self.intervalo = intervalo_s
+        self.lote = max(1, lote)
+        self._tarea: Optional[asyncio.Task] = None
+        # Cancelar la tarea no corta el hilo de una sincronización en curso: detener()
+        # le avisa (_detenido) y espera a que suelte _en_curso antes de que se cierre el diario
+        self._detenido = threading.Event()
+        self._en_curso = threading.Lock()
+
+    def iniciar(self):
+        self._tarea = asyncio.get_running_loop().create_task(self._bucle())
+
+    async def detener(self):
+        self._detenido.set()
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+        # Termina el grupo que estaba aplicando y vuelve
+        await asyncio.to_thread(self._esperar_sincronizacion)
+
+    def _esperar_sincronizacion(self):
+        with self._en_curso:
+            pass
+
+    async def _bucle(self):
+        while True:
+            await asyncio.sleep(self.intervalo)
+            if self.diario.pendientes == 0:
+                continue
+            try:
+                await asyncio.to_thread(self.sincronizar)
+            except Exception as e:
+                bitacora.advertencia("No se pudo sincronizar el diario offline", error=str(e))
+
+    def sincronizar(self) -> int:
+        """Aplica lotes mientras haya pendientes y Supabase responda; devuelve los escaneos aplicados."""
+        with self._en_curso:
+            aplicados = self._sincronizar()
+        if aplicados:
+            print(f"[SYNC] Diario offline: {aplicados} escaneos sincronizados.")
+        return aplicados
+
+    def _sincronizar(self) -> int:
+        aplicados = 0
+        while self.diario.pendientes > 0:
+            escaneos = self.diario.lote(self.lote)
+            if not escaneos:
+                return aplicados
+            for grupo in agrupar_consecutivos(escaneos):
+                if self._detenido.is_set() or not self.circuito.disponible:
+                    return aplicados
+                # Gana el último escaneo del grupo: su estado y su imagen
+                ultimo = grupo[-1]
+                ids = [e["id"] for e in grupo]
+                try:
+                    self._aplicar(
+                        ultimo["campos"], ultimo["estado"], ultimo["imagen"], ultimo["urls"],
+                        [e["escaneo_id"] for e in grupo],
+                    )
+                except Exception as e:
+                    self.diario.ultimo_error = str(e)
+                    if es_error_de_conexion(e):
+                        return aplicados
+                    # Error de datos: sale de la cola para no trabarla, pero se conserva
+                    bitacora.error(
+                        "Escaneos del diario movidos a fallidos", codigo_barras=ultimo["campos"].get("codigo_barras"),
+                        escaneos=len(grupo), error=str(e),
+                    )
+                    self.diario.mover_a_fallidos(ids, str(e))
+                else:
+                    aplicados += len(grupo)
+                    self.diario.borrar(ids)
+        return aplicados
+
+
+# ------------------------------
+# INSTANCIA POR WORKER
+# ------------------------------
+_diario: Optional[DiarioOffline] = None
+_sincronizador: Optional[SincronizadorDiario] = None
+# Lock del archivo de diario tomado por este proceso (se mantiene abierto)
+_lock_diario = None
+
+
+def obtener_diario() -> Optional[DiarioOffline]:
+    return _diario
+
+
+def iniciar_diario(circuito: CircuitoRemoto, aplicar: Callable) -> Optional[DiarioOffline]:
+    """Abre el diario de este worker y arranca su sincronizador (None si DIARIO_OFFLINE es 0)."""
+    global _diario, _sincronizador
+    if not settings.DIARIO_OFFLINE:
+        return None
+    # Un archivo por worker; el que reemplaza a un worker caído retoma su diario (ver _ruta_diario)
+    diario = DiarioOffline(
+        _ruta_diario(settings.DIARIO_DIR), settings.DIARIO_MAX_MB * 1024 * 1024, settings.DIARIO_MAX_ESCANEOS
+    )
+    sincronizador = SincronizadorDiario(diario, circuito, aplicar, settings.DIARIO_INTERVALO_S, settings.DIARIO_LOTE)
+    sincronizador.iniciar()
+    _diario, _sincronizador = diario, sincronizador
+    print(f"[INIT] Diario offline activo ({diario.ruta}, {diario.pendientes} pendientes, {diario.fallidos} fallidos).")
+    return diario
+
+
+def _ruta_diario(directorio: str) -> str:
+    """Primer diario-N.sqlite que ningún otro proceso tenga tomado (lock de archivo)."""
+    global _lock_diario
+    os.makedirs(directorio, exist_ok=True)
+    slot = 0
+    while True:
+        lock = open(os.path.join(directorio, f"diario-{slot}.lock"), "w")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            slot += 1
+            continue
+        _lock_diario = lock
+        return os.path.join(directorio, f"diario-{slot}.sqlite")
+
+
+async def detener_diario():
+    global _diario, _sincronizador
+    if _sincronizador is not None:
+        await _sincronizador.detener()
+    if _diario is not None:
+        _diario.cerrar()
+    _diario, _sincronizador = None, None
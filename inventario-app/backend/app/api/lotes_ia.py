@@ -0,0 +1,189 @@
+# /backend/app/api/lotes_ia.py
+"""
+Programador de micro-lotes para la clasificación de imágenes.
+
+Las ráfagas de la pistola lectora o de varios handhelds llegan con pocos
+milisegundos de diferencia. En vez de un invoke de lote 1 por request, el
+programador junta los tensores ya preprocesados durante ``espera_max_ms``
+(o hasta ``max_lote``), ejecuta un único invoke (N, 224, 224, 3) en el pool de
+intérpretes y entrega a cada request su propio vector de probabilidades.
+
+La cola es acotada (``max_cola``: si está llena la request recibe 503) y cada
+tensor viaja con el plazo de su request (ver admision.py): los vencidos se
+descartan antes del invoke. Al detener el programador, las requests que seguían
+en la cola o en el lote en formación reciben 503 en vez de quedar colgadas.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+from .admision import PlazoVencido, Sobrecarga, plazo_actual, vencido
+from .config import settings
+from .motor_ia import MotorInferencia
+
+
+class ProgramadorLotes:
+    def __init__(
+        self,
+        motor: MotorInferencia,
+        max_lote: int = settings.IA_LOTE_MAX,
+        espera_max_ms: int = settings.IA_LOTE_ESPERA_MS,
+        max_cola: int = settings.IA_COLA_MAX,
+    ):
+        self.motor = motor
+        self.max_lote = max(1, max_lote)
+        self.espera_max = max(0, espera_max_ms) / 1000
+        self.max_cola = max(1, max_cola)
+        self.lotes = 0
+        self.rechazados = 0
+        self.vencidos = 0
+        self._cola: Optional[asyncio.Queue] = None
+        self._tarea: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._hilo_loop: Optional[int] = None
+        # No despachamos más lotes que intérpretes: lo que llega mientras tanto engorda el siguiente lote
+        self._slots: Optional[asyncio.Semaphore] = None
+        # Lote que _bucle está juntando (aún no despachado a _ejecutar)
+        self._juntando: list = []
+        self._detenido = False
+        # Executor propio: las requests bloqueadas en predecir_desde_hilo ocupan el
+        # executor por defecto y no deben impedir que corra el invoke del lote
+        self._executor = ThreadPoolExecutor(max_workers=motor.tamano_pool, thread_name_prefix="ia-lote")
+
+    def iniciar(self):
+        self._loop = asyncio.get_running_loop()
+        self._hilo_loop = threading.get_ident()
+        self._cola = asyncio.Queue(maxsize=self.max_cola)
+        self._slots = asyncio.Semaphore(self.motor.tamano_pool)
+        self._tarea = self._loop.create_task(self._bucle())
+
+    async def detener(self):
+        self._detenido = True
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+        # Nadie va a despachar lo que quedó pendiente: se responde con error
+        pendientes = self._juntando
+        self._juntando = []
+        while self._cola is not None and not self._cola.empty():
+            pendientes.append(self._cola.get_nowait())
+        for _, futuro, _ in pendientes:
+            if not futuro.done():
+                futuro.set_exception(Sobrecarga("El servidor se está deteniendo.", 503, 1))
+        self._executor.shutdown(wait=False)
+
+    async def predecir(self, input_tensor: np.ndarray, plazo: Optional[float] = None) -> np.ndarray:
+        """Encola un tensor (1, 224, 224, 3) y espera sus probabilidades (plazo: el de la request)."""
+        if self._detenido:
+            raise Sobrecarga("El servidor se está deteniendo.", 503, 1)
+        futuro = self._loop.create_future()
+        try:
+            self._cola.put_nowait((input_tensor, futuro, plazo if plazo is not None else plazo_actual()))
+        except asyncio.QueueFull:
+            self.rechazados += 1
+            raise Sobrecarga("Cola de inferencia llena.", 503, 1)
+        return await futuro
+
+    def predecir_desde_hilo(self, input_tensor: np.ndarray) -> np.ndarray:
+        """Versión bloqueante para código que corre en un thread (asyncio.to_thread)."""
+        if threading.get_ident() == self._hilo_loop:
+            # Bloquear el event-loop esperando al propio loop sería un deadlock
+            return self.motor.predecir(input_tensor)
+        # to_thread copia el contexto: el plazo de la request se lee acá y viaja explícito
+        return asyncio.run_coroutine_threadsafe(self.predecir(input_tensor, plazo_actual()), self._loop).result()
+
+    async def _bucle(self):
+        while True:
+            lote = self._juntando = [await self._cola.get()]
+            limite = self._loop.time() + self.espera_max
+
+            while len(lote) < self.max_lote:
+                restante = limite - self._loop.time()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(await asyncio.wait_for(self._cola.get(), restante))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._slots.acquire()
+            # Lo que llegó mientras esperábamos un intérprete libre viaja en este mismo lote
+            while len(lote) < self.max_lote and not self._cola.empty():
+                lote.append(self._cola.get_nowait())
+
+            self._juntando = []
+            self._loop.create_task(self._ejecutar(lote))
+
+    async def _ejecutar(self, lote):
+        try:
+            vivos = []
+            for tensor, futuro, plazo in lote:
+                if futuro.done():
+                    continue
+                if vencido(plazo):
+                    self.vencidos += 1
+                    futuro.set_exception(PlazoVencido("la inferencia"))
+                    continue
+                vivos.append((tensor, futuro))
+            if not vivos:
+                return
+            self.lotes += 1
+            try:
+                entrada = np.concatenate([tensor for tensor, _ in vivos], axis=0)
+                probabilidades = await self._loop.run_in_executor(self._executor, self.motor.predecir_lote, entrada)
+            except Exception as e:
+                for _, futuro in vivos:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+                return
+
+            for (_, futuro), fila in zip(vivos, probabilidades):
+                if not futuro.done():
+                    futuro.set_result(fila)
+        finally:
+            self._slots.release()
+
+    def estadisticas(self) -> dict:
+        return {
+            "en_cola": self._cola.qsize() if self._cola is not None else 0,
+            "max_cola": self.max_cola,
+            "lotes": self.lotes,
+            "rechazados": self.rechazados,
+            "vencidos": self.vencidos,
+        }
+
+
+# ------------------------------
+# INSTANCIA POR WORKER
+# ------------------------------
+_programador: Optional[ProgramadorLotes] = None
+
+
+def obtener_programador() -> Optional[ProgramadorLotes]:
+    return _programador
+
+
+def iniciar_programador(motor: MotorInferencia) -> Optional[ProgramadorLotes]:
+    """Arranca el programador en el event-loop actual (None si el batching está desactivado)."""
+    global _programador
+    if settings.IA_LOTE_MAX <= 1:
+        return None
+    _programador = ProgramadorLotes(motor, settings.IA_LOTE_MAX, settings.IA_LOTE_ESPERA_MS, settings.IA_COLA_MAX)
+    _programador.iniciar()
+    print(f"[INIT] Micro-batching activo (lote máx {_programador.max_lote}, "
+          f"espera máx {settings.IA_LOTE_ESPERA_MS} ms).")
+    return _programador
+
+
+async def detener_programador():
+    global _programador
+    if _programador is not None:
+        await _programador.detener()
+        _programador = None
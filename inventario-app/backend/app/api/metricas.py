@@ -0,0 +1,199 @@
+# /backend/app/api/metricas.py
+"""
+Métricas del worker: tiempos por etapa, cabecera ``Server-Timing`` y ``/metrics``.
+
+Cada etapa del registro (decodificación, preproceso, inferencia, caché de
+predicciones, subida y escritura) se mide con ``medir(etapa)``:
+
+- se suma a los tiempos de la request en curso (contextvar), que el middleware
+  devuelve en la cabecera ``Server-Timing`` (visible en las devtools del navegador);
+- se observa en el histograma ``nexa_etapa_segundos{etapa=...}``.
+
+``/metrics`` expone todo en el formato de texto de Prometheus, sin dependencias
+extra: histogramas, contadores y medidores que se leen al momento de exportar
+(requests en curso, colas). Medir cuesta dos ``perf_counter`` y una búsqueda
+binaria en los buckets: despreciable frente a cualquier etapa.
+
+Las métricas son por worker; con varios workers, Prometheus las suma por instancia.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+# Tiempos (s) de las etapas de la request en curso; None fuera de una request
+_etapas: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("etapas_request", default=None)
+
+# Buckets en segundos: de 1 ms a 30 s
+BUCKETS_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _etiquetas(nombres: tuple, valores: tuple) -> str:
+    if not nombres:
+        return ""
+    return "{" + ",".join(f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)) + "}"
+
+
+class Histograma:
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = (), buckets: tuple = BUCKETS_LATENCIA):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # valores de etiquetas -> [conteos por bucket (+Inf al final), suma]
+        self._series = {}
+
+    def observar(self, valor: float, *etiquetas):
+        i = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(etiquetas)
+            if serie is None:
+                serie = self._series[etiquetas] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][i] += 1
+            serie[1] += valor
+
+    def exportar(self) -> list:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._lock:
+            series = [(k, list(v[0]), v[1]) for k, v in self._series.items()]
+        for valores, conteos, suma in sorted(series):
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + ("+Inf",), conteos):
+                acumulado += conteo
+                le = _etiquetas(self.etiquetas + ("le",), valores + (limite,))
+                lineas.append(f"{self.nombre}_bucket{le} {acumulado}")
+            base = _etiquetas(self.etiquetas, valores)
+            lineas.append(f"{self.nombre}_sum{base} {suma:.6f}")
+            lineas.append(f"{self.nombre}_count{base} {acumulado}")
+        return lineas
+
+
+class Contador:
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._lock = threading.Lock()
+        self._valores = {}
+
+    def sumar(self, *etiquetas, n: int = 1):
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + n
+
+    def exportar(self) -> list:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        with self._lock:
+            valores = sorted(self._valores.items())
+        lineas += [f"{self.nombre}{_etiquetas(self.etiquetas, k)} {v}" for k, v in valores]
+        return lineas
+
+
+class Medidor:
+    """Valor instantáneo que se lee al exportar (``leer`` devuelve un número o None si no aplica)."""
+
+    def __init__(self, nombre: str, ayuda: str, leer: Callable[[], Optional[float]]):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self._leer = leer
+
+    def exportar(self) -> list:
+        try:
+            valor = self._leer()
+        except Exception:
+            valor = None
+        if valor is None:
+            return []
+        return [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} gauge", f"{self.nombre} {valor}"]
+
+
+# ------------------------------
+# MÉTRICAS DEL WORKER
+# ------------------------------
+ETAPAS = Histograma("nexa_etapa_segundos", "Duración de cada etapa del registro.", ("etapa",))
+REQUESTS = Histograma("nexa_request_segundos", "Duración de las requests HTTP.", ("ruta", "metodo", "codigo"))
+INVOKES = Histograma("nexa_invoke_segundos", "Duración de cada invoke del modelo (un lote).")
+TAMANO_LOTE = Histograma("nexa_lote_tamano", "Imágenes por invoke.", buckets=(1, 2, 4, 8, 16, 32, 64))
+PREDICCIONES = Contador("nexa_predicciones_total", "Predicciones por etiqueta (INCIERTO bajo el umbral).", ("etiqueta",))
+
+_en_curso = 0
+_medidores: list = [Medidor("nexa_requests_en_curso", "Requests HTTP en curso en el worker.", lambda: _en_curso)]
+
+
+def registrar_medidor(nombre: str, ayuda: str, leer: Callable[[], Optional[float]]):
+    """Agrega un medidor leído en cada exportación (colas, en curso, pendientes...)."""
+    _medidores.append(Medidor(nombre, ayuda, leer))
+
+
+def exportar() -> str:
+    lineas = []
+    for metrica in (*_medidores, ETAPAS, INVOKES, TAMANO_LOTE, REQUESTS, PREDICCIONES):
+        lineas += metrica.exportar()
+    return "\n".join(lineas) + "\n"
+
+
+@contextmanager
+def medir(etapa: str):
+    """Mide el bloque como ``etapa`` (se acumula si la request la repite)."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - inicio
+        ETAPAS.observar(duracion, etapa)
+        etapas = _etapas.get()
+        if etapas is not None:
+            etapas[etapa] = etapas.get(etapa, 0.0) + duracion
+
+
+def server_timing(etapas: dict, total: float) -> str:
+    partes = [f"{etapa};dur={segundos * 1000:.1f}" for etapa, segundos in etapas.items()]
+    partes.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(partes)
+
+
+class MiddlewareMetricas:
+    """Middleware ASGI: requests en curso, duración por ruta y cabecera Server-Timing."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _en_curso
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        etapas = {}
+        token = _etapas.set(etapas)
+        inicio = time.perf_counter()
+        codigo = 500
+
+        async def enviar(mensaje):
+            nonlocal codigo
+            if mensaje["type"] == "http.response.start":
+                codigo = mensaje["status"]
+                cabecera = server_timing(etapas, time.perf_counter() - inicio).encode()
+                # Timing-Allow-Origin: la app web (otro origen) también puede leer los tiempos
+                mensaje = dict(mensaje, headers=[
+                    *mensaje.get("headers", []), (b"server-timing", cabecera), (b"timing-allow-origin", b"*"),
+                ])
+            await send(mensaje)
+
+        _en_curso += 1
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            _en_curso -= 1
+            _etapas.reset(token)
+            # Plantilla de la ruta (no el path con parámetros) para acotar las series
+            ruta = getattr(scope.get("route"), "path", None) or "otra"
+            REQUESTS.observar(time.perf_counter() - inicio, ruta, scope["method"], codigo)
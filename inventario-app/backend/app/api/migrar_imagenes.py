@@ -0,0 +1,148 @@
+# /backend/app/api/migrar_imagenes.py
+"""
+Migra las imágenes antiguas (``<uuid4>.jpeg``) del bucket ``imagenes`` a nombres
+por contenido y actualiza ``productos.imagen_url``. Con IMAGENES_VARIANTES
+(por defecto) sube la vista y la miniatura de cada foto, igual que la API, y
+también migra las fotos originales ``<sha256>.jpeg`` que siguen referenciadas.
+
+Uso (desde backend/app, con la service role key en api/credenciales.py):
+
+    python -m api.migrar_imagenes                      # simulación: solo informa
+    python -m api.migrar_imagenes --aplicar            # copia y actualiza productos
+    python -m api.migrar_imagenes --aplicar --borrar-huerfanas
+
+Con ``--borrar-huerfanas`` además se borran los objetos que ningún producto
+referencia (incluidos los uuid ya copiados; un objeto se conserva si cualquier
+variante de su mismo hash está referenciada), solo si tienen más de
+``--antiguedad-min`` minutos para no tocar subidas de escaneos en curso.
+Después de borrar conviene reiniciar los workers: el índice de imágenes
+conocidas de cada uno vive en memoria.
+
+Es idempotente: se puede cortar y volver a correr.
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from supabase import create_client
+
+from .almacen_imagenes import BUCKET_IMAGENES, es_nombre_por_contenido, subir_por_contenido
+from .config import settings
+from .credenciales import SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY
+from .preprocesamiento import ImagenDecodificada
+
+PAGINA = 1000
+
+
+def listar_objetos(bucket):
+    """Todos los objetos de la raíz del bucket (las carpetas vienen sin id)."""
+    objetos, offset = [], 0
+    while True:
+        pagina = bucket.list("", {"limit": PAGINA, "offset": offset, "sortBy": {"column": "name", "order": "asc"}})
+        objetos.extend(o for o in pagina if o.get("id"))
+        if len(pagina) < PAGINA:
+            return objetos
+        offset += PAGINA
+
+
+def urls_referenciadas(supabase):
+    urls, desde = set(), 0
+    while True:
+        filas = (
+            supabase.table("productos").select("imagen_url, imagen_miniatura_url")
+            .order("id").range(desde, desde + PAGINA - 1)
+            .execute().data
+        )
+        for fila in filas:
+            urls.update(u for u in (fila["imagen_url"], fila["imagen_miniatura_url"]) if u)
+        if len(filas) < PAGINA:
+            return urls
+        desde += PAGINA
+
+
+def hash_del_nombre(file_name: str):
+    return file_name[:64] if es_nombre_por_contenido(file_name) else None
+
+
+def pendiente_de_migrar(file_name: str, referenciadas: set, bucket) -> bool:
+    if not es_nombre_por_contenido(file_name):
+        return True
+    # Foto original (sin sufijo de variante) a la que todavía apunta algún producto
+    return settings.IMAGENES_VARIANTES and "_" not in file_name \
+        and bucket.get_public_url(file_name) in referenciadas
+
+
+def migrar(supabase, bucket, objetos, aplicar):
+    referenciadas = urls_referenciadas(supabase)
+    migradas = 0
+    for objeto in objetos:
+        nombre = objeto["name"]
+        if not pendiente_de_migrar(nombre, referenciadas, bucket):
+            continue
+
+        print(f"[MIGRAR] {nombre}")
+        if not aplicar:
+            continue
+
+        contenido = bucket.download(nombre)
+        decodificada = None
+        if settings.IMAGENES_VARIANTES:
+            decodificada = ImagenDecodificada(contenido, settings.IMAGENES_VISTA_LADO)
+        try:
+            file_name, miniatura, _ = subir_por_contenido(bucket, contenido, decodificada)
+        except Exception as e:
+            print(f"[ERROR] No se pudo migrar {nombre}: {e}")
+            continue
+
+        cambios = {"imagen_url": bucket.get_public_url(file_name)}
+        if miniatura:
+            cambios["imagen_miniatura_url"] = bucket.get_public_url(miniatura)
+        supabase.table("productos").update(cambios).eq("imagen_url", bucket.get_public_url(nombre)).execute()
+        migradas += 1
+    return migradas
+
+
+def borrar_huerfanas(supabase, bucket, antiguedad_min, aplicar):
+    referenciadas = urls_referenciadas(supabase)
+    hashes_referenciados = {hash_del_nombre(url.rsplit("/", 1)[-1]) for url in referenciadas} - {None}
+    limite = datetime.now(timezone.utc) - timedelta(minutes=antiguedad_min)
+
+    huerfanas = []
+    for objeto in listar_objetos(bucket):
+        nombre = objeto["name"]
+        creado = datetime.fromisoformat(objeto["created_at"].replace("Z", "+00:00"))
+        if creado >= limite or bucket.get_public_url(nombre) in referenciadas:
+            continue
+        if hash_del_nombre(nombre) in hashes_referenciados:
+            continue
+        huerfanas.append(nombre)
+
+    print(f"[HUÉRFANAS] {len(huerfanas)} objetos sin producto que los referencie.")
+    if aplicar:
+        for i in range(0, len(huerfanas), 100):
+            bucket.remove(huerfanas[i:i + 100])
+    return huerfanas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--aplicar", action="store_true", help="ejecuta los cambios (por defecto solo simula)")
+    parser.add_argument("--borrar-huerfanas", action="store_true", help="borra objetos sin producto asociado")
+    parser.add_argument("--antiguedad-min", type=int, default=60, help="antigüedad mínima de un huérfano para borrarlo")
+    args = parser.parse_args()
+
+    supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+    bucket = supabase.storage.from_(BUCKET_IMAGENES)
+
+    objetos = listar_objetos(bucket)
+    antiguos = sum(1 for o in objetos if not es_nombre_por_contenido(o["name"]))
+    print(f"--- {len(objetos)} objetos en '{BUCKET_IMAGENES}', {antiguos} con nombre antiguo ---")
+
+    migradas = migrar(supabase, bucket, objetos, args.aplicar)
+    if args.borrar_huerfanas:
+        borrar_huerfanas(supabase, bucket, args.antiguedad_min, args.aplicar)
+
+    print("\n--- CONCLUSIÓN ---")
+    if args.aplicar:
+        print(f"ÉXITO: {migradas} imágenes migradas a nombres por contenido.")
+    else:
+        print("Simulación terminada: volver a correr con --aplicar para ejecutar los cambios.")
@@ -0,0 +1,238 @@
+# /backend/app/api/motor_ia.py
+"""
+Motor de inferencia de larga vida.
+
+Carga el modelo TFLite y las etiquetas una sola vez por worker y mantiene un
+pool acotado de intérpretes ya preparados (``allocate_tensors``). Como el
+intérprete de TFLite no es thread-safe, cada request toma un intérprete del
+pool, lo usa y lo devuelve: dos requests concurrentes nunca comparten tensores.
+
+Cambiar el tamaño de entrada (``resize_tensor_input`` + ``allocate_tensors``)
+reconstruye el delegate XNNPACK, así que los lotes se rellenan hasta un tamaño
+fijo (1, 2, 4, ... ``IA_LOTE_MAX``) y cada puesto del pool guarda un intérprete
+ya asignado por tamaño: en régimen ningún invoke reasigna tensores.
+
+Para servir no hace falta TensorFlow completo: se usa el runtime standalone
+(LiteRT ``ai_edge_litert`` o ``tflite_runtime``) con el delegate XNNPACK.
+TensorFlow queda solo como último recurso y para los scripts de ``modelo_ia/``.
+
+El intérprete se crea con ``model_path``: TFLite mapea el archivo (mmap de solo
+lectura) en vez de copiarlo, así que todos los workers comparten las mismas
+páginas del modelo en la caché del sistema. Con gunicorn, ``precargar_runtime``
+importa el runtime en el maestro antes del fork (ver gunicorn_conf.py).
+"""
+import hashlib
+import importlib
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from .config import settings
+from .metricas import INVOKES, TAMANO_LOTE
+
+# Módulos que exponen Interpreter/OpResolverType, en orden de preferencia
+_RUNTIMES = {
+    "litert": "ai_edge_litert.interpreter",
+    "tflite_runtime": "tflite_runtime.interpreter",
+    "tensorflow": "tensorflow.lite",
+}
+
+
+def cargar_runtime(nombre: str = settings.IA_RUNTIME):
+    """Importa el módulo del runtime TFLite pedido ("auto" prueba en orden de preferencia)."""
+    nombres = list(_RUNTIMES) if nombre == "auto" else [nombre]
+    errores = []
+    for candidato in nombres:
+        if candidato not in _RUNTIMES:
+            raise ValueError(f"Runtime IA desconocido: {candidato}")
+        try:
+            modulo = importlib.import_module(_RUNTIMES[candidato])
+        except ImportError as e:
+            errores.append(f"{candidato}: {e}")
+            continue
+        return candidato, modulo
+    raise ImportError(f"No hay runtime TFLite disponible ({'; '.join(errores)})")
+
+
+def precargar_runtime(model_paths=()) -> str:
+    """
+    Para el proceso maestro, antes del fork: importa el runtime (lo heredan los
+    workers copy-on-write) y adelanta la lectura de los modelos a la caché de páginas.
+
+    No crea intérpretes: los hilos de XNNPACK no sobreviven a un fork.
+    """
+    nombre, _ = cargar_runtime()
+    for path in model_paths:
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+    return nombre
+
+
+def tamanos_lote(lote_max: int) -> list:
+    """Tamaños de lote con intérprete propio: potencias de 2 hasta ``lote_max`` (incluido)."""
+    tamanos = [1]
+    while tamanos[-1] * 2 < lote_max:
+        tamanos.append(tamanos[-1] * 2)
+    if lote_max > 1:
+        tamanos.append(lote_max)
+    return tamanos
+
+
+class MotorInferencia:
+    def __init__(self, model_path: str, labels_path: str, tamano_pool: int = settings.IA_POOL_INTERPRETES,
+                 lote_max: int = settings.IA_LOTE_MAX):
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Modelo no encontrado: {model_path}")
+
+        self.model_path = model_path
+        self.version = self._huella_modelo(model_path)
+        self.labels = self._leer_etiquetas(labels_path)
+        self.tamano_pool = max(1, tamano_pool)
+        self.tamanos = tamanos_lote(max(1, lote_max))
+        self.runtime, self._modulo_runtime = cargar_runtime()
+
+        # Cada puesto del pool es un dict tamaño de lote -> intérprete asignado para ese N.
+        # Los tamaños > 1 se crean la primera vez que se usan (o en el calentamiento).
+        self._pool: queue.Queue = queue.Queue(maxsize=self.tamano_pool)
+        for _ in range(self.tamano_pool):
+            self._pool.put({1: self._crear_interprete(1)})
+
+        # Los índices de entrada/salida son iguales en todos los intérpretes del pool
+        with self.interprete() as interpreter:
+            self.input_index = interpreter.get_input_details()[0]["index"]
+            self.output_index = interpreter.get_output_details()[0]["index"]
+
+        print(f"[INIT] Motor IA listo ({self.tamano_pool} intérpretes, runtime {self.runtime}, "
+              f"{settings.IA_HILOS_INTERPRETE} hilos, XNNPACK {'sí' if settings.IA_XNNPACK else 'no'}).")
+
+    @staticmethod
+    def _huella_modelo(path):
+        """Hash del archivo del modelo: identifica la versión (p. ej. para la caché de predicciones)."""
+        huella = hashlib.sha256()
+        with open(path, "rb") as f:
+            for bloque in iter(lambda: f.read(1024 * 1024), b""):
+                huella.update(bloque)
+        return huella.hexdigest()[:16]
+
+    @staticmethod
+    def _leer_etiquetas(path):
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return [line.strip() for line in f.readlines()]
+
+    def _crear_interprete(self, n: int):
+        # XNNPACK es el delegate por defecto de los builtin ops para modelos float
+        op_resolver = self._modulo_runtime.experimental.OpResolverType if self.runtime == "tensorflow" \
+            else self._modulo_runtime.OpResolverType
+        interpreter = self._modulo_runtime.Interpreter(
+            model_path=self.model_path,
+            num_threads=settings.IA_HILOS_INTERPRETE,
+            experimental_op_resolver_type=(
+                op_resolver.AUTO if settings.IA_XNNPACK else op_resolver.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+            ),
+        )
+        if n > 1:
+            entrada = interpreter.get_input_details()[0]
+            interpreter.resize_tensor_input(entrada["index"], [n] + list(entrada["shape"][1:]), strict=False)
+        interpreter.allocate_tensors()
+        return interpreter
+
+    def _tamano_relleno(self, n: int) -> int:
+        """Menor tamaño con intérprete propio que admite ``n`` imágenes."""
+        return next(tamano for tamano in self.tamanos if tamano >= n)
+
+    def _del_puesto(self, puesto: dict, n: int):
+        """Intérprete de lote ``n`` del puesto, creándolo la primera vez."""
+        interpreter = puesto.get(n)
+        if interpreter is None:
+            interpreter = puesto[n] = self._crear_interprete(n)
+        return interpreter
+
+    @contextmanager
+    def interprete(self, timeout=None, n: int = 1):
+        """Presta el intérprete de lote ``n`` de un puesto del pool y lo devuelve al salir del bloque."""
+        puesto = self._pool.get(timeout=timeout)
+        try:
+            yield self._del_puesto(puesto, n)
+        finally:
+            self._pool.put(puesto)
+
+    def predecir(self, input_tensor: np.ndarray) -> np.ndarray:
+        """Ejecuta el modelo sobre un tensor (1, 224, 224, 3) y devuelve las probabilidades."""
+        return self.predecir_lote(input_tensor)[0]
+
+    def predecir_lote(self, lote: np.ndarray) -> np.ndarray:
+        """
+        Devuelve (N, clases) para un tensor (N, 224, 224, 3).
+
+        El lote se rellena con ceros hasta el tamaño fijo siguiente y se corta la
+        salida; un lote mayor que el tamaño máximo se parte en varios invokes.
+        """
+        n = lote.shape[0]
+        tamano_max = self.tamanos[-1]
+        if n > tamano_max:
+            return np.concatenate([self.predecir_lote(lote[i:i + tamano_max]) for i in range(0, n, tamano_max)])
+
+        tamano = self._tamano_relleno(n)
+        if tamano > n:
+            lote = np.concatenate([lote, np.zeros((tamano - n,) + lote.shape[1:], dtype=lote.dtype)])
+        with self.interprete(n=tamano) as interpreter:
+            inicio = time.perf_counter()
+            interpreter.set_tensor(self.input_index, lote)
+            interpreter.invoke()
+            INVOKES.observar(time.perf_counter() - inicio)
+            TAMANO_LOTE.observar(n)
+            # get_tensor devuelve una copia: el buffer del intérprete se reutiliza en el próximo invoke
+            return interpreter.get_tensor(self.output_index)[:n]
+
+    def calentar(self, entrada: np.ndarray, iteraciones: int, lote_max: int = 1) -> float:
+        """
+        Pasa ``entrada`` (1, 224, 224, 3) por todos los intérpretes del pool y devuelve los segundos.
+
+        El primer invoke de cada intérprete es el lento: XNNPACK empaqueta los pesos
+        y reserva sus buffers. Se crean y calientan los intérpretes de todos los
+        tamaños de lote hasta ``lote_max``.
+        """
+        inicio = time.perf_counter()
+        # Se toman todos los puestos a la vez para que cada uno reciba sus invokes
+        puestos = [self._pool.get() for _ in range(self.tamano_pool)]
+        try:
+            for puesto in puestos:
+                for n in self.tamanos:
+                    if n > max(1, lote_max):
+                        break
+                    interpreter = self._del_puesto(puesto, n)
+                    lote = np.repeat(entrada, n, axis=0)
+                    for _ in range(max(1, iteraciones)):
+                        interpreter.set_tensor(self.input_index, lote)
+                        interpreter.invoke()
+        finally:
+            for puesto in puestos:
+                self._pool.put(puesto)
+        return time.perf_counter() - inicio
+
+
+# ------------------------------
+# INSTANCIA POR WORKER
+# ------------------------------
+_motores = {}
+_motores_lock = threading.Lock()
+
+
+def obtener_motor(model_path: str, labels_path: str) -> MotorInferencia:
+    """Devuelve el motor compartido del worker, creándolo la primera vez."""
+    clave = (model_path, labels_path)
+    motor = _motores.get(clave)
+    if motor is None:
+        with _motores_lock:
+            motor = _motores.get(clave)
+            if motor is None:
+                motor = MotorInferencia(model_path, labels_path)
+                _motores[clave] = motor
+    return motor
@@ -0,0 +1,205 @@
+# /backend/app/api/perfilador.py
+"""
+Perfilador por muestreo para un worker en producción.
+
+Un hilo toma cada ``intervalo`` la pila de todos los hilos del proceso
+(``sys._current_frames``) y cuenta cuántas veces aparece cada una. El resultado
+sale en formato "collapsed" (``marco;marco;marco N`` por línea), el que leen
+flamegraph.pl, speedscope o inferno. La inferencia nativa (TFLite) aparece con
+``motor_ia.py:predecir_lote`` como hoja, y el trabajo del event-loop bajo
+``base_events.py:run_forever``.
+
+Hay dos modos:
+
+- ``perfilar(segundos)``: muestrea todo el worker durante N segundos (lo usa el
+  endpoint de administración).
+- ``PerfilRequests``: perfila una fracción de las requests de registro y
+  conserva las más lentas. El worker atiende varias requests a la vez, así que
+  la pila de una request incluye lo que hacía todo el worker mientras ella
+  estaba en curso.
+
+Con el perfilador apagado no corre ningún hilo. Cada request paga solo una
+comparación.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from .config import settings
+
+# Hojas de hilos que esperan sin trabajar (cola vacía, selector sin eventos, condición)
+_ESPERAS = {
+    ("threading.py", "wait"), ("selectors.py", "select"), ("thread.py", "_worker"),
+    ("queue.py", "get"), ("_base.py", "result"), ("connection.py", "wait"),
+}
+
+
+def _marco(frame) -> str:
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}"
+
+
+def muestrear_pilas(excluir: set, inactivos: bool = False) -> list:
+    """Pila (de la raíz a la hoja, con el nombre del hilo) de cada hilo del proceso."""
+    nombres = {hilo.ident: hilo.name for hilo in threading.enumerate()}
+    pilas = []
+    for ident, frame in sys._current_frames().items():
+        if ident in excluir:
+            continue
+        hoja = frame
+        marcos = []
+        while frame is not None:
+            marcos.append(_marco(frame))
+            frame = frame.f_back
+        if not inactivos and (os.path.basename(hoja.f_code.co_filename), hoja.f_code.co_name) in _ESPERAS:
+            continue
+        marcos.append(f"hilo:{nombres.get(ident, ident)}")
+        pilas.append(";".join(reversed(marcos)))
+    return pilas
+
+
+def colapsar(conteo: Counter) -> str:
+    return "".join(f"{pila} {n}\n" for pila, n in conteo.most_common())
+
+
+class _Muestreador(threading.Thread):
+    """Hilo que suma las pilas en ``conteo`` cada ``intervalo_s`` hasta ``detener()``."""
+
+    def __init__(self, intervalo_s: float, inactivos: bool):
+        super().__init__(name="perfilador", daemon=True)
+        self.intervalo = intervalo_s
+        self.inactivos = inactivos
+        self.conteo = Counter()
+        self.muestras = 0
+        self._fin = threading.Event()
+
+    def run(self):
+        excluir = {threading.get_ident()}
+        while not self._fin.wait(self.intervalo):
+            self.conteo.update(muestrear_pilas(excluir, self.inactivos))
+            self.muestras += 1
+
+    def detener(self):
+        self._fin.set()
+        self.join()
+
+
+_corrida = threading.Lock()
+
+
+async def perfilar(segundos: float, intervalo_ms: int = settings.PERFIL_INTERVALO_MS,
+                   inactivos: bool = False) -> tuple:
+    """Muestrea el worker ``segundos`` y devuelve (collapsed, muestras). Una corrida a la vez."""
+    if not _corrida.acquire(blocking=False):
+        raise RuntimeError("Ya hay un perfil en curso en este worker.")
+    try:
+        muestreador = _Muestreador(max(1, intervalo_ms) / 1000, inactivos)
+        muestreador.start()
+        try:
+            await asyncio.sleep(segundos)
+        finally:
+            await asyncio.to_thread(muestreador.detener)
+        return colapsar(muestreador.conteo), muestreador.muestras
+    finally:
+        _corrida.release()
+
+
+class PerfilRequests:
+    """Perfila una fracción de las requests y conserva las ``conservar`` más lentas."""
+
+    def __init__(self, porcentaje: float = settings.PERFIL_MUESTREO_PCT, conservar: int = settings.PERFIL_LENTAS,
+                 intervalo_ms: int = settings.PERFIL_INTERVALO_MS):
+        self.fraccion = 0.0
+        self.conservar = 1
+        self.intervalo = max(1, intervalo_ms) / 1000
+        self.configurar(porcentaje, conservar)
+        self._lock = threading.Lock()
+        self._secuencia = itertools.count()
+        self._activas = {}
+        # (duración, secuencia, perfil): heap de mínimos, se descarta la más rápida
+        self._lentas = []
+        self._hay_activas = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def configurar(self, porcentaje: float, conservar: int):
+        self.fraccion = min(100.0, max(0.0, porcentaje)) / 100
+        self.conservar = max(1, conservar)
+
+    def iniciar(self) -> Optional[int]:
+        """Id de la request si toca perfilarla, o None."""
+        if random.random() >= self.fraccion:
+            return None
+        with self._lock:
+            id_request = next(self._secuencia)
+            self._activas[id_request] = Counter()
+            self._hay_activas.set()
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._bucle, name="perfilador-requests", daemon=True)
+                self._hilo.start()
+        return id_request
+
+    def terminar(self, id_request: int, ruta: str, duracion_s: float):
+        with self._lock:
+            conteo = self._activas.pop(id_request, Counter())
+            if not self._activas:
+                self._hay_activas.clear()
+            perfil = {
+                "ruta": ruta, "duracion_ms": round(duracion_s * 1000, 1),
+                "inicio": time.time() - duracion_s, "muestras": sum(conteo.values()), "pilas": colapsar(conteo),
+            }
+            heapq.heappush(self._lentas, (duracion_s, id_request, perfil))
+            while len(self._lentas) > self.conservar:
+                heapq.heappop(self._lentas)
+
+    def lentas(self) -> list:
+        with self._lock:
+            return [perfil for _, _, perfil in sorted(self._lentas, reverse=True)]
+
+    def _bucle(self):
+        excluir = {threading.get_ident()}
+        while True:
+            self._hay_activas.wait()
+            pilas = muestrear_pilas(excluir)
+            with self._lock:
+                for conteo in self._activas.values():
+                    conteo.update(pilas)
+            time.sleep(self.intervalo)
+
+
+class MiddlewarePerfil:
+    """Middleware ASGI: con muestreo activo, perfila una fracción de los POST de ``rutas``."""
+
+    def __init__(self, app, rutas: tuple = ("/api/clasificar-producto",)):
+        self.app = app
+        self.rutas = rutas
+
+    async def __call__(self, scope, receive, send):
+        perfil = _perfil_requests
+        if perfil.fraccion <= 0 or scope["type"] != "http" or not scope["path"].startswith(self.rutas):
+            await self.app(scope, receive, send)
+            return
+        id_request = perfil.iniciar()
+        if id_request is None:
+            await self.app(scope, receive, send)
+            return
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            perfil.terminar(id_request, scope["path"], time.perf_counter() - inicio)
+
+
+# ------------------------------
+# INSTANCIA POR WORKER
+# ------------------------------
+_perfil_requests = PerfilRequests(settings.PERFIL_MUESTREO_PCT, settings.PERFIL_LENTAS, settings.PERFIL_INTERVALO_MS)
+
+
+def obtener_perfil_requests() -> PerfilRequests:
+    return _perfil_requests
@@ -0,0 +1,199 @@
+# /backend/app/api/prediccion.py
+"""
+Clasificación de imágenes: motor TFLite, caché de predicciones y micro-batching.
+
+Separado de app_ia.py (el registro de escaneos) para que se pueda importar sin
+efectos: no conecta la persistencia, no abre el Storage ni el diario. Lo usan
+app_ia.py para el registro y /api/clasificar, y services/ai_service.py (main.py).
+El motor se carga la primera vez que se pide; ``calentar_modelo`` lo hace antes,
+desde el lifespan de cada app.
+"""
+import asyncio
+import os
+from typing import Optional
+
+import numpy as np
+
+from .motor_ia import obtener_motor
+from .lotes_ia import obtener_programador
+from .cache_predicciones import obtener_cache_predicciones
+from .config import settings
+from .metricas import PREDICCIONES, medir
+from . import bitacora
+from .preprocesamiento import IMG_SIZE, ImagenDecodificada, ImagenInvalida, jpeg_sintetico, preprocesar
+
+# ------------------------------
+# CONFIG
+# ------------------------------
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.path.join(BASE_DIR, "modelo_ia")
+MODEL_PATH = os.path.join(MODEL_DIR, "modelo_final_v3.tflite")
+LABELS_PATH = os.path.join(MODEL_DIR, "labels.txt")
+CONFIDENCE_THRESHOLD = 0.50
+
+# ------------------------------
+# UTILS
+# ------------------------------
+def get_labels(path):
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return [line.strip() for line in f.readlines()]
+    return None
+
+
+# ------------------------------
+# IA PREDICTION
+# ------------------------------
+def _resultado_prediccion(probabilities, labels, threshold, top_k: int = 0):
+    if not labels:
+        return {'status': 'error', 'message': 'No se pudieron cargar las etiquetas.'}
+
+    idx = np.argmax(probabilities)
+    confidence = probabilities[idx]
+
+    label = labels[idx] if confidence >= threshold else "INCIERTO"
+    PREDICCIONES.sumar(label)
+
+    resultado = {
+        'status': 'success',
+        'predicted_label': label,
+        'confidence': float(confidence),
+        'confidence_score': f"{confidence * 100:.2f}%"
+    }
+    # Detalle para la vista previa (como modelo_ia/test_prediction.py): vector completo y top-k
+    if top_k > 0:
+        resultado['threshold_met'] = bool(confidence >= threshold)
+        resultado['probabilities'] = {labels[i]: float(p) for i, p in enumerate(probabilities)}
+        resultado['top_k'] = [
+            {'label': labels[i], 'confidence': float(probabilities[i])}
+            for i in np.argsort(probabilities)[::-1][:top_k]
+        ]
+    return resultado
+
+
+def _tensor_medido(image_data: bytes, decodificada: Optional[ImagenDecodificada], out: np.ndarray = None):
+    """Tensor del modelo; con la decodificación compartida, decodificar y preprocesar se miden aparte."""
+    if decodificada is not None and not settings.IA_PREPROCESO_RAPIDO:
+        with medir("decodificacion"):
+            decodificada.imagen()
+        with medir("preproceso"):
+            return decodificada.tensor(out=out)
+    # preprocesar() decodifica y escala en un solo paso. En modo rápido la
+    # decodificación compartida queda para las variantes (ver ImagenDecodificada)
+    with medir("preproceso"):
+        return preprocesar(image_data, out=out)
+
+
+def predict_from_bytes(
+    model_path, image_data: bytes, labels_path, threshold, decodificada: Optional[ImagenDecodificada] = None,
+    top_k: int = 0,
+):
+    # El modelo, las etiquetas y los intérpretes se cargan una sola vez por worker
+    try:
+        motor = obtener_motor(model_path, labels_path)
+    except FileNotFoundError:
+        return {'status': 'error', 'message': f'Modelo no encontrado: {model_path}'}
+
+    # Reintentos y reenvíos de la misma foto no vuelven a pasar por el modelo
+    cache = obtener_cache_predicciones(motor.version)
+    if cache is not None:
+        with medir("cache"):
+            probabilities, claves = cache.buscar(image_data)
+        if probabilities is not None:
+            return _resultado_prediccion(probabilities, motor.labels, threshold, top_k)
+
+    try:
+        input_tensor = _tensor_medido(image_data, decodificada)
+    except (ValueError, OSError) as e:
+        return _error_imagen(e)
+
+    if cache is not None:
+        with medir("cache"):
+            probabilities = cache.buscar_perceptual(input_tensor, claves)
+        if probabilities is not None:
+            return _resultado_prediccion(probabilities, motor.labels, threshold, top_k)
+
+    # Si el micro-batching está activo, la imagen viaja en un lote junto a las demás requests
+    programador = obtener_programador()
+    with medir("inferencia"):
+        if programador is not None and programador.motor is motor:
+            probabilities = programador.predecir_desde_hilo(input_tensor)
+        else:
+            probabilities = motor.predecir(input_tensor)
+
+    if cache is not None:
+        cache.guardar(claves, probabilities)
+    return _resultado_prediccion(probabilities, motor.labels, threshold, top_k)
+
+
+async def predict_from_bytes_async(
+    model_path, image_data: bytes, labels_path, threshold, decodificada: Optional[ImagenDecodificada] = None,
+    top_k: int = 0,
+):
+    """Igual que predict_from_bytes, pero espera el lote en el event-loop sin ocupar un thread."""
+    def preparar():
+        motor = obtener_motor(model_path, labels_path)
+        cache = obtener_cache_predicciones(motor.version)
+        claves = None
+        if cache is not None:
+            with medir("cache"):
+                probabilities, claves = cache.buscar(image_data)
+            if probabilities is not None:
+                return motor, cache, claves, None, probabilities
+
+        # Tensor propio: el buffer por thread del modo rápido se reutilizaría mientras esperamos el lote
+        input_tensor = _tensor_medido(image_data, decodificada, np.empty((1, *IMG_SIZE, 3), dtype=np.float32))
+        if cache is None:
+            return motor, cache, claves, input_tensor, None
+        with medir("cache"):
+            return motor, cache, claves, input_tensor, cache.buscar_perceptual(input_tensor, claves)
+
+    try:
+        motor, cache, claves, input_tensor, probabilities = await asyncio.to_thread(preparar)
+    except FileNotFoundError:
+        return {'status': 'error', 'message': f'Modelo no encontrado: {model_path}'}
+    except (ValueError, OSError) as e:
+        return _error_imagen(e)
+
+    if probabilities is not None:
+        return _resultado_prediccion(probabilities, motor.labels, threshold, top_k)
+
+    programador = obtener_programador()
+    with medir("inferencia"):
+        if programador is not None and programador.motor is motor:
+            probabilities = await programador.predecir(input_tensor)
+        else:
+            probabilities = await asyncio.to_thread(motor.predecir, input_tensor)
+
+    if cache is not None:
+        # Con backend compartido guardar hace una ida a Redis: fuera del event-loop
+        if cache.compartida:
+            await asyncio.to_thread(cache.guardar, claves, probabilities)
+        else:
+            cache.guardar(claves, probabilities)
+    return _resultado_prediccion(probabilities, motor.labels, threshold, top_k)
+
+
+def calentar_modelo(model_path, labels_path, iteraciones: int = settings.IA_CALENTAMIENTO) -> dict:
+    """
+    Carga el motor y hace los primeros invokes con una foto sintética.
+
+    Se llama en el arranque del worker: la primera request real no paga la carga
+    del modelo, la asignación de tensores ni el primer invoke (el más lento).
+    """
+    motor = obtener_motor(model_path, labels_path)
+    if not motor.labels:
+        raise FileNotFoundError(f"Etiquetas no encontradas: {labels_path}")
+    # Igual que una request: decodificación + preprocesamiento configurado
+    entrada = preprocesar(jpeg_sintetico(), out=np.empty((1, *IMG_SIZE, 3), dtype=np.float32))
+    segundos = motor.calentar(entrada, iteraciones, settings.IA_LOTE_MAX) if iteraciones > 0 else 0.0
+    obtener_cache_predicciones(motor.version)
+    return {"modelo": motor.version, "invokes": iteraciones, "calentamiento_ms": round(segundos * 1000, 1)}
+
+
+def _error_imagen(e: Exception) -> dict:
+    """Error de imagen para el cliente: el detalle interno (PIL, objetos) va solo a la bitácora."""
+    if isinstance(e, ImagenInvalida):
+        return {'status': 'error', 'message': str(e)}
+    bitacora.advertencia("Imagen inválida", error=repr(e))
+    return {'status': 'error', 'message': 'Imagen inválida: formato no soportado o archivo dañado.'}
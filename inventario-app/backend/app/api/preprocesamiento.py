@@ -0,0 +1,182 @@
+# /backend/app/api/preprocesamiento.py
+"""
+Preprocesamiento de imágenes para MobileNetV2 sin depender de TensorFlow.
+
+``preprocess_image`` reproduce exactamente ``keras.preprocessing.image.load_img(target_size=...)``
++ ``img_to_array`` + ``mobilenet_v2.preprocess_input``:
+
+- conversión a RGB si la imagen viene en otro modo,
+- resize al tamaño del modelo con interpolación ``nearest`` (la de Keras por defecto),
+- escalado a [-1, 1] en float32 (x / 127.5 - 1).
+
+``preprocess_image_rapido`` evita decodificar la foto completa: en JPEG pide al
+decodificador una versión reducida por DCT (``draft``) cercana a 224x224 y luego
+hace resize + normalización en un solo paso sobre un buffer preasignado.
+
+En ambos casos las dimensiones se leen primero de la cabecera y se rechazan
+imágenes demasiado grandes (o bombas de descompresión) antes de decodificar.
+
+``ImagenDecodificada`` comparte una sola decodificación entre la inferencia y la
+generación de las variantes que se suben al Storage (ver variantes_imagen.py).
+En modo rápido el tensor sigue el camino de ``preprocess_image_rapido``: el mismo
+JPEG da el mismo tensor en /api/clasificar, la vista previa y el registro.
+"""
+import threading
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from .config import settings
+
+IMG_SIZE = (224, 224)
+
+# Tabla uint8 -> float32 con el mismo resultado que (x / 127.5) - 1 en float32
+_LUT_MOBILENET = (np.arange(256, dtype=np.float32) / np.float32(127.5)) - np.float32(1.0)
+
+_buffers = threading.local()
+
+# Tag EXIF con la orientación de la cámara
+ORIENTACION_EXIF = 0x0112
+
+
+class ImagenInvalida(ValueError):
+    """Imagen rechazada por una validación propia: el mensaje se puede mostrar al cliente."""
+
+
+def abrir_imagen(image_data: bytes, max_pixeles: int = settings.IA_MAX_PIXELES) -> Image.Image:
+    """Abre la imagen leyendo solo la cabecera y valida su tamaño antes de decodificar."""
+    try:
+        img = Image.open(BytesIO(image_data))
+    except Image.DecompressionBombError:
+        raise ImagenInvalida("Imagen demasiado grande.")
+
+    ancho, alto = img.size
+    if ancho <= 0 or alto <= 0:
+        raise ImagenInvalida("Imagen sin dimensiones válidas.")
+    if ancho * alto > max_pixeles:
+        raise ImagenInvalida(f"Imagen demasiado grande: {ancho}x{alto} supera el máximo de {max_pixeles} píxeles.")
+    return img
+
+
+def preprocess_image(image_data: bytes, target_size=IMG_SIZE) -> np.ndarray:
+    """Devuelve un tensor float32 (1, alto, ancho, 3) listo para el intérprete."""
+    img = abrir_imagen(image_data)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    # PIL recibe (ancho, alto); target_size viene como (alto, ancho) igual que en Keras
+    ancho_alto = (target_size[1], target_size[0])
+    if img.size != ancho_alto:
+        img = img.resize(ancho_alto, Image.NEAREST)
+
+    img_array = np.asarray(img, dtype=np.float32)
+    img_array = np.expand_dims(img_array, axis=0)
+
+    # Mismo orden de operaciones que preprocess_input(mode="tf") para obtener los mismos float32
+    img_array /= 127.5
+    img_array -= 1.0
+    return img_array
+
+
+def _buffer_hilo(target_size) -> np.ndarray:
+    forma = (1, target_size[0], target_size[1], 3)
+    buffer = getattr(_buffers, "tensor", None)
+    if buffer is None or buffer.shape != forma:
+        buffer = np.empty(forma, dtype=np.float32)
+        _buffers.tensor = buffer
+    return buffer
+
+
+def preprocess_image_rapido(image_data: bytes, target_size=IMG_SIZE, out: np.ndarray = None) -> np.ndarray:
+    """
+    Variante rápida de ``preprocess_image`` (decodificación reducida + buffer preasignado).
+
+    Si no se entrega ``out`` se escribe en un buffer propio del thread, que se
+    reutiliza en la siguiente llamada: quien necesite conservar el tensor debe copiarlo.
+    """
+    img = abrir_imagen(image_data)
+    ancho_alto = (target_size[1], target_size[0])
+
+    # El decodificador JPEG escala por 1/2, 1/4 o 1/8 quedando siempre >= al tamaño pedido
+    if img.format == "JPEG":
+        img.draft("RGB", ancho_alto)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if img.size != ancho_alto:
+        img = img.resize(ancho_alto, Image.NEAREST)
+
+    if out is None:
+        out = _buffer_hilo(target_size)
+    # Normalización a [-1, 1] en un solo paso vectorizado vía tabla uint8 -> float32
+    np.take(_LUT_MOBILENET, np.asarray(img, dtype=np.uint8), out=out[0])
+    return out
+
+
+def preprocesar(image_data: bytes, target_size=IMG_SIZE, out: np.ndarray = None) -> np.ndarray:
+    """Preprocesamiento configurado para el servidor (IA_PREPROCESO_RAPIDO)."""
+    if settings.IA_PREPROCESO_RAPIDO:
+        return preprocess_image_rapido(image_data, target_size, out)
+    return preprocess_image(image_data, target_size)
+
+
+# ------------------------------
+# DECODIFICACIÓN COMPARTIDA
+# ------------------------------
+class ImagenDecodificada:
+    """
+    Decodifica la imagen una sola vez aunque la pidan a la vez la inferencia y
+    la subida (cada una desde su thread): la segunda espera y reutiliza la primera.
+
+    Sin IA_PREPROCESO_RAPIDO se decodifica completa una sola vez y el tensor es
+    bit a bit igual al de ``preprocess_image``. Con él la imagen de las variantes
+    se reduce por DCT sin bajar de ``lado_min`` (el tamaño de la vista), y el
+    tensor no sale de ella sino de ``preprocess_image_rapido``, que reduce hasta
+    cerca de 224: así coincide con el de las demás rutas y la caché de
+    predicciones (indexada por los bytes) no guarda resultados de dos tensores distintos.
+    """
+
+    def __init__(self, image_data: bytes, lado_min: int):
+        self.image_data = image_data
+        self.lado_min = lado_min
+        self.orientacion = 1
+        self._img = None
+        self._lock = threading.Lock()
+
+    def imagen(self) -> Image.Image:
+        """Imagen RGB ya cargada en memoria (solo lectura: no modificarla in-place)."""
+        with self._lock:
+            if self._img is None:
+                img = abrir_imagen(self.image_data)
+                self.orientacion = img.getexif().get(ORIENTACION_EXIF, 1)
+                if settings.IA_PREPROCESO_RAPIDO and img.format == "JPEG":
+                    img.draft("RGB", (self.lado_min, self.lado_min))
+                if img.mode != "RGB":
+                    img = img.convert("RGB")
+                img.load()
+                self._img = img
+            return self._img
+
+    def tensor(self, target_size=IMG_SIZE, out: np.ndarray = None) -> np.ndarray:
+        """Tensor (1, alto, ancho, 3) para el modelo, en un buffer propio salvo que se entregue ``out``."""
+        if out is None:
+            out = np.empty((1, target_size[0], target_size[1], 3), dtype=np.float32)
+        if settings.IA_PREPROCESO_RAPIDO:
+            return preprocess_image_rapido(self.image_data, target_size, out)
+
+        img = self.imagen()
+        ancho_alto = (target_size[1], target_size[0])
+        if img.size != ancho_alto:
+            img = img.resize(ancho_alto, Image.NEAREST)
+        np.take(_LUT_MOBILENET, np.asarray(img, dtype=np.uint8), out=out[0])
+        return out
+
+
+def jpeg_sintetico(ancho: int = 640, alto: int = 480) -> bytes:
+    """JPEG de prueba (degradado) para calentar el decodificador y el modelo al arrancar."""
+    x = np.linspace(0, 255, ancho, dtype=np.uint8)
+    y = np.linspace(0, 255, alto, dtype=np.uint8)
+    pixeles = np.stack(np.broadcast_arrays(x[None, :], y[:, None], np.uint8(128)), axis=-1)
+    salida = BytesIO()
+    Image.fromarray(np.ascontiguousarray(pixeles)).save(salida, format="JPEG", quality=85)
+    return salida.getvalue()
@@ -0,0 +1,127 @@
+# /backend/app/api/reporte_memoria.py
+"""
+Memoria por worker de gunicorn: RSS, PSS y memoria privada de cada proceso.
+
+El RSS cuenta entero cada página compartida (librerías importadas antes del fork,
+el modelo mapeado del disco), así que sumar el RSS de los workers exagera el
+total. El PSS reparte cada página compartida entre los procesos que la usan y
+"privada" es lo que se liberaría al matar ese worker: esas dos columnas son las
+que muestran el efecto de precargar en el maestro (ver gunicorn_conf.py).
+
+Uso (en el contenedor, con el servidor recibiendo tráfico o recién calentado):
+
+    python -m api.reporte_memoria                         # busca el maestro de gunicorn
+    python -m api.reporte_memoria --pid 1 --guardar antes.json
+    python -m api.reporte_memoria --pid 1 --comparar antes.json
+
+Lee /proc directamente (Linux); no necesita dependencias extra.
+"""
+import argparse
+import json
+import os
+
+CAMPOS = ("rss", "pss", "privada", "compartida")
+
+
+def _leer(ruta: str) -> str:
+    with open(ruta, "r", encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+def memoria_proceso(pid: int) -> dict:
+    """RSS/PSS/privada/compartida del proceso en MB (smaps_rollup, kernel >= 4.14)."""
+    kb = {}
+    for linea in _leer(f"/proc/{pid}/smaps_rollup").splitlines()[1:]:
+        partes = linea.split()
+        if len(partes) >= 2 and partes[1].isdigit():
+            kb[partes[0].rstrip(":")] = int(partes[1])
+    return {
+        "rss": kb.get("Rss", 0) / 1024,
+        "pss": kb.get("Pss", 0) / 1024,
+        "privada": (kb.get("Private_Clean", 0) + kb.get("Private_Dirty", 0)) / 1024,
+        "compartida": (kb.get("Shared_Clean", 0) + kb.get("Shared_Dirty", 0)) / 1024,
+    }
+
+
+def _es_gunicorn(pid: int) -> bool:
+    # Ejecutable o script (python .../bin/gunicorn); no un shell que lo menciona en sus argumentos
+    argumentos = _leer(f"/proc/{pid}/cmdline").split("\0")[:2]
+    return any(os.path.basename(a).startswith("gunicorn") for a in argumentos)
+
+
+def _hijos(pid: int) -> list:
+    hijos = []
+    for entrada in os.listdir("/proc"):
+        if not entrada.isdigit():
+            continue
+        try:
+            ppid = int(_leer(f"/proc/{entrada}/stat").rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            hijos.append(int(entrada))
+    return sorted(hijos)
+
+
+def buscar_maestro() -> int:
+    """PID del maestro de gunicorn: el proceso gunicorn cuyo padre no es gunicorn."""
+    candidatos = []
+    for entrada in os.listdir("/proc"):
+        if not entrada.isdigit():
+            continue
+        try:
+            if _es_gunicorn(int(entrada)):
+                candidatos.append(int(entrada))
+        except OSError:
+            continue
+    for pid in candidatos:
+        ppid = int(_leer(f"/proc/{pid}/stat").rsplit(")", 1)[1].split()[1])
+        if ppid not in candidatos:
+            return pid
+    raise SystemExit("No se encontró un proceso gunicorn (usar --pid).")
+
+
+def tomar_muestra(pid_maestro: int) -> dict:
+    procesos = [{"pid": pid_maestro, "rol": "maestro", **memoria_proceso(pid_maestro)}]
+    for pid in _hijos(pid_maestro):
+        try:
+            procesos.append({"pid": pid, "rol": "worker", **memoria_proceso(pid)})
+        except OSError:
+            continue  # el worker terminó mientras se leía
+    total = {campo: sum(p[campo] for p in procesos) for campo in CAMPOS}
+    return {"procesos": procesos, "total": total, "workers": len(procesos) - 1}
+
+
+def imprimir(muestra: dict, titulo: str):
+    print(f"\n{titulo} ({muestra['workers']} workers)")
+    print(f"{'pid':>8} {'rol':<8} " + " ".join(f"{c + ' MB':>14}" for c in CAMPOS))
+    for p in muestra["procesos"]:
+        print(f"{p['pid']:>8} {p['rol']:<8} " + " ".join(f"{p[c]:>14.1f}" for c in CAMPOS))
+    print(f"{'':>8} {'total':<8} " + " ".join(f"{muestra['total'][c]:>14.1f}" for c in CAMPOS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pid", type=int, help="PID del maestro de gunicorn (por defecto se busca)")
+    parser.add_argument("--guardar", metavar="JSON", help="guarda la muestra para compararla después")
+    parser.add_argument("--comparar", metavar="JSON", help="muestra guardada con --guardar (el 'antes')")
+    args = parser.parse_args()
+
+    muestra = tomar_muestra(args.pid or buscar_maestro())
+    if args.comparar:
+        with open(args.comparar, "r", encoding="utf-8") as f:
+            antes = json.load(f)
+        imprimir(antes, "Antes")
+        imprimir(muestra, "Después")
+        print("\nDiferencia total: " + ", ".join(
+            f"{c} {muestra['total'][c] - antes['total'][c]:+.1f} MB" for c in CAMPOS
+        ))
+    else:
+        imprimir(muestra, "Memoria")
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as f:
+            json.dump(muestra, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+# /backend/app/api/repositorio.py
+"""
+Persistencia del registro de escaneos detrás de una interfaz única.
+
+``app_ia`` ya no habla directo con el cliente de Supabase sino con un
+``RepositorioInventario``:
+
+- ``RepositorioSupabase``: las RPC ``registrar_escaneo`` y ``registrar_escaneos_lote``, la tabla ``productos``
+  y el Storage de Supabase (producción).
+- ``RepositorioLocal``: SQLite + carpeta local con la misma semántica (búsqueda
+  por id / código de barras / nombre+marca+modelo, alta, ids de escaneo
+  idempotentes). Sirve para benchmarks y pruebas de carga sin el servicio, y
+  para un despliegue en el borde sin nube.
+
+Se elige con PERSISTENCIA ("supabase" | "local").
+
+Las requests usan las variantes ``*_async``: con Supabase van por el pool HTTP
+compartido del worker (ver cliente_http.py); por defecto corren la versión
+sincrónica en un hilo. Los trabajos en segundo plano (cola de subidas, diario
+offline) siguen usando la API sincrónica.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+from .config import settings
+
+
+# Mismos umbrales que public.get_disponibilidad() en backend/supabase/migrations
+def get_disponibilidad(cantidad: int) -> str:
+    if cantidad <= 0:
+        return "Sin stock"
+    if cantidad <= 4:
+        return "Baja disponibilidad"
+    if cantidad <= 10:
+        return "Disponibilidad media"
+    return "Alta disponibilidad"
+
+
+class RepositorioInventario:
+    """Operaciones que necesita el registro de escaneos."""
+
+    nombre = ""
+
+    def registrar_escaneo(self, parametros: dict) -> Optional[dict]:
+        """
+        Busca el producto (código de barras, nombre+marca+modelo; ``p_producto_id``
+        solo como atajo si sigue coincidiendo) y le suma el incremento, o lo da
+        de alta, en una sola operación atómica.
+        Recibe los parámetros de la RPC ``registrar_escaneo`` y devuelve su fila
+        {'producto_id', 'stock', 'disponibilidad', 'coincidencia'}.
+        """
+        raise NotImplementedError
+
+    def registrar_escaneos(self, lista: list) -> list:
+        """
+        Varios ``registrar_escaneo`` en una sola operación (registro en lote).
+        Devuelve una fila por escaneo, en el mismo orden; si falla no se aplica ninguno.
+        """
+        raise NotImplementedError
+
+    def actualizar_producto(self, producto_id: int, cambios: dict):
+        raise NotImplementedError
+
+    def almacen(self, bucket: str):
+        """Bucket de imágenes con la interfaz del Storage (upload / exists / get_public_url)."""
+        raise NotImplementedError
+
+    # ------------------------------
+    # Asíncrono
+    # ------------------------------
+    async def iniciar_async(self, cliente_http):
+        """Prepara el acceso asíncrono sobre el pool HTTP del worker (nada que hacer por defecto)."""
+
+    async def registrar_escaneo_async(self, parametros: dict) -> Optional[dict]:
+        return await asyncio.to_thread(self.registrar_escaneo, parametros)
+
+    async def registrar_escaneos_async(self, lista: list) -> list:
+        return await asyncio.to_thread(self.registrar_escaneos, lista)
+
+    def almacen_async(self, bucket: str):
+        """Como almacen(), con upload / exists / get_public_url awaitables."""
+        return AlmacenEnHilo(self.almacen(bucket))
+
+
+class AlmacenEnHilo:
+    """Adapta un bucket sincrónico a la interfaz asíncrona corriendo cada llamada en un hilo."""
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    async def upload(self, path: str, file: bytes, file_options: Optional[dict] = None):
+        return await asyncio.to_thread(self.bucket.upload, path, file, file_options)
+
+    async def exists(self, path: str) -> bool:
+        return await asyncio.to_thread(self.bucket.exists, path)
+
+    async def get_public_url(self, path: str) -> str:
+        return self.bucket.get_public_url(path)
+
+
+# ------------------------------
+# SUPABASE
+# ------------------------------
+def _parametros_lote(lista: list) -> dict:
+    """Parámetros de la RPC ``registrar_escaneos_lote``: los de registrar_escaneo sin el prefijo ``p_``."""
+    return {"p_escaneos": [{clave.removeprefix("p_"): valor for clave, valor in p.items()} for p in lista]}
+
+
+def _filas_lote(data: Optional[list], cantidad: int) -> list:
+    """Filas de la RPC en el orden del lote (None si la base no devolvió la de algún escaneo)."""
+    filas = [None] * cantidad
+    for fila in data or []:
+        filas[fila.pop("indice")] = fila
+    return filas
+
+
+class RepositorioSupabase(RepositorioInventario):
+    nombre = "supabase"
+
+    def __init__(self, cliente, url: Optional[str] = None, clave: Optional[str] = None):
+        self.cliente = cliente
+        self.url = url
+        self.clave = clave
+        # Cliente asíncrono sobre el pool HTTP compartido (se crea en el lifespan)
+        self.cliente_async = None
+
+    def registrar_escaneo(self, parametros: dict) -> Optional[dict]:
+        result = self.cliente.rpc("registrar_escaneo", parametros).execute()
+        return result.data[0] if result and result.data else None
+
+    def registrar_escaneos(self, lista: list) -> list:
+        result = self.cliente.rpc("registrar_escaneos_lote", _parametros_lote(lista)).execute()
+        return _filas_lote(result.data if result else None, len(lista))
+
+    def actualizar_producto(self, producto_id: int, cambios: dict):
+        self.cliente.table("productos").update(cambios).eq("id", producto_id).execute()
+
+    def almacen(self, bucket: str):
+        return self.cliente.storage.from_(bucket)
+
+    async def iniciar_async(self, cliente_http):
+        if self.url is None:
+            return
+        from supabase import acreate_client, AsyncClientOptions
+        # Con httpx_client, los timeouts son los del pool (ver cliente_http.py)
+        self.cliente_async = await acreate_client(
+            self.url, self.clave, AsyncClientOptions(httpx_client=cliente_http)
+        )
+
+    async def registrar_escaneo_async(self, parametros: dict) -> Optional[dict]:
+        if self.cliente_async is None:
+            return await super().registrar_escaneo_async(parametros)
+        result = await self.cliente_async.rpc("registrar_escaneo", parametros).execute()
+        return result.data[0] if result and result.data else None
+
+    async def registrar_escaneos_async(self, lista: list) -> list:
+        if self.cliente_async is None:
+            return await super().registrar_escaneos_async(lista)
+        result = await self.cliente_async.rpc("registrar_escaneos_lote", _parametros_lote(lista)).execute()
+        return _filas_lote(result.data if result else None, len(lista))
+
+    def almacen_async(self, bucket: str):
+        if self.cliente_async is None:
+            return super().almacen_async(bucket)
+        return self.cliente_async.storage.from_(bucket)
+
+
+# ------------------------------
+# LOCAL (SQLite + sistema de archivos)
+# ------------------------------
+class ErrorAlmacenLocal(Exception):
+    """Mismos atributos que StorageApiError, para que es_duplicado() lo reconozca."""
+
+    def __init__(self, message: str, code: str, status: int):
+        super().__init__(message)
+        self.code = code
+        self.status = status
+
+
+class AlmacenLocal:
+    """Bucket en una carpeta; api_server la publica en PERSISTENCIA_LOCAL_URL."""
+
+    def __init__(self, directorio: str, url_base: str):
+        os.makedirs(directorio, exist_ok=True)
+        self.directorio = directorio
+        self.url_base = url_base.rstrip("/")
+
+    def _ruta(self, path: str) -> str:
+        if os.path.basename(path) != path or path in ("", ".", ".."):
+            raise ValueError(f"Nombre de objeto inválido: {path}")
+        return os.path.join(self.directorio, path)
+
+    def upload(self, path: str, file: bytes, file_options: Optional[dict] = None):
+        ruta = self._ruta(path)
+        temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporal, "wb") as f:
+            f.write(file)
+        try:
+            # link() falla si el objeto ya existe: mismo contrato que upsert=false
+            os.link(temporal, ruta)
+        except FileExistsError:
+            raise ErrorAlmacenLocal("The resource already exists", "Duplicate", 409)
+        finally:
+            os.unlink(temporal)
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(self._ruta(path))
+
+    def get_public_url(self, path: str) -> str:
+        return f"{self.url_base}/{path}"
+
+
+_ESQUEMA_LOCAL = """
+CREATE TABLE IF NOT EXISTS productos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    codigo_barras TEXT UNIQUE,
+    nombre TEXT,
+    marca TEXT,
+    modelo TEXT,
+    compatibilidad TEXT,
+    categoria_id INTEGER,
+    observaciones TEXT,
+    stock INTEGER NOT NULL DEFAULT 0,
+    estado TEXT,
+    disponibilidad TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    imagen_url TEXT,
+    imagen_miniatura_url TEXT
+);
+CREATE INDEX IF NOT EXISTS productos_nombre_marca_modelo ON productos (nombre, marca, modelo);
+CREATE INDEX IF NOT EXISTS productos_updated_at ON productos (updated_at);
+CREATE TABLE IF NOT EXISTS escaneos_registrados (
+    id TEXT PRIMARY KEY,
+    creado TEXT NOT NULL
+);
+"""
+
+# Columnas que se pueden cambiar con actualizar_producto
+_COLUMNAS_ACTUALIZABLES = {"imagen_url", "imagen_miniatura_url", "estado", "observaciones", "compatibilidad"}
+
+
+class RepositorioLocal(RepositorioInventario):
+    """
+    Misma semántica que la RPC ``registrar_escaneo`` sobre un SQLite (WAL).
+    Cada escaneo corre en una transacción ``BEGIN IMMEDIATE``: los workers que
+    comparten el archivo se serializan igual que con el lock de fila de Postgres.
+    """
+
+    nombre = "local"
+
+    def __init__(self, directorio: str, url_base: str):
+        os.makedirs(directorio, exist_ok=True)
+        self.directorio = directorio
+        self.url_base = url_base.rstrip("/")
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(
+            os.path.join(directorio, "inventario.sqlite"),
+            check_same_thread=False, isolation_level=None, timeout=30,
+        )
+        self._conexion.row_factory = sqlite3.Row
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.executescript(_ESQUEMA_LOCAL)
+        self._conexion.create_function("get_disponibilidad", 1, get_disponibilidad, deterministic=True)
+        self._almacenes = {}
+
+    def registrar_escaneo(self, parametros: dict) -> Optional[dict]:
+        return self.registrar_escaneos([parametros])[0]
+
+    def registrar_escaneos(self, lista: list) -> list:
+        # En SQLite no hay idas y vueltas que ahorrar: el lote es una sola transacción
+        ahora = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            cur = self._conexion.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                filas = [self._registrar(cur, p, ahora) for p in lista]
+            except BaseException:
+                cur.execute("ROLLBACK")
+                raise
+            cur.execute("COMMIT")
+        return filas
+
+    def _registrar(self, cur, p: dict, ahora: str) -> dict:
+        incremento = p.get("p_incremento", 1)
+        # Escaneos con id: solo suman los que no se aplicaron antes
+        if p.get("p_escaneo_ids") is not None:
+            incremento = 0
+            for escaneo_id in p["p_escaneo_ids"]:
+                cur.execute("INSERT OR IGNORE INTO escaneos_registrados (id, creado) VALUES (?, ?)", (escaneo_id, ahora))
+                incremento += cur.rowcount
+
+        actualizar = """
+            UPDATE productos
+               SET stock = stock + :incremento,
+                   disponibilidad = get_disponibilidad(stock + :incremento),
+                   estado = :estado,
+                   updated_at = :ahora,
+                   imagen_url = coalesce(:imagen_url, imagen_url),
+                   imagen_miniatura_url = coalesce(:imagen_miniatura_url, imagen_miniatura_url)
+             WHERE {condicion}
+            RETURNING id, stock, disponibilidad
+        """
+        valores = {
+            "incremento": incremento, "estado": p.get("p_estado"), "ahora": ahora,
+            "imagen_url": p.get("p_imagen_url"), "imagen_miniatura_url": p.get("p_imagen_miniatura_url"),
+            "producto_id": p.get("p_producto_id"), "codigo_barras": p["p_codigo_barras"],
+            "nombre": p.get("p_nombre"), "marca": p.get("p_marca"), "modelo": p.get("p_modelo"),
+        }
+        # Como la RPC: el id del índice solo sirve si el producto sigue coincidiendo,
+        # por código primero y por nombre/marca/modelo recién si el código no está
+        por_nombre = "nombre = :nombre AND marca = :marca AND modelo = :modelo"
+        busquedas = [
+            ("id = :producto_id AND codigo_barras = :codigo_barras", "código de barras"),
+            ("codigo_barras = :codigo_barras", "código de barras"),
+            (f"id = :producto_id AND {por_nombre}", "nombre/marca/modelo"),
+            (f"id = (SELECT id FROM productos WHERE {por_nombre} ORDER BY id LIMIT 1)", "nombre/marca/modelo"),
+        ]
+        if valores["producto_id"] is None:
+            busquedas = busquedas[1:2] + busquedas[3:]
+        for condicion, coincidencia in busquedas:
+            fila = cur.execute(actualizar.format(condicion=condicion), valores).fetchone()
+            if fila is not None:
+                return {"producto_id": fila["id"], "stock": fila["stock"],
+                        "disponibilidad": fila["disponibilidad"], "coincidencia": coincidencia}
+
+        # Producto nuevo (la transacción IMMEDIATE ya excluye un alta concurrente)
+        fila = cur.execute("""
+            INSERT INTO productos (
+                codigo_barras, nombre, marca, modelo, compatibilidad, categoria_id, observaciones,
+                stock, estado, disponibilidad, created_at, updated_at, imagen_url, imagen_miniatura_url
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, get_disponibilidad(?), ?, ?, ?, ?)
+            RETURNING id, stock, disponibilidad
+        """, (
+            p["p_codigo_barras"], p.get("p_nombre"), p.get("p_marca"), p.get("p_modelo"),
+            p.get("p_compatibilidad"), p.get("p_categoria_id"), p.get("p_observaciones"),
+            incremento, p.get("p_estado"), incremento, ahora, ahora,
+            p.get("p_imagen_url"), p.get("p_imagen_miniatura_url"),
+        )).fetchone()
+        return {"producto_id": fila["id"], "stock": fila["stock"],
+                "disponibilidad": fila["disponibilidad"], "coincidencia": "nuevo"}
+
+    def actualizar_producto(self, producto_id: int, cambios: dict):
+        desconocidas = set(cambios) - _COLUMNAS_ACTUALIZABLES
+        if desconocidas:
+            raise ValueError(f"Columnas no actualizables: {sorted(desconocidas)}")
+        asignaciones = ", ".join(f"{columna} = :{columna}" for columna in cambios)
+        with self._lock:
+            self._conexion.execute(
+                f"UPDATE productos SET {asignaciones} WHERE id = :id", dict(cambios, id=producto_id)
+            )
+
+    def almacen(self, bucket: str):
+        if bucket not in self._almacenes:
+            self._almacenes[bucket] = AlmacenLocal(
+                os.path.join(self.directorio, "almacen", bucket), f"{self.url_base}/{bucket}"
+            )
+        return self._almacenes[bucket]
+
+
+# ------------------------------
+# CREACIÓN
+# ------------------------------
+def crear_repositorio(tipo: str = settings.PERSISTENCIA) -> RepositorioInventario:
+    """Repositorio configurado; lanza si no se puede crear (p. ej. sin credenciales)."""
+    if tipo == "local":
+        return RepositorioLocal(settings.PERSISTENCIA_LOCAL_DIR, settings.PERSISTENCIA_LOCAL_URL)
+    if tipo != "supabase":
+        raise ValueError(f"Persistencia desconocida: {tipo}")
+
+    from supabase import create_client, ClientOptions
+    from credenciales import SUPABASE_URL, SUPABASE_ANON_KEY
+    # Timeouts cortos: ante un corte, mejor ir al diario offline que esperar 120 s
+    cliente = create_client(SUPABASE_URL, SUPABASE_ANON_KEY, ClientOptions(
+        postgrest_client_timeout=settings.SUPABASE_TIMEOUT_S,
+        storage_client_timeout=settings.SUPABASE_TIMEOUT_STORAGE_S,
+    ))
+    return RepositorioSupabase(cliente, SUPABASE_URL, SUPABASE_ANON_KEY)
@@ -0,0 +1,89 @@
+# /backend/app/api/variantes_imagen.py
+"""
+Variantes livianas de la foto de cada escaneo para el Storage.
+
+En vez de la foto de la cámara (varios MB) se suben una vista comprimida
+(lado mayor ``IMAGENES_VISTA_LADO``) y una miniatura para tablas y reportes.
+Se generan a partir de la misma ``ImagenDecodificada`` que usa la inferencia,
+aplicando la orientación EXIF (al recodificar se pierde el tag).
+
+Los nombres derivan del hash de la foto original (ver almacen_imagenes):
+``<hash>_vista.<ext>`` y ``<hash>_miniatura.<ext>``; la original, si se guarda,
+sigue siendo ``<hash>.jpeg``.
+"""
+from io import BytesIO
+
+from PIL import Image
+
+from .config import settings
+from .preprocesamiento import ImagenDecodificada
+
+# Orientación EXIF -> transformación que deja la imagen derecha
+_TRANSPOSICIONES = {
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+
+_FORMATOS = {
+    "jpeg": ("JPEG", "jpeg", "image/jpeg"),
+    "webp": ("WEBP", "webp", "image/webp"),
+}
+
+
+def formato_variantes(formato: str = settings.IMAGENES_FORMATO):
+    """(formato PIL, extensión, content-type) del formato configurado."""
+    if formato not in _FORMATOS:
+        raise ValueError(f"Formato de imagen desconocido: {formato}")
+    return _FORMATOS[formato]
+
+
+def nombres_variantes(hash_original: str, formato: str = settings.IMAGENES_FORMATO) -> dict:
+    extension = formato_variantes(formato)[1]
+    return {
+        "vista": f"{hash_original}_vista.{extension}",
+        "miniatura": f"{hash_original}_miniatura.{extension}",
+    }
+
+
+def _reducida(img: Image.Image, lado: int) -> Image.Image:
+    """Copia reducida a ``lado`` de lado mayor, sin agrandar nunca."""
+    ancho, alto = img.size
+    escala = lado / max(ancho, alto)
+    if escala >= 1:
+        return img
+    # reducing_gap: primero reduce por bloques (barato) y termina con LANCZOS
+    return img.resize((max(1, round(ancho * escala)), max(1, round(alto * escala))), Image.LANCZOS, reducing_gap=1.0)
+
+
+def _codificar(img: Image.Image, formato_pil: str, calidad: int) -> bytes:
+    buffer = BytesIO()
+    img.save(buffer, formato_pil, quality=calidad)
+    return buffer.getvalue()
+
+
+def generar_variantes(
+    decodificada: ImagenDecodificada,
+    vista_lado: int = settings.IMAGENES_VISTA_LADO,
+    miniatura_lado: int = settings.IMAGENES_MINIATURA_LADO,
+    calidad: int = settings.IMAGENES_CALIDAD,
+    formato: str = settings.IMAGENES_FORMATO,
+) -> dict:
+    """Devuelve {'vista': bytes, 'miniatura': bytes} en el formato configurado."""
+    formato_pil = formato_variantes(formato)[0]
+
+    vista = _reducida(decodificada.imagen(), vista_lado)
+    transposicion = _TRANSPOSICIONES.get(decodificada.orientacion)
+    if transposicion is not None:
+        vista = vista.transpose(transposicion)
+    # La miniatura sale de la vista, que ya es chica
+    miniatura = _reducida(vista, miniatura_lado)
+
+    return {
+        "vista": _codificar(vista, formato_pil, calidad),
+        "miniatura": _codificar(miniatura, formato_pil, calidad),
+    }
@@ -0,0 +1,111 @@
+# /backend/app/gunicorn_conf.py
+"""
+Configuración de gunicorn para la imagen tiangolo/uvicorn-gunicorn-fastapi.
+
+La imagen usa /app/gunicorn_conf.py si existe (este archivo, ver Dockerfile) en
+lugar del suyo. Se respetan las mismas variables (WEB_CONCURRENCY, WORKERS_PER_CORE,
+MAX_WORKERS, HOST, PORT, BIND, LOG_LEVEL, TIMEOUT, ...) y se agrega:
+
+- Precarga antes del fork: el maestro importa numpy, PIL, FastAPI, el cliente de
+  Supabase y el runtime TFLite; los workers los heredan copy-on-write en vez de
+  importar cada uno su copia. La app no se precarga (``preload_app``): conecta la
+  persistencia al importarse y esas conexiones no deben cruzar el fork.
+- ``gc.freeze()`` antes del fork, para que el recolector no toque los objetos
+  heredados y los vuelva privados de cada worker.
+- El modelo se comparte solo: cada intérprete lo mapea del disco (ver motor_ia.py).
+- Workers: por defecto uno por núcleo disponible (WORKERS_PER_CORE=1), sin el
+  mínimo de 2 de la imagen base, que en 1 núcleo pone dos workers a competir.
+- Hilos de inferencia por worker: si no se fijan IA_POOL_INTERPRETES /
+  IA_HILOS_INTERPRETE, cada worker usa un intérprete con núcleos // workers hilos
+  (al menos 1). Con workers <= núcleos, workers x hilos no pasa de los núcleos
+  disponibles. Con más workers que núcleos (WEB_CONCURRENCY o WORKERS_PER_CORE > 1)
+  cada uno queda con 1 hilo y la CPU queda sobresuscrita: se avisa al arrancar.
+
+Para comparar la memoria antes y después: ``python -m api.reporte_memoria``.
+"""
+import gc
+import glob
+import importlib
+import math
+import os
+
+# Módulos pesados y sin efectos al importarse (no abren conexiones ni hilos)
+PRECARGA = (
+    "numpy", "PIL.Image", "fastapi", "starlette.staticfiles", "pydantic", "multipart",
+    "httpx", "h2", "supabase", "api.config", "api.preprocesamiento", "api.motor_ia",
+)
+
+
+def _nucleos_disponibles() -> int:
+    """Núcleos que el contenedor puede usar: afinidad y cuota de CPU del cgroup (Cloud Run)."""
+    nucleos = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    try:
+        with open("/sys/fs/cgroup/cpu.max", "r", encoding="utf-8") as f:
+            cuota, periodo = f.read().split()
+        if cuota != "max":
+            nucleos = min(nucleos, max(1, math.ceil(int(cuota) / int(periodo))))
+    except (OSError, ValueError):
+        pass
+    return max(1, nucleos)
+
+
+# ------------------------------
+# WORKERS (mismas variables que la imagen base)
+# ------------------------------
+nucleos = _nucleos_disponibles()
+web_concurrency = os.getenv("WEB_CONCURRENCY")
+if web_concurrency:
+    workers = int(web_concurrency)
+    assert workers > 0
+else:
+    workers = max(int(float(os.getenv("WORKERS_PER_CORE", "1")) * nucleos), 1)
+    if os.getenv("MAX_WORKERS"):
+        workers = min(workers, int(os.getenv("MAX_WORKERS")))
+
+bind = os.getenv("BIND") or f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '80')}"
+loglevel = os.getenv("LOG_LEVEL", "info")
+accesslog = os.getenv("ACCESS_LOG", "-") or None
+errorlog = os.getenv("ERROR_LOG", "-") or None
+worker_tmp_dir = "/dev/shm"
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "120"))
+timeout = int(os.getenv("TIMEOUT", "120"))
+keepalive = int(os.getenv("KEEP_ALIVE", "5"))
+preload_app = False
+
+# ------------------------------
+# HILOS DE INFERENCIA
+# ------------------------------
+# Se fijan antes de que el maestro importe api.config (los workers heredan esos settings).
+# Con más workers que núcleos no hay reparto que no sobresuscriba: 1 hilo cada uno
+_cpu_por_worker = max(1, nucleos // workers)
+os.environ.setdefault("IA_POOL_INTERPRETES", "1")
+os.environ.setdefault(
+    "IA_HILOS_INTERPRETE", str(max(1, _cpu_por_worker // int(os.environ["IA_POOL_INTERPRETES"])))
+)
+
+
+def on_starting(server):
+    """En el maestro, antes de crear los workers."""
+    for modulo in PRECARGA:
+        try:
+            importlib.import_module(modulo)
+        except ImportError as e:
+            server.log.warning(f"Precarga omitida ({modulo}): {e}")
+
+    from api.motor_ia import precargar_runtime
+    directorio = os.path.join(os.path.dirname(os.path.abspath(__file__)), "api", "modelo_ia")
+    try:
+        runtime = precargar_runtime(glob.glob(os.path.join(directorio, "*.tflite")))
+    except ImportError as e:
+        runtime = f"no precargado ({e})"
+
+    gc.collect()
+    gc.freeze()
+    if workers > nucleos:
+        server.log.warning(
+            f"[INIT] {workers} workers para {nucleos} núcleos: los hilos de inferencia sobresuscriben la CPU."
+        )
+    server.log.info(
+        f"[INIT] Precarga lista: {workers} workers x {os.environ['IA_POOL_INTERPRETES']} intérpretes x "
+        f"{os.environ['IA_HILOS_INTERPRETE']} hilos ({nucleos} núcleos), runtime {runtime}."
+    )
@@ -1,7 +1,23 @@
-from fastapi import FastAPI, UploadFile, File
-from app.services.ai_service import predict_image
+from contextlib import asynccontextmanager
 
-app = FastAPI(title="Inventario API")
+from fastapi import FastAPI, UploadFile, File, HTTPException
+from app.services.ai_service import detener_ia, iniciar_ia, predict_image_async
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Modelo cargado y caliente antes de la primera request; sin él /clasificar responde 400
+    try:
+        calentamiento = await iniciar_ia()
+        print(f"[INIT] Modelo caliente ({calentamiento['invokes']} invokes por intérprete, "
+              f"{calentamiento['calentamiento_ms']} ms).")
+    except Exception as e:
+        print(f"[ERROR INIT] Modelo no cargado: {e}")
+    yield
+    await detener_ia()
+
+
+app = FastAPI(title="Inventario API", lifespan=lifespan)
 
 @app.get("/ping")
 def ping():
@@ -9,5 +25,7 @@ def ping():
 
 @app.post("/clasificar")
 async def clasificar(file: UploadFile = File(...)):
-    result = predict_image(await file.read())
-    return {"estado": result}
+    result = await predict_image_async(await file.read())
+    if result["status"] == "error":
+        raise HTTPException(status_code=400, detail=result["message"])
+    return {"estado": result["predicted_label"].lower(), **result}
@@ -1,6 +1,39 @@
 # app/services/ai_service.py Aca se agrega la funcon que usara para el analisis de imagenes para dar estado
+# Solo clasifica: usa el mismo motor que /api/clasificar-producto (pool de intérpretes,
+# micro-batching si está activo y caché de predicciones) sin tocar el Storage ni la base de datos:
+# app.api.prediccion no conecta la persistencia al importarse (app_ia sí).
+import asyncio
 from typing import Any
 
-def predict_image(data: bytes) -> Any:
-    # TODO: lógica real de ML/IA
-    return "ok"
+from app.api.config import settings
+from app.api.lotes_ia import detener_programador, iniciar_programador
+from app.api.motor_ia import obtener_motor
+
+from app.api.prediccion import (
+    CONFIDENCE_THRESHOLD, LABELS_PATH, MODEL_PATH, calentar_modelo, predict_from_bytes, predict_from_bytes_async
+)
+
+# Clases más probables que se devuelven además de la etiqueta
+TOP_K = 3
+
+
+def predict_image(data: bytes, top_k: int = TOP_K) -> Any:
+    """Etiqueta, confianza, probabilidad de cada clase y top-k de la imagen (o {'status': 'error', ...})."""
+    return predict_from_bytes(MODEL_PATH, data, LABELS_PATH, CONFIDENCE_THRESHOLD, top_k=top_k)
+
+
+async def predict_image_async(data: bytes, top_k: int = TOP_K) -> Any:
+    """Igual que predict_image, sin bloquear el event-loop durante el preprocesamiento y la inferencia."""
+    return await predict_from_bytes_async(MODEL_PATH, data, LABELS_PATH, CONFIDENCE_THRESHOLD, top_k=top_k)
+
+
+async def iniciar_ia() -> dict:
+    """Carga y calienta el motor y arranca el micro-batching del worker (desde el lifespan)."""
+    calentamiento = await asyncio.to_thread(calentar_modelo, MODEL_PATH, LABELS_PATH, settings.IA_CALENTAMIENTO)
+    iniciar_programador(obtener_motor(MODEL_PATH, LABELS_PATH))
+    return calentamiento
+
+
+async def detener_ia():
+    """Responde o rechaza (503) las inferencias en cola antes de apagar."""
+    await detener_programador()
@@ -0,0 +1,198 @@
+# /backend/benchmarks/bench_carga.py
+"""
+Generador de carga para ``/api/clasificar-producto`` con concurrencia creciente.
+
+Por defecto levanta su propio servidor (uvicorn) con ``PERSISTENCIA=local``: la
+base de datos es un SQLite y el Storage una carpeta temporal, así que la prueba
+no toca Supabase y se puede repetir en cualquier máquina. Con ``--url`` se apunta
+a un servidor ya levantado (por ejemplo el contenedor con gunicorn_conf.py).
+
+Cada nivel de concurrencia es un ciclo cerrado: ``c`` clientes mandan un escaneo
+tras otro durante ``--duracion`` segundos. Por nivel se informa p50/p95/p99,
+requests/s, códigos de respuesta y el promedio de cada etapa según la cabecera
+``Server-Timing`` del servidor.
+
+Uso (desde backend/, con el modelo en app/api/modelo_ia/):
+
+    python benchmarks/bench_carga.py
+    python benchmarks/bench_carga.py --niveles 1,4,16,64 --duracion 20 --workers 2 --salida antes.json
+    python benchmarks/bench_carga.py --url http://localhost:8080 --binario
+    python benchmarks/comparar.py antes.json despues.json
+"""
+import argparse
+import asyncio
+import base64
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+import httpx
+
+import comun
+
+RUTA = "/api/clasificar-producto"
+
+
+def levantar_servidor(puerto: int, workers: int, directorio: str) -> subprocess.Popen:
+    """uvicorn con persistencia local en ``directorio``; la caché de predicciones queda apagada."""
+    entorno = dict(os.environ)
+    entorno.setdefault("CACHE_PREDICCIONES", "0")
+    entorno.update(
+        PERSISTENCIA="local",
+        PERSISTENCIA_LOCAL_DIR=os.path.join(directorio, "local"),
+        SUBIDA_COLA_DIR=os.path.join(directorio, "subidas"),
+        DIARIO_DIR=os.path.join(directorio, "diario"),
+    )
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api.api_server:app", "--host", "127.0.0.1", "--port", str(puerto),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=comun.APP_DIR, env=entorno, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def esperar_listo(url: str, proceso: subprocess.Popen = None, timeout_s: float = 120):
+    limite = time.monotonic() + timeout_s
+    while time.monotonic() < limite:
+        if proceso is not None and proceso.poll() is not None:
+            sys.exit(f"El servidor terminó al arrancar (código {proceso.returncode}).")
+        try:
+            if httpx.get(f"{url}/listo", timeout=2).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.5)
+    sys.exit(f"El servidor no quedó listo en {timeout_s} s ({url}/listo).")
+
+
+def _etapas(cabecera: str) -> dict:
+    """'inferencia;dur=12.3, subida;dur=4.0' -> {'inferencia': 12.3, 'subida': 4.0}"""
+    etapas = {}
+    for parte in cabecera.split(","):
+        nombre, _, resto = parte.strip().partition(";dur=")
+        try:
+            etapas[nombre] = float(resto)
+        except ValueError:
+            continue
+    return etapas
+
+
+class Carga:
+    def __init__(self, url: str, imagenes: list, productos: int, binario: bool):
+        self.url = url
+        self.imagenes = imagenes
+        self.imagenes_b64 = [base64.b64encode(i).decode() for i in imagenes]
+        self.productos = productos
+        self.binario = binario
+
+    async def escaneo(self, cliente: httpx.AsyncClient, rng: random.Random) -> tuple:
+        i = rng.randrange(len(self.imagenes))
+        codigo = f"BENCH-{rng.randrange(self.productos):05d}"
+        inicio = time.perf_counter()
+        try:
+            if self.binario:
+                r = await cliente.post(
+                    f"{self.url}{RUTA}/binario", params={"codigo_barras": codigo, "nombre": "Bench"},
+                    content=self.imagenes[i], headers={"content-type": "image/jpeg"},
+                )
+            else:
+                r = await cliente.post(
+                    f"{self.url}{RUTA}", json={"image_base64": self.imagenes_b64[i], "codigo_barras": codigo},
+                )
+            estado = r.status_code
+            if estado == 200 and r.json().get("status") != "success":
+                estado = "error_app"
+            etapas = _etapas(r.headers.get("server-timing", ""))
+        except httpx.HTTPError as e:
+            estado, etapas = type(e).__name__, {}
+        return time.perf_counter() - inicio, estado, etapas
+
+    async def nivel(self, concurrencia: int, duracion_s: float, calentamiento_s: float) -> dict:
+        latencias, codigos, etapas = [], Counter(), defaultdict(list)
+        limites = httpx.Limits(max_connections=concurrencia, max_keepalive_connections=concurrencia)
+        async with httpx.AsyncClient(limits=limites, timeout=60) as cliente:
+            inicio = time.monotonic()
+            medir_desde = inicio + calentamiento_s
+            fin = medir_desde + duracion_s
+
+            async def cliente_cerrado(semilla):
+                rng = random.Random(semilla)
+                while time.monotonic() < fin:
+                    latencia, estado, tiempos = await self.escaneo(cliente, rng)
+                    if time.monotonic() < medir_desde:
+                        continue
+                    codigos[str(estado)] += 1
+                    if estado == 200:
+                        latencias.append(latencia)
+                        for nombre, ms in tiempos.items():
+                            etapas[nombre].append(ms)
+
+            await asyncio.gather(*(cliente_cerrado(concurrencia * 1000 + c) for c in range(concurrencia)))
+            medido = time.monotonic() - medir_desde
+
+        total = sum(codigos.values())
+        return {
+            "nombre": f"carga/{'binario' if self.binario else 'base64'}/c={concurrencia}",
+            "concurrencia": concurrencia,
+            "solicitudes": total,
+            "rps": round(len(latencias) / medido, 1),
+            **comun.percentiles_ms(latencias),
+            "errores": total - len(latencias),
+            "codigos": dict(codigos),
+            "etapas_ms": {nombre: round(sum(v) / len(v), 2) for nombre, v in sorted(etapas.items())},
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="servidor ya levantado (si no, se levanta uno local)")
+    parser.add_argument("--niveles", default="1,2,4,8,16,32", help="concurrencias a medir, en orden")
+    parser.add_argument("--duracion", type=float, default=10, help="segundos medidos por nivel")
+    parser.add_argument("--calentamiento", type=float, default=2, help="segundos descartados al inicio de cada nivel")
+    parser.add_argument("--tamano", default="1280x960", help="imágenes ANCHOxALTO")
+    parser.add_argument("--imagenes", type=int, default=32, help="imágenes distintas que se rotan")
+    parser.add_argument("--productos", type=int, default=50, help="códigos de barras distintos")
+    parser.add_argument("--binario", action="store_true", help="usar /binario en vez de JSON con base64")
+    parser.add_argument("--workers", type=int, default=1, help="workers de uvicorn del servidor local")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--salida", help="archivo JSON (por defecto benchmarks/resultados/)")
+    args = parser.parse_args()
+
+    ancho, alto = (int(v) for v in args.tamano.lower().split("x"))
+    imagenes = [comun.jpeg_aleatorio(ancho, alto, semilla=i) for i in range(args.imagenes)]
+
+    proceso, directorio = None, None
+    url = args.url
+    if url is None:
+        directorio = tempfile.TemporaryDirectory(prefix="nexa_carga_")
+        url = f"http://127.0.0.1:{args.puerto}"
+        proceso = levantar_servidor(args.puerto, args.workers, directorio.name)
+    try:
+        esperar_listo(url.rstrip("/"), proceso)
+        carga = Carga(url.rstrip("/"), imagenes, args.productos, args.binario)
+        resultados = []
+        for concurrencia in (int(n) for n in args.niveles.split(",") if n):
+            resultado = asyncio.run(carga.nivel(concurrencia, args.duracion, args.calentamiento))
+            resultados.append(resultado)
+            print(f"c={concurrencia:<4} {resultado['rps']:>8} req/s  p50 {resultado['p50']} ms  "
+                  f"p95 {resultado['p95']} ms  p99 {resultado['p99']} ms  códigos {resultado['codigos']}")
+    finally:
+        if proceso is not None:
+            proceso.terminate()
+            try:
+                proceso.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proceso.kill()
+        if directorio is not None:
+            directorio.cleanup()
+
+    print()
+    comun.imprimir_tabla(resultados, ("rps", "p50", "p95", "p99", "errores"))
+    comun.guardar("carga", vars(args), resultados, args.salida)
+
+
+if __name__ == "__main__":
+    main()
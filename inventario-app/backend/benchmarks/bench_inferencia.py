@@ -0,0 +1,170 @@
+# /backend/benchmarks/bench_inferencia.py
+"""
+Microbenchmarks de la inferencia, sin red ni base de datos:
+
+1. ``preprocess_image`` / ``preprocess_image_rapido`` por tamaño de imagen.
+2. ``MotorInferencia.predecir_lote`` por hilos del intérprete y tamaño de lote.
+3. ``predict_from_bytes`` (preprocesamiento + invoke) por tamaño de imagen y
+   cantidad de hilos llamando a la vez (pool de intérpretes del servidor).
+
+La caché de predicciones se desactiva para medir siempre el camino completo.
+
+Uso (desde backend/, con el modelo en app/api/modelo_ia/ o indicado con --modelo):
+
+    python benchmarks/bench_inferencia.py
+    python benchmarks/bench_inferencia.py --tamanos 640x480,4032x3024 --lotes 1,8 --salida antes.json
+    python benchmarks/comparar.py antes.json despues.json
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import comun
+
+
+def _lista(valor: str, tipo=int) -> list:
+    return [tipo(v) for v in valor.split(",") if v]
+
+
+def _tamano(valor: str) -> tuple:
+    ancho, alto = valor.lower().split("x")
+    return int(ancho), int(alto)
+
+
+def bench_preprocesamiento(tamanos: list, repeticiones: int) -> list:
+    from api.preprocesamiento import preprocess_image, preprocess_image_rapido
+
+    resultados = []
+    for ancho, alto in tamanos:
+        imagen = comun.jpeg_aleatorio(ancho, alto, semilla=ancho * alto)
+        out = np.empty((1, 224, 224, 3), dtype=np.float32)
+        for modo, fn in (("exacto", lambda: preprocess_image(imagen)),
+                         ("rapido", lambda: preprocess_image_rapido(imagen, out=out))):
+            fn()
+            latencias = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                fn()
+                latencias.append(time.perf_counter() - inicio)
+            resultados.append({
+                "nombre": f"preproceso/{modo}/{ancho}x{alto}",
+                **comun.percentiles_ms(latencias),
+                "imagenes_s": round(len(latencias) / sum(latencias), 1),
+            })
+    return resultados
+
+
+def bench_lotes(modelo: str, etiquetas: str, hilos: list, lotes: list, repeticiones: int) -> list:
+    from api.config import settings
+    from api.motor_ia import MotorInferencia
+
+    resultados = []
+    rng = np.random.default_rng(0)
+    hilos_configurados = settings.IA_HILOS_INTERPRETE
+    for n_hilos in hilos:
+        settings.IA_HILOS_INTERPRETE = n_hilos
+        # Con lote_max = el mayor N medido cada N tiene su intérprete (sin partir el lote)
+        motor = MotorInferencia(modelo, etiquetas, tamano_pool=1, lote_max=max(lotes))
+        for n in lotes:
+            lote = rng.uniform(-1, 1, (n, 224, 224, 3)).astype(np.float32)
+            motor.predecir_lote(lote)  # crea el intérprete para N
+            latencias = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                motor.predecir_lote(lote)
+                latencias.append(time.perf_counter() - inicio)
+            resultados.append({
+                "nombre": f"lote/hilos={n_hilos}/n={n}",
+                **comun.percentiles_ms(latencias),
+                "ms_por_imagen": round(sum(latencias) * 1000 / (n * len(latencias)), 2),
+                "imagenes_s": round(n * len(latencias) / sum(latencias), 1),
+            })
+    # predict_from_bytes usa la configuración del servidor
+    settings.IA_HILOS_INTERPRETE = hilos_configurados
+    return resultados
+
+
+def bench_predict(modelo: str, etiquetas: str, tamanos: list, concurrencias: list, repeticiones: int) -> list:
+    from api.prediccion import CONFIDENCE_THRESHOLD, predict_from_bytes
+
+    resultados = []
+    for ancho, alto in tamanos:
+        # Pocas imágenes distintas por tamaño: generar fotos grandes es más lento que inferir
+        imagenes = [comun.jpeg_aleatorio(ancho, alto, semilla=i) for i in range(8)]
+        predict_from_bytes(modelo, imagenes[0], etiquetas, CONFIDENCE_THRESHOLD)
+        for concurrencia in concurrencias:
+            latencias, lock = [], threading.Lock()
+
+            def trabajador(indice):
+                for i in range(repeticiones):
+                    imagen = imagenes[(indice + i) % len(imagenes)]
+                    inicio = time.perf_counter()
+                    resultado = predict_from_bytes(modelo, imagen, etiquetas, CONFIDENCE_THRESHOLD)
+                    duracion = time.perf_counter() - inicio
+                    if resultado["status"] != "success":
+                        raise RuntimeError(resultado["message"])
+                    with lock:
+                        latencias.append(duracion)
+
+            inicio = time.perf_counter()
+            with ThreadPoolExecutor(concurrencia) as ejecutor:
+                list(ejecutor.map(trabajador, range(concurrencia)))
+            total = time.perf_counter() - inicio
+            resultados.append({
+                "nombre": f"predict/{ancho}x{alto}/concurrencia={concurrencia}",
+                **comun.percentiles_ms(latencias),
+                "imagenes_s": round(len(latencias) / total, 1),
+            })
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modelo", default=os.path.join(comun.APP_DIR, "api", "modelo_ia", "modelo_final_v3.tflite"))
+    parser.add_argument("--etiquetas", default=os.path.join(comun.APP_DIR, "api", "modelo_ia", "labels.txt"))
+    parser.add_argument("--tamanos", default="640x480,1280x960,4032x3024", help="imágenes ANCHOxALTO")
+    parser.add_argument("--hilos", default="1,2,4", help="hilos del intérprete (lotes)")
+    parser.add_argument("--lotes", default="1,2,4,8,16", help="tamaños de lote")
+    parser.add_argument("--concurrencia", default="1,2,4", help="hilos llamando a predict_from_bytes")
+    parser.add_argument("--repeticiones", type=int, default=30)
+    parser.add_argument("--salida", help="archivo JSON (por defecto benchmarks/resultados/)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.modelo):
+        sys.exit(f"Modelo no encontrado: {args.modelo}")
+    tamanos = [_tamano(t) for t in args.tamanos.split(",") if t]
+    concurrencias = _lista(args.concurrencia)
+
+    # Antes de importar api.*: sin caché, un intérprete por hilo llamador y sin Supabase
+    os.environ["CACHE_PREDICCIONES"] = "0"
+    os.environ["IA_POOL_INTERPRETES"] = str(max(concurrencias))
+    os.environ["PERSISTENCIA"] = "local"
+    os.environ.setdefault("PERSISTENCIA_LOCAL_DIR", tempfile.mkdtemp(prefix="nexa_bench_"))
+    comun.usar_backend()
+
+    resultados = []
+    print("--- PREPROCESAMIENTO ---")
+    resultados += bench_preprocesamiento(tamanos, args.repeticiones)
+    comun.imprimir_tabla(resultados, ("p50", "p95", "imagenes_s"))
+
+    print("\n--- LOTES (predecir_lote) ---")
+    lotes = bench_lotes(args.modelo, args.etiquetas, _lista(args.hilos), _lista(args.lotes), args.repeticiones)
+    comun.imprimir_tabla(lotes, ("p50", "p95", "ms_por_imagen", "imagenes_s"))
+    resultados += lotes
+
+    print("\n--- predict_from_bytes ---")
+    predict = bench_predict(args.modelo, args.etiquetas, tamanos, concurrencias, args.repeticiones)
+    comun.imprimir_tabla(predict, ("p50", "p95", "p99", "imagenes_s"))
+    resultados += predict
+
+    comun.guardar("inferencia", vars(args), resultados, args.salida)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# /backend/benchmarks/comparar.py
+"""
+Compara dos corridas de un benchmark (JSON de bench_inferencia.py o bench_carga.py).
+
+Une los resultados por ``nombre`` y muestra la variación de cada métrica. Marca
+como regresión lo que empeora más que ``--umbral`` (latencias o errores que
+suben, rps o imágenes/s que bajan) y en ese caso termina con código 1, para
+usarlo en CI.
+
+    python benchmarks/comparar.py antes.json despues.json --umbral 10
+"""
+import argparse
+import json
+import sys
+
+import comun
+
+
+def _cargar(ruta: str) -> dict:
+    with open(ruta, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def comparar(antes: dict, despues: dict, umbral_pct: float) -> list:
+    """Filas (nombre, métrica, antes, después, variación %, regresión) de los resultados en común."""
+    previos = {r["nombre"]: r for r in antes["resultados"]}
+    filas = []
+    for actual in despues["resultados"]:
+        previo = previos.get(actual["nombre"])
+        if previo is None:
+            continue
+        for metrica in comun.MENOR_ES_MEJOR + comun.MAYOR_ES_MEJOR:
+            a, d = previo.get(metrica), actual.get(metrica)
+            if a is None or d is None:
+                continue
+            variacion = (d - a) / a * 100 if a else (0.0 if d == a else float("inf"))
+            empeora = variacion if metrica in comun.MENOR_ES_MEJOR else -variacion
+            filas.append((actual["nombre"], metrica, a, d, variacion, empeora > umbral_pct))
+    return filas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("antes")
+    parser.add_argument("despues")
+    parser.add_argument("--umbral", type=float, default=10, help="%% de empeoramiento que cuenta como regresión")
+    args = parser.parse_args()
+
+    antes, despues = _cargar(args.antes), _cargar(args.despues)
+    for etiqueta, datos in (("antes", antes), ("después", despues)):
+        m = datos["metadatos"]
+        print(f"{etiqueta:<8} {m['suite']} commit {m['commit']} ({m['fecha']}, {m['nucleos']} núcleos)")
+
+    filas = comparar(antes, despues, args.umbral)
+    print(f"\n{'nombre':<44}{'métrica':>14}{'antes':>12}{'después':>12}{'var %':>10}")
+    for nombre, metrica, a, d, variacion, regresion in filas:
+        print(f"{nombre:<44}{metrica:>14}{a:>12}{d:>12}{variacion:>+10.1f}{'  <-- regresión' if regresion else ''}")
+
+    regresiones = sum(1 for fila in filas if fila[5])
+    print(f"\n{regresiones} regresiones (umbral {args.umbral}%).")
+    sys.exit(1 if regresiones else 0)
+
+
+if __name__ == "__main__":
+    main()
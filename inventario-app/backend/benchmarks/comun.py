@@ -0,0 +1,96 @@
+# /backend/benchmarks/comun.py
+"""
+Utilidades compartidas por los benchmarks: imágenes sintéticas, percentiles y
+el formato JSON de resultados.
+
+Cada resultado es un dict con ``nombre`` (clave estable entre corridas) y sus
+métricas; ``comparar.py`` une dos archivos por ``nombre``.
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCH_DIR, "..", "app")
+RESULTADOS_DIR = os.path.join(BENCH_DIR, "resultados")
+
+# Métricas que compara comparar.py y en qué sentido empeoran
+MENOR_ES_MEJOR = ("p50", "p95", "p99", "media", "ms_por_imagen", "errores")
+MAYOR_ES_MEJOR = ("rps", "imagenes_s")
+
+
+def usar_backend():
+    """Permite importar ``api.*`` como lo hace el servidor (desde backend/app)."""
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+
+
+def jpeg_aleatorio(ancho: int, alto: int, semilla: int, calidad: int = 85) -> bytes:
+    """JPEG con ruido sobre un degradado: cada semilla da otro contenido (sin aciertos de caché)."""
+    from io import BytesIO
+    from PIL import Image
+
+    rng = np.random.default_rng(semilla)
+    x = np.linspace(0, 255, ancho, dtype=np.float32)[None, :, None]
+    y = np.linspace(0, 255, alto, dtype=np.float32)[:, None, None]
+    base = np.broadcast_to((x + y) / 2, (alto, ancho, 3))
+    pixeles = np.clip(base + rng.normal(0, 24, (alto, ancho, 3)), 0, 255).astype(np.uint8)
+    salida = BytesIO()
+    Image.fromarray(pixeles).save(salida, format="JPEG", quality=calidad)
+    return salida.getvalue()
+
+
+def percentiles_ms(latencias_s: list) -> dict:
+    if not latencias_s:
+        return {"p50": None, "p95": None, "p99": None, "media": None, "max": None}
+    ms = np.asarray(latencias_s) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "p50": round(float(p50), 2), "p95": round(float(p95), 2), "p99": round(float(p99), 2),
+        "media": round(float(ms.mean()), 2), "max": round(float(ms.max()), 2),
+    }
+
+
+def _commit_git() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or "desconocido"
+    except (OSError, subprocess.SubprocessError):
+        return "desconocido"
+
+
+def metadatos(suite: str, parametros: dict) -> dict:
+    return {
+        "suite": suite,
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": _commit_git(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "nucleos": len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count(),
+        "parametros": parametros,
+    }
+
+
+def guardar(suite: str, parametros: dict, resultados: list, ruta: str = None) -> str:
+    """Escribe {metadatos, resultados} y devuelve la ruta (por defecto resultados/<suite>-<fecha>.json)."""
+    if ruta is None:
+        os.makedirs(RESULTADOS_DIR, exist_ok=True)
+        ruta = os.path.join(RESULTADOS_DIR, f"{suite}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump({"metadatos": metadatos(suite, parametros), "resultados": resultados}, f, indent=2,
+                  ensure_ascii=False)
+    print(f"\nResultados guardados en: {ruta}")
+    return ruta
+
+
+def imprimir_tabla(resultados: list, columnas: tuple):
+    print(f"{'nombre':<44}" + "".join(f"{c:>15}" for c in columnas))
+    for r in resultados:
+        valores = ("-" if r.get(c) is None else r[c] for c in columnas)
+        print(f"{r['nombre']:<44}" + "".join(f"{v:>15}" for v in valores))
@@ -0,0 +1,163 @@
+-- Registro atómico de un escaneo en una sola ida y vuelta a la base de datos.
+--
+-- Reemplaza el select + update (o insert) que hacía la API por cada escaneo.
+-- El UPDATE toma el lock de la fila, así que dos escaneos concurrentes del mismo
+-- producto se serializan y ninguno pierde su incremento.
+
+-- Necesario para el ON CONFLICT del alta de productos nuevos.
+--
+-- Antes de crearlo se verifica que no haya códigos de barras repetidos: con
+-- duplicados el CREATE UNIQUE INDEX falla, y no hay una fusión automática
+-- segura (cada fila puede tener su stock, sus imágenes y referencias). Si la
+-- verificación falla, la migración se detiene con la lista de códigos y nada
+-- queda aplicado. Para revisarlos:
+--
+--   select codigo_barras, array_agg(id order by id) as ids, sum(stock) as stock_total
+--     from public.productos
+--    where codigo_barras is not null
+--    group by codigo_barras
+--   having count(*) > 1;
+--
+-- Una forma de fusionarlos (conserva el id más bajo con la suma del stock;
+-- revisar antes las tablas que referencien a productos):
+--
+--   with grupos as (
+--       select codigo_barras, min(id) as conservar, sum(stock)::integer as stock_total
+--         from public.productos
+--        where codigo_barras is not null
+--        group by codigo_barras
+--       having count(*) > 1
+--   ), fusion as (
+--       update public.productos p
+--          set stock = g.stock_total,
+--              disponibilidad = case when g.stock_total <= 0 then 'Sin stock'
+--                                    when g.stock_total <= 4 then 'Baja disponibilidad'
+--                                    when g.stock_total <= 10 then 'Disponibilidad media'
+--                                    else 'Alta disponibilidad' end
+--         from grupos g
+--        where p.id = g.conservar
+--   )
+--   delete from public.productos p
+--    using grupos g
+--    where p.codigo_barras = g.codigo_barras and p.id <> g.conservar;
+--
+-- En una tabla grande en uso, el índice se puede crear antes a mano con
+-- "create unique index concurrently productos_codigo_barras_key on public.productos (codigo_barras);"
+-- (fuera de una transacción) para no bloquear las escrituras; esta migración lo
+-- encuentra y sigue.
+do $$
+declare
+    v_duplicados text;
+begin
+    select string_agg(format('%s (%s filas)', codigo_barras, n), ', ')
+      into v_duplicados
+      from (
+        select codigo_barras, count(*) as n
+          from public.productos
+         where codigo_barras is not null
+         group by codigo_barras
+        having count(*) > 1
+         order by codigo_barras
+         limit 20
+      ) d;
+    if v_duplicados is not null then
+        raise exception 'productos tiene códigos de barras repetidos: %', v_duplicados
+            using hint = 'Fusionarlos antes de crear productos_codigo_barras_key (ver el comentario de esta migración).';
+    end if;
+end
+$$;
+
+create unique index if not exists productos_codigo_barras_key
+    on public.productos (codigo_barras);
+
+-- Mismos umbrales que get_disponibilidad() en backend/app/api/app_ia.py
+create or replace function public.get_disponibilidad(cantidad integer)
+returns text
+language sql
+immutable
+as $$
+    select case
+        when cantidad <= 0 then 'Sin stock'
+        when cantidad <= 4 then 'Baja disponibilidad'
+        when cantidad <= 10 then 'Disponibilidad media'
+        else 'Alta disponibilidad'
+    end
+$$;
+
+create or replace function public.registrar_escaneo(
+    p_codigo_barras text,
+    p_nombre text default null,
+    p_marca text default null,
+    p_modelo text default null,
+    p_categoria_id integer default null,
+    p_compatibilidad text default null,
+    p_observaciones text default null,
+    p_estado text default null,
+    p_imagen_url text default null
+)
+returns table (producto_id bigint, stock integer, disponibilidad text, coincidencia text)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+    v_ahora timestamptz := now();
+begin
+    -- 1) Coincidencia por código de barras
+    return query
+    update public.productos p
+       set stock = p.stock + 1,
+           disponibilidad = public.get_disponibilidad(p.stock + 1),
+           estado = p_estado,
+           updated_at = v_ahora,
+           imagen_url = coalesce(p_imagen_url, p.imagen_url)
+     where p.codigo_barras = p_codigo_barras
+    returning p.id::bigint, p.stock, p.disponibilidad, 'código de barras'::text;
+    if found then
+        return;
+    end if;
+
+    -- 2) Coincidencia por nombre + marca + modelo
+    return query
+    update public.productos p
+       set stock = p.stock + 1,
+           disponibilidad = public.get_disponibilidad(p.stock + 1),
+           estado = p_estado,
+           updated_at = v_ahora,
+           imagen_url = coalesce(p_imagen_url, p.imagen_url)
+     where p.id = (
+        select q.id
+          from public.productos q
+         where q.nombre = p_nombre and q.marca = p_marca and q.modelo = p_modelo
+         order by q.id
+         limit 1
+           for update
+     )
+    returning p.id::bigint, p.stock, p.disponibilidad, 'nombre/marca/modelo'::text;
+    if found then
+        return;
+    end if;
+
+    -- 3) Producto nuevo. Si otro escaneo concurrente lo insertó entre medio,
+    --    el ON CONFLICT lo convierte en un incremento.
+    return query
+    insert into public.productos as p (
+        codigo_barras, nombre, marca, modelo, compatibilidad, categoria_id, observaciones,
+        stock, estado, disponibilidad, created_at, updated_at, imagen_url
+    )
+    values (
+        p_codigo_barras, p_nombre, p_marca, p_modelo, p_compatibilidad, p_categoria_id, p_observaciones,
+        1, p_estado, public.get_disponibilidad(1), v_ahora, v_ahora, p_imagen_url
+    )
+    on conflict (codigo_barras) do update
+       set stock = p.stock + 1,
+           disponibilidad = public.get_disponibilidad(p.stock + 1),
+           estado = excluded.estado,
+           updated_at = excluded.updated_at,
+           imagen_url = coalesce(excluded.imagen_url, p.imagen_url)
+    returning p.id::bigint, p.stock, p.disponibilidad,
+              case when p.xmax = 0 then 'nuevo' else 'código de barras' end;
+end;
+$$;
+
+grant execute on function public.registrar_escaneo(text, text, text, text, integer, text, text, text, text)
+    to anon, authenticated;
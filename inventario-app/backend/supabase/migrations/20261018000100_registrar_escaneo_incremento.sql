@@ -0,0 +1,86 @@
+-- registrar_escaneo con incremento variable.
+--
+-- La API puede agrupar varios escaneos seguidos del mismo código de barras en
+-- una sola escritura (stock += n). El parámetro nuevo va al final y con valor
+-- por defecto 1, así que las llamadas existentes siguen funcionando igual.
+
+drop function if exists public.registrar_escaneo(text, text, text, text, integer, text, text, text, text);
+
+create function public.registrar_escaneo(
+    p_codigo_barras text,
+    p_nombre text default null,
+    p_marca text default null,
+    p_modelo text default null,
+    p_categoria_id integer default null,
+    p_compatibilidad text default null,
+    p_observaciones text default null,
+    p_estado text default null,
+    p_imagen_url text default null,
+    p_incremento integer default 1
+)
+returns table (producto_id bigint, stock integer, disponibilidad text, coincidencia text)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+    v_ahora timestamptz := now();
+begin
+    -- 1) Coincidencia por código de barras
+    return query
+    update public.productos p
+       set stock = p.stock + p_incremento,
+           disponibilidad = public.get_disponibilidad(p.stock + p_incremento),
+           estado = p_estado,
+           updated_at = v_ahora,
+           imagen_url = coalesce(p_imagen_url, p.imagen_url)
+     where p.codigo_barras = p_codigo_barras
+    returning p.id::bigint, p.stock, p.disponibilidad, 'código de barras'::text;
+    if found then
+        return;
+    end if;
+
+    -- 2) Coincidencia por nombre + marca + modelo
+    return query
+    update public.productos p
+       set stock = p.stock + p_incremento,
+           disponibilidad = public.get_disponibilidad(p.stock + p_incremento),
+           estado = p_estado,
+           updated_at = v_ahora,
+           imagen_url = coalesce(p_imagen_url, p.imagen_url)
+     where p.id = (
+        select q.id
+          from public.productos q
+         where q.nombre = p_nombre and q.marca = p_marca and q.modelo = p_modelo
+         order by q.id
+         limit 1
+           for update
+     )
+    returning p.id::bigint, p.stock, p.disponibilidad, 'nombre/marca/modelo'::text;
+    if found then
+        return;
+    end if;
+
+    -- 3) Producto nuevo. Si otro escaneo concurrente lo insertó entre medio,
+    --    el ON CONFLICT lo convierte en un incremento.
+    return query
+    insert into public.productos as p (
+        codigo_barras, nombre, marca, modelo, compatibilidad, categoria_id, observaciones,
+        stock, estado, disponibilidad, created_at, updated_at, imagen_url
+    )
+    values (
+        p_codigo_barras, p_nombre, p_marca, p_modelo, p_compatibilidad, p_categoria_id, p_observaciones,
+        p_incremento, p_estado, public.get_disponibilidad(p_incremento), v_ahora, v_ahora, p_imagen_url
+    )
+    on conflict (codigo_barras) do update
+       set stock = p.stock + p_incremento,
+           disponibilidad = public.get_disponibilidad(p.stock + p_incremento),
+           estado = excluded.estado,
+           updated_at = excluded.updated_at,
+           imagen_url = coalesce(excluded.imagen_url, p.imagen_url)
+    returning p.id::bigint, p.stock, p.disponibilidad,
+              case when p.xmax = 0 then 'nuevo' else 'código de barras' end;
+end;
+$$;
+
+grant execute on function public.registrar_escaneo(text, text, text, text, integer, text, text, text, text, integer)
+    to anon, authenticated;
@@ -0,0 +1,113 @@
+-- Miniatura de la imagen del producto.
+--
+-- La API sube una vista comprimida (imagen_url) y una miniatura para tablas y
+-- reportes en vez de la foto original de la cámara. registrar_escaneo recibe la
+-- URL de la miniatura y, como con imagen_url, conserva la anterior si llega null.
+
+alter table public.productos
+    add column if not exists imagen_miniatura_url text;
+
+drop function if exists public.registrar_escaneo(text, text, text, text, integer, text, text, text, text, integer, bigint);
+
+create function public.registrar_escaneo(
+    p_codigo_barras text,
+    p_nombre text default null,
+    p_marca text default null,
+    p_modelo text default null,
+    p_categoria_id integer default null,
+    p_compatibilidad text default null,
+    p_observaciones text default null,
+    p_estado text default null,
+    p_imagen_url text default null,
+    p_incremento integer default 1,
+    p_producto_id bigint default null,
+    p_imagen_miniatura_url text default null
+)
+returns table (producto_id bigint, stock integer, disponibilidad text, coincidencia text)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+    v_ahora timestamptz := now();
+begin
+    -- 0) Producto ya resuelto por el índice en memoria de la API: update por PK.
+    --    Si ya no existe, se sigue con la búsqueda normal.
+    if p_producto_id is not null then
+        return query
+        update public.productos p
+           set stock = p.stock + p_incremento,
+               disponibilidad = public.get_disponibilidad(p.stock + p_incremento),
+               estado = p_estado,
+               updated_at = v_ahora,
+               imagen_url = coalesce(p_imagen_url, p.imagen_url),
+               imagen_miniatura_url = coalesce(p_imagen_miniatura_url, p.imagen_miniatura_url)
+         where p.id = p_producto_id
+        returning p.id::bigint, p.stock, p.disponibilidad, 'producto_id'::text;
+        if found then
+            return;
+        end if;
+    end if;
+
+    -- 1) Coincidencia por código de barras
+    return query
+    update public.productos p
+       set stock = p.stock + p_incremento,
+           disponibilidad = public.get_disponibilidad(p.stock + p_incremento),
+           estado = p_estado,
+           updated_at = v_ahora,
+           imagen_url = coalesce(p_imagen_url, p.imagen_url),
+           imagen_miniatura_url = coalesce(p_imagen_miniatura_url, p.imagen_miniatura_url)
+     where p.codigo_barras = p_codigo_barras
+    returning p.id::bigint, p.stock, p.disponibilidad, 'código de barras'::text;
+    if found then
+        return;
+    end if;
+
+    -- 2) Coincidencia por nombre + marca + modelo
+    return query
+    update public.productos p
+       set stock = p.stock + p_incremento,
+           disponibilidad = public.get_disponibilidad(p.stock + p_incremento),
+           estado = p_estado,
+           updated_at = v_ahora,
+           imagen_url = coalesce(p_imagen_url, p.imagen_url),
+           imagen_miniatura_url = coalesce(p_imagen_miniatura_url, p.imagen_miniatura_url)
+     where p.id = (
+        select q.id
+          from public.productos q
+         where q.nombre = p_nombre and q.marca = p_marca and q.modelo = p_modelo
+         order by q.id
+         limit 1
+           for update
+     )
+    returning p.id::bigint, p.stock, p.disponibilidad, 'nombre/marca/modelo'::text;
+    if found then
+        return;
+    end if;
+
+    -- 3) Producto nuevo. Si otro escaneo concurrente lo insertó entre medio,
+    --    el ON CONFLICT lo convierte en un incremento.
+    return query
+    insert into public.productos as p (
+        codigo_barras, nombre, marca, modelo, compatibilidad, categoria_id, observaciones,
+        stock, estado, disponibilidad, created_at, updated_at, imagen_url, imagen_miniatura_url
+    )
+    values (
+        p_codigo_barras, p_nombre, p_marca, p_modelo, p_compatibilidad, p_categoria_id, p_observaciones,
+        p_incremento, p_estado, public.get_disponibilidad(p_incremento), v_ahora, v_ahora,
+        p_imagen_url, p_imagen_miniatura_url
+    )
+    on conflict (codigo_barras) do update
+       set stock = p.stock + p_incremento,
+           disponibilidad = public.get_disponibilidad(p.stock + p_incremento),
+           estado = excluded.estado,
+           updated_at = excluded.updated_at,
+           imagen_url = coalesce(excluded.imagen_url, p.imagen_url),
+           imagen_miniatura_url = coalesce(excluded.imagen_miniatura_url, p.imagen_miniatura_url)
+    returning p.id::bigint, p.stock, p.disponibilidad,
+              case when p.xmax = 0 then 'nuevo' else 'código de barras' end;
+end;
+$$;
+
+grant execute on function public.registrar_escaneo(text, text, text, text, integer, text, text, text, text, integer, bigint, text)
+    to anon, authenticated;
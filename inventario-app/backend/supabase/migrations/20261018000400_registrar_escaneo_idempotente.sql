@@ -0,0 +1,136 @@
+-- Escaneos idempotentes para el diario offline.
+--
+-- Durante un corte de Supabase la API guarda los escaneos en un diario local y
+-- los reaplica al volver la conexión. Un timeout no dice si la llamada llegó a
+-- aplicarse, así que cada escaneo lleva un uuid: registrar_escaneo recibe los
+-- ids del lote y solo suma al stock los que no estaban registrados.
+--
+-- escaneos_registrados solo sirve para deduplicar reintentos; se puede podar lo
+-- que tenga más de unos días (delete ... where creado < now() - interval '7 days').
+
+create table if not exists public.escaneos_registrados (
+    id uuid primary key,
+    creado timestamptz not null default now()
+);
+
+drop function if exists public.registrar_escaneo(text, text, text, text, integer, text, text, text, text, integer, bigint, text);
+
+create function public.registrar_escaneo(
+    p_codigo_barras text,
+    p_nombre text default null,
+    p_marca text default null,
+    p_modelo text default null,
+    p_categoria_id integer default null,
+    p_compatibilidad text default null,
+    p_observaciones text default null,
+    p_estado text default null,
+    p_imagen_url text default null,
+    p_incremento integer default 1,
+    p_producto_id bigint default null,
+    p_imagen_miniatura_url text default null,
+    p_escaneo_ids uuid[] default null
+)
+returns table (producto_id bigint, stock integer, disponibilidad text, coincidencia text)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+    v_ahora timestamptz := now();
+    v_incremento integer := p_incremento;
+begin
+    -- Escaneos con id (diario offline): solo suman los que no se aplicaron antes.
+    -- Si todos ya estaban, v_incremento queda en 0 y solo se actualizan estado e imagen.
+    if p_escaneo_ids is not null then
+        with nuevos as (
+            insert into public.escaneos_registrados (id)
+            select unnest(p_escaneo_ids)
+            on conflict (id) do nothing
+            returning 1
+        )
+        select count(*) into v_incremento from nuevos;
+    end if;
+
+    -- 0) Producto ya resuelto por el índice en memoria de la API: update por PK.
+    --    Si ya no existe, se sigue con la búsqueda normal.
+    if p_producto_id is not null then
+        return query
+        update public.productos p
+           set stock = p.stock + v_incremento,
+               disponibilidad = public.get_disponibilidad(p.stock + v_incremento),
+               estado = p_estado,
+               updated_at = v_ahora,
+               imagen_url = coalesce(p_imagen_url, p.imagen_url),
+               imagen_miniatura_url = coalesce(p_imagen_miniatura_url, p.imagen_miniatura_url)
+         where p.id = p_producto_id
+        returning p.id::bigint, p.stock, p.disponibilidad, 'producto_id'::text;
+        if found then
+            return;
+        end if;
+    end if;
+
+    -- 1) Coincidencia por código de barras
+    return query
+    update public.productos p
+       set stock = p.stock + v_incremento,
+           disponibilidad = public.get_disponibilidad(p.stock + v_incremento),
+           estado = p_estado,
+           updated_at = v_ahora,
+           imagen_url = coalesce(p_imagen_url, p.imagen_url),
+           imagen_miniatura_url = coalesce(p_imagen_miniatura_url, p.imagen_miniatura_url)
+     where p.codigo_barras = p_codigo_barras
+    returning p.id::bigint, p.stock, p.disponibilidad, 'código de barras'::text;
+    if found then
+        return;
+    end if;
+
+    -- 2) Coincidencia por nombre + marca + modelo
+    return query
+    update public.productos p
+       set stock = p.stock + v_incremento,
+           disponibilidad = public.get_disponibilidad(p.stock + v_incremento),
+           estado = p_estado,
+           updated_at = v_ahora,
+           imagen_url = coalesce(p_imagen_url, p.imagen_url),
+           imagen_miniatura_url = coalesce(p_imagen_miniatura_url, p.imagen_miniatura_url)
+     where p.id = (
+        select q.id
+          from public.productos q
+         where q.nombre = p_nombre and q.marca = p_marca and q.modelo = p_modelo
+         order by q.id
+         limit 1
+           for update
+     )
+    returning p.id::bigint, p.stock, p.disponibilidad, 'nombre/marca/modelo'::text;
+    if found then
+        return;
+    end if;
+
+    -- 3) Producto nuevo. Si otro escaneo concurrente lo insertó entre medio,
+    --    el ON CONFLICT lo convierte en un incremento.
+    return query
+    insert into public.productos as p (
+        codigo_barras, nombre, marca, modelo, compatibilidad, categoria_id, observaciones,
+        stock, estado, disponibilidad, created_at, updated_at, imagen_url, imagen_miniatura_url
+    )
+    values (
+        p_codigo_barras, p_nombre, p_marca, p_modelo, p_compatibilidad, p_categoria_id, p_observaciones,
+        v_incremento, p_estado, public.get_disponibilidad(v_incremento), v_ahora, v_ahora,
+        p_imagen_url, p_imagen_miniatura_url
+    )
+    on conflict (codigo_barras) do update
+       set stock = p.stock + v_incremento,
+           disponibilidad = public.get_disponibilidad(p.stock + v_incremento),
+           estado = excluded.estado,
+           updated_at = excluded.updated_at,
+           imagen_url = coalesce(excluded.imagen_url, p.imagen_url),
+           imagen_miniatura_url = coalesce(excluded.imagen_miniatura_url, p.imagen_miniatura_url)
+    returning p.id::bigint, p.stock, p.disponibilidad,
+              case when p.xmax = 0 then 'nuevo' else 'código de barras' end;
+end;
+$$;
+
+grant execute on function public.registrar_escaneo(text, text, text, text, integer, text, text, text, text, integer, bigint, text, uuid[])
+    to anon, authenticated;
+
+-- ON CONFLICT necesita select además de insert
+grant select, insert on public.escaneos_registrados to anon, authenticated;
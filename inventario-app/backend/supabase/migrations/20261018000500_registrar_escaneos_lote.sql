@@ -0,0 +1,145 @@
+-- Registro de escaneos en lote.
+--
+-- Una toma de inventario registra cientos de productos. En vez de una llamada a
+-- registrar_escaneo por escaneo, la API manda el lote entero y esta función lo
+-- aplica con unas pocas sentencias sobre todo el conjunto:
+--
+--   1. los ids de escaneo ya aplicados no vuelven a sumar (como en registrar_escaneo);
+--   2. cada escaneo se resuelve a un producto: id que mandó la API, código de
+--      barras o nombre + marca + modelo, en ese orden;
+--   3. un solo UPDATE suma los escaneos de cada producto existente;
+--   4. un solo INSERT ... ON CONFLICT da de alta los productos nuevos (los
+--      escaneos repetidos de un mismo código nuevo se suman en la misma fila).
+--
+-- p_escaneos es un arreglo JSON con los mismos campos que los parámetros de
+-- registrar_escaneo sin el prefijo "p_". Devuelve una fila por escaneo con su
+-- posición en el arreglo (indice) y el stock del producto después del lote.
+-- Si una sentencia falla no se aplica nada: la API reintenta los escaneos uno por uno.
+
+create function public.registrar_escaneos_lote(p_escaneos jsonb)
+returns table (indice integer, producto_id bigint, stock integer, disponibilidad text, coincidencia text)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+    v_ahora timestamptz := now();
+begin
+    drop table if exists pg_temp.escaneos_lote;
+    create temporary table escaneos_lote on commit drop as
+    select (e.orden - 1)::integer as indice,
+           x.codigo_barras, x.nombre, x.marca, x.modelo, x.categoria_id, x.compatibilidad,
+           x.observaciones, x.estado, x.imagen_url, x.imagen_miniatura_url, x.producto_id, x.escaneo_ids,
+           coalesce(x.incremento, 1) as incremento,
+           null::bigint as destino,
+           null::text as coincidencia
+      from jsonb_array_elements(p_escaneos) with ordinality as e(valor, orden),
+           jsonb_to_record(e.valor) as x(
+               codigo_barras text, nombre text, marca text, modelo text, categoria_id integer,
+               compatibilidad text, observaciones text, estado text, imagen_url text,
+               imagen_miniatura_url text, incremento integer, producto_id bigint, escaneo_ids uuid[]
+           );
+
+    -- 1) Escaneos con id: solo suman los que no se aplicaron antes
+    with nuevos as (
+        insert into public.escaneos_registrados (id)
+        select distinct unnest(l.escaneo_ids) from escaneos_lote l where l.escaneo_ids is not null
+        on conflict (id) do nothing
+        returning id
+    )
+    update escaneos_lote l
+       set incremento = (select count(*) from nuevos n where n.id = any(l.escaneo_ids))
+     where l.escaneo_ids is not null;
+
+    -- 2) Resolución: id de la API, código de barras, nombre + marca + modelo
+    update escaneos_lote l
+       set destino = p.id, coincidencia = 'producto_id'
+      from public.productos p
+     where p.id = l.producto_id;
+
+    update escaneos_lote l
+       set destino = p.id, coincidencia = 'código de barras'
+      from public.productos p
+     where l.destino is null and p.codigo_barras = l.codigo_barras;
+
+    update escaneos_lote l
+       set destino = m.id, coincidencia = 'nombre/marca/modelo'
+      from (
+        select distinct on (q.nombre, q.marca, q.modelo) q.id, q.nombre, q.marca, q.modelo
+          from public.productos q
+         where (q.nombre, q.marca, q.modelo) in (
+                select b.nombre, b.marca, b.modelo from escaneos_lote b where b.destino is null
+               )
+         order by q.nombre, q.marca, q.modelo, q.id
+      ) m
+     where l.destino is null and m.nombre = l.nombre and m.marca = l.marca and m.modelo = l.modelo;
+
+    -- 3) Productos existentes: un UPDATE con la suma de sus escaneos.
+    --    Estado e imágenes quedan los del último escaneo del lote que los trae.
+    update public.productos p
+       set stock = p.stock + a.incremento,
+           disponibilidad = public.get_disponibilidad(p.stock + a.incremento),
+           estado = a.estado,
+           updated_at = v_ahora,
+           imagen_url = coalesce(a.imagen_url, p.imagen_url),
+           imagen_miniatura_url = coalesce(a.imagen_miniatura_url, p.imagen_miniatura_url)
+      from (
+        select l.destino,
+               sum(l.incremento)::integer as incremento,
+               (array_agg(l.estado order by l.indice desc))[1] as estado,
+               (array_agg(l.imagen_url order by l.indice desc) filter (where l.imagen_url is not null))[1] as imagen_url,
+               (array_agg(l.imagen_miniatura_url order by l.indice desc)
+                    filter (where l.imagen_miniatura_url is not null))[1] as imagen_miniatura_url
+          from escaneos_lote l
+         where l.destino is not null
+         group by l.destino
+      ) a
+     where p.id = a.destino;
+
+    -- 4) Productos nuevos: un INSERT por código de barras con la suma de sus escaneos.
+    --    Los datos del producto son los del primer escaneo; si otro registro
+    --    concurrente lo insertó entre medio, el ON CONFLICT lo convierte en un incremento.
+    with altas as (
+        insert into public.productos as p (
+            codigo_barras, nombre, marca, modelo, compatibilidad, categoria_id, observaciones,
+            stock, estado, disponibilidad, created_at, updated_at, imagen_url, imagen_miniatura_url
+        )
+        select l.codigo_barras,
+               (array_agg(l.nombre order by l.indice))[1],
+               (array_agg(l.marca order by l.indice))[1],
+               (array_agg(l.modelo order by l.indice))[1],
+               (array_agg(l.compatibilidad order by l.indice))[1],
+               (array_agg(l.categoria_id order by l.indice))[1],
+               (array_agg(l.observaciones order by l.indice))[1],
+               sum(l.incremento)::integer,
+               (array_agg(l.estado order by l.indice desc))[1],
+               public.get_disponibilidad(sum(l.incremento)::integer),
+               v_ahora, v_ahora,
+               (array_agg(l.imagen_url order by l.indice desc) filter (where l.imagen_url is not null))[1],
+               (array_agg(l.imagen_miniatura_url order by l.indice desc)
+                    filter (where l.imagen_miniatura_url is not null))[1]
+          from escaneos_lote l
+         where l.destino is null
+         group by l.codigo_barras
+        on conflict (codigo_barras) do update
+           set stock = p.stock + excluded.stock,
+               disponibilidad = public.get_disponibilidad(p.stock + excluded.stock),
+               estado = excluded.estado,
+               updated_at = excluded.updated_at,
+               imagen_url = coalesce(excluded.imagen_url, p.imagen_url),
+               imagen_miniatura_url = coalesce(excluded.imagen_miniatura_url, p.imagen_miniatura_url)
+        returning p.id, p.codigo_barras, (p.xmax = 0) as es_nuevo
+    )
+    update escaneos_lote l
+       set destino = a.id, coincidencia = case when a.es_nuevo then 'nuevo' else 'código de barras' end
+      from altas a
+     where l.destino is null and l.codigo_barras = a.codigo_barras;
+
+    return query
+    select l.indice, p.id::bigint, p.stock, p.disponibilidad, l.coincidencia
+      from escaneos_lote l
+      join public.productos p on p.id = l.destino
+     order by l.indice;
+end;
+$$;
+
+grant execute on function public.registrar_escaneos_lote(jsonb) to anon, authenticated;
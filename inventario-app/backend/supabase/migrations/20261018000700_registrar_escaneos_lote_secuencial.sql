@@ -0,0 +1,150 @@
+-- registrar_escaneos_lote con el mismo resultado que registrar_escaneo uno por uno.
+--
+-- La versión anterior resolvía todo el lote contra la tabla tal como estaba al
+-- empezar, y así se apartaba de aplicar los escaneos en orden:
+--
+--   - dos escaneos nuevos con el mismo nombre/marca/modelo y distinto código
+--     daban de alta dos productos (en orden, el segundo coincide por nombre con
+--     el que dio de alta el primero);
+--   - un escaneo_id repetido dentro del lote sumaba una vez por cada escaneo;
+--   - todos los escaneos de un código nuevo informaban 'nuevo', no solo el primero;
+--   - el id del índice se usaba sin comprobar el código (ver 20261018000600).
+--
+-- Ahora:
+--
+--   1. cada escaneo_id suma solo en el primer escaneo del lote que lo trae, y
+--      solo si no se aplicó antes;
+--   2. un solo UPDATE ... FROM resuelve por código de barras contra los
+--      productos existentes (el código es único: las altas del lote no lo cambian);
+--   3. el resto se recorre en orden: código de barras (dado de alta antes en el
+--      lote), id del índice si sigue coincidiendo el nombre/marca/modelo,
+--      búsqueda por nombre/marca/modelo y, si nada coincide, alta con stock 0;
+--   4. un solo UPDATE suma los escaneos de cada producto, existente o nuevo.
+--
+-- Solo los escaneos de productos que no existían al empezar pasan por el paso 3.
+
+create or replace function public.registrar_escaneos_lote(p_escaneos jsonb)
+returns table (indice integer, producto_id bigint, stock integer, disponibilidad text, coincidencia text)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+    v_ahora timestamptz := now();
+    v_escaneo record;
+    v_id bigint;
+    v_coincidencia text;
+begin
+    drop table if exists pg_temp.escaneos_lote;
+    create temporary table escaneos_lote on commit drop as
+    select (e.orden - 1)::integer as indice,
+           x.codigo_barras, x.nombre, x.marca, x.modelo, x.categoria_id, x.compatibilidad,
+           x.observaciones, x.estado, x.imagen_url, x.imagen_miniatura_url, x.producto_id, x.escaneo_ids,
+           coalesce(x.incremento, 1) as incremento,
+           null::bigint as destino,
+           null::text as coincidencia
+      from jsonb_array_elements(p_escaneos) with ordinality as e(valor, orden),
+           jsonb_to_record(e.valor) as x(
+               codigo_barras text, nombre text, marca text, modelo text, categoria_id integer,
+               compatibilidad text, observaciones text, estado text, imagen_url text,
+               imagen_miniatura_url text, incremento integer, producto_id bigint, escaneo_ids uuid[]
+           );
+
+    -- 1) Escaneos con id: cada id cuenta en el primer escaneo del lote que lo trae,
+    --    y solo si no se aplicó antes
+    with ids as (
+        select distinct on (u.id) u.id, l.indice
+          from escaneos_lote l, unnest(l.escaneo_ids) as u(id)
+         order by u.id, l.indice
+    ),
+    nuevos as (
+        insert into public.escaneos_registrados (id)
+        select ids.id from ids
+        on conflict (id) do nothing
+        returning id
+    )
+    update escaneos_lote l
+       set incremento = (select count(*) from nuevos n join ids i on i.id = n.id where i.indice = l.indice)
+     where l.escaneo_ids is not null;
+
+    -- 2) Código de barras de un producto existente
+    update escaneos_lote l
+       set destino = p.id, coincidencia = 'código de barras'
+      from public.productos p
+     where p.codigo_barras = l.codigo_barras;
+
+    -- 3) El resto, en orden: cada escaneo ve las altas de los anteriores
+    for v_escaneo in
+        select * from escaneos_lote l where l.destino is null order by l.indice
+    loop
+        v_coincidencia := 'código de barras';
+        select p.id into v_id from public.productos p where p.codigo_barras = v_escaneo.codigo_barras;
+
+        if v_id is null then
+            v_coincidencia := 'nombre/marca/modelo';
+            select p.id into v_id
+              from public.productos p
+             where p.id = v_escaneo.producto_id
+               and p.nombre = v_escaneo.nombre and p.marca = v_escaneo.marca and p.modelo = v_escaneo.modelo;
+        end if;
+
+        if v_id is null then
+            select q.id into v_id
+              from public.productos q
+             where q.nombre = v_escaneo.nombre and q.marca = v_escaneo.marca and q.modelo = v_escaneo.modelo
+             order by q.id
+             limit 1;
+        end if;
+
+        -- Alta con stock 0: el paso 4 suma este escaneo y los siguientes del mismo
+        -- producto. Si otro registro concurrente lo insertó entre medio, el ON
+        -- CONFLICT devuelve esa fila y el escaneo cuenta como coincidencia por código.
+        if v_id is null then
+            insert into public.productos as p (
+                codigo_barras, nombre, marca, modelo, compatibilidad, categoria_id, observaciones,
+                stock, estado, disponibilidad, created_at, updated_at, imagen_url, imagen_miniatura_url
+            )
+            values (
+                v_escaneo.codigo_barras, v_escaneo.nombre, v_escaneo.marca, v_escaneo.modelo,
+                v_escaneo.compatibilidad, v_escaneo.categoria_id, v_escaneo.observaciones,
+                0, v_escaneo.estado, public.get_disponibilidad(0), v_ahora, v_ahora,
+                v_escaneo.imagen_url, v_escaneo.imagen_miniatura_url
+            )
+            on conflict (codigo_barras) do update
+               set updated_at = excluded.updated_at
+            returning p.id, case when p.xmax = 0 then 'nuevo' else 'código de barras' end
+                 into v_id, v_coincidencia;
+        end if;
+
+        update escaneos_lote l
+           set destino = v_id, coincidencia = v_coincidencia
+         where l.indice = v_escaneo.indice;
+    end loop;
+
+    -- 4) Un UPDATE con la suma de los escaneos de cada producto.
+    --    Estado e imágenes quedan los del último escaneo del lote que los trae.
+    update public.productos p
+       set stock = p.stock + a.incremento,
+           disponibilidad = public.get_disponibilidad(p.stock + a.incremento),
+           estado = a.estado,
+           updated_at = v_ahora,
+           imagen_url = coalesce(a.imagen_url, p.imagen_url),
+           imagen_miniatura_url = coalesce(a.imagen_miniatura_url, p.imagen_miniatura_url)
+      from (
+        select l.destino,
+               sum(l.incremento)::integer as incremento,
+               (array_agg(l.estado order by l.indice desc))[1] as estado,
+               (array_agg(l.imagen_url order by l.indice desc) filter (where l.imagen_url is not null))[1] as imagen_url,
+               (array_agg(l.imagen_miniatura_url order by l.indice desc)
+                    filter (where l.imagen_miniatura_url is not null))[1] as imagen_miniatura_url
+          from escaneos_lote l
+         group by l.destino
+      ) a
+     where p.id = a.destino;
+
+    return query
+    select l.indice, p.id::bigint, p.stock, p.disponibilidad, l.coincidencia
+      from escaneos_lote l
+      join public.productos p on p.id = l.destino
+     order by l.indice;
+end;
+$$;